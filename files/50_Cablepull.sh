@@ -66,6 +66,36 @@ keepFiles () {
     fi
 }
 
+# Polatis lock of the ports of this run: with POLATIS_LEASE_SERVER set (host:port of
+# lease_ports.py serve) only the ports are leased, so runs on other ports of the
+# switch go on at the same time, the lease expires if this script dies.
+# Returns 0 when locked, 1 when another run holds the ports and 2 when the lease
+# server failed
+polatisLock () {
+    if [[ -n $POLATIS_LEASE_SERVER ]]; then
+        POLATIS_LEASE=$(python2 ./cablepull/polatis/lease_ports.py acquire --switch ${SWITCH} --ports ${PORTS} \
+            --owner $(hostname):$$ --wait $etime --parent $$)
+    else
+        concurrent::createLock -r autotest@bistro -e $etime /tmp/$lockdir || return 1
+    fi
+}
+
+polatisUnlock () {
+    if [[ -n $POLATIS_LEASE_SERVER ]]; then
+        python2 ./cablepull/polatis/lease_ports.py release --lease ${POLATIS_LEASE}
+    else
+        concurrent::releaseLock -r autotest@bistro /tmp/$lockdir
+    fi
+}
+
+polatisWaitForUnlock () {
+    if [[ -n $POLATIS_LEASE_SERVER ]]; then
+        python2 ./cablepull/polatis/lease_ports.py list --switch ${SWITCH}
+    else
+        concurrent::waitForUnlock -r autotest@bistro /tmp/$lockdir --retry-count 11111111 # more than 12 days
+    fi
+}
+
 # end of function section
 
 usage()
@@ -77,6 +107,10 @@ usage()
   echo " -n    number of port off/on cycles"
   echo " -toff time for port off in sec or random (between 10 and 120 sec)"
   echo " -ton  time for port on in sec or random (between 30 and 120 sec)"
+  echo " -m    Polatis mode: patch (default), flap for off/on times kept by the switch"
+  echo "       or concurrent for all ports on their own timeline at the same time"
+  echo " -maxdark  concurrent mode: number of ports switched off at the same time (default 1)"
+  echo " -paths    concurrent mode: port groups never switched off together; eg: \"12,13 40,41\""
 }
 
 while [[ $# > 1 ]]
@@ -90,6 +124,9 @@ opt=$1
         -n)    CYCLES="$2";;
         -toff) TIME_OFF="$2";;
         -ton)  TIME_ON="$2";;
+        -m)    MODE="$2";;
+        -maxdark) MAX_DARK="$2";;
+        -paths) PATHS="$2";;
         -h)    usage
                exit
                ;;
@@ -107,6 +144,7 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
     echo " -n    number of port off/on cycles = $CYCLES"
     echo " -toff time for port off in sec     = $TIME_OFF"
     echo " -ton  time for port on in sec      = $TIME_ON"
+    echo " -m    Polatis mode                 = ${MODE:-patch}"
     echo ""
 
 
@@ -175,6 +213,8 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
             #call checkDASDpath_status function to check if one of chpids is crashed or not before start of execution DASD_cablepull_fio cycles
             checkDASDpath_status
 
+            # how long multipath takes to fail the paths and to reinstate them in every cycle
+            startFailoverMonitor
             Z=0
             while [ $Z -lt $CYCLES ]; do
                 Z=$[Z+1]
@@ -199,6 +239,7 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
                         concurrent::releaseLock -r autotest@bistro /tmp/$lockdir
                         assert_fail $rc 0 "Exiting here..."
                     fi
+                    failoverMark off "port $PORT"
                     echo "sleeping for $toff sec..."
                     sleep $toff
 
@@ -215,6 +256,7 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
                         concurrent::releaseLock -r autotest@bistro /tmp/$lockdir
                         assert_fail $rc 0 "Exiting here..."
                     fi
+                    failoverMark on "port $PORT"
                     echo "sleeping for $ton sec..."
                     sleep $ton
                     # call checkDASDpath_status function to check if one of chpids crashed or not during execution - check it after each cycle!
@@ -223,6 +265,7 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
                 done
                 echo ""
             done
+            stopFailoverMonitor
             echo "Ports $PORTS on switch $switch had been switched off/on for $Z times!"
             concurrent::releaseLock -r autotest@bistro /tmp/$lockdir
         else  # Brocade switch port toggling is already running
@@ -244,6 +287,10 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
         else
             etime=$(( $(echo $PORTS |awk -F "," '{print NF}')*$(( $(($TIME_OFF>0?$TIME_OFF:120)) + $(($TIME_ON>0?$TIME_ON:120)) +50 ))*$CYCLES ))
         fi
+        if [ "$MODE" == "concurrent" ]; then
+            # up to MAX_DARK ports are off at the same time
+            etime=$(( (etime + ${MAX_DARK:-1} - 1) / ${MAX_DARK:-1} ))
+        fi
 
         WDIR="./cablepull"
         PORTSTAT=${WDIR}/connections/portStates_$$.out
@@ -254,7 +301,9 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
         touch $logfile
         exec > >(tee $logfile) 2>&1
 
-        if ( concurrent::createLock -r autotest@bistro -e $etime /tmp/$lockdir ); then
+        polatisLock
+        lockrc=$?
+        if [[ $lockrc -eq 0 ]]; then
             echo running Polatis cable pull on $SWITCH ports $PORTS only once at a time
             # check and establish connection to polatis switch 10.30.x.x
             if (! ping -c3 -i 0.2 $SWITCH > /dev/null) ; then  # switch does not ping, tunnel it
@@ -271,19 +320,69 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
                 IP=$SWITCH  # use the original address
             fi
 
+            # record the TL1 traffic of all the sessions of this run, replay with
+            # python2 ${WDIR}/polatis/tl1_replay.py ${WDIR}/captures/<host>_<port>_<yyyymmdd_hhmmss>_*
+            mkdir -p ${WDIR}/captures
+            export POLATIS_CAPTURE_DIR=${WDIR}/captures
+
+            # keep one logged in TL1 session open for all the polatis_tl1.sh calls of this run
+            export POLATIS_BROKER_SOCKET=/tmp/.polatis-tl1-broker-$$.sock
+            python2 ${WDIR}/polatis/tl1_broker.py serve --socket ${POLATIS_BROKER_SOCKET} --parent $$ &
+            for i in $(seq 50); do [[ -S ${POLATIS_BROKER_SOCKET} ]] && break; sleep 0.1; done
+
             # save the switch config
             mkdir -p ${WDIR}/connections
             DATE=$(date +%Y%m%d_%H%M%S)
-            ${WDIR}/polatis_tl1.sh -h ${IP} -u ${USERID} -pw ${PASSWD} -c "rtrv-patch:::123:;" > ${WDIR}/connections/all_connections_${SWITCH}_${DATE}
-            ${WDIR}/polatis_tl1.sh -h ${IP} -u ${USERID} -pw ${PASSWD} -c "rtrv-patch::${PORTS//,/&}:123:;" > ${WDIR}/connections/portStates_${PORTS//,/_}_${SWITCH}_${DATE}.out
+            # only stored if the switch changed since its last snapshot; list, diff or restore the versions with
+            # python2 ${WDIR}/polatis/snapshot_connections.py --store ${WDIR}/connections/snapshots --switch ${SWITCH} list
+            python2 ${WDIR}/polatis/snapshot_connections.py --store ${WDIR}/connections/snapshots --switch ${SWITCH} \
+                record --host ${IP} --username ${USERID} --password ${PASSWD}
             ${WDIR}/polatis_tl1.sh -h ${IP} -u ${USERID} -pw ${PASSWD} -c "rtrv-patch::${PORTS//,/&}:123:;" |grep "\"" > ${PORTSTAT}
 
             #call checkDASDpath_status function to check if one of chpids is crashed or not before start of execution DASD_cablepull_fio cycles
             checkDASDpath_status
 
+            # how long multipath takes to fail the paths and to reinstate them, every stretch
+            # of failed paths counts as a cycle with flap and concurrent, which the switch times
+            startFailoverMonitor ${WDIR}/connections/failover_${PORTS//,/_}_${SWITCH}_${DATE}.jsonl
+
             # now do the cable pulls
-            PORTS=$(echo $PORTS|tr ',' ' ')  # removing the delimiting commas
             Z=0
+            if [ "$MODE" == "flap" ]; then
+                # the switch keeps the off/on times, the patches are restored if the run fails
+                if [ -e ${TESTLIBDIR}/00_config-file ]; then
+                    source ${TESTLIBDIR}/00_config-file
+                    checkZfcpStatus
+                fi
+                python2 ${WDIR}/polatis/flap_cablepull.py --host ${IP} --username ${USERID} --password ${PASSWD} --ports ${PORTS} \
+                    --cycles ${CYCLES} --toff ${TIME_OFF} --ton ${TIME_ON} --output ${WDIR}/connections/flap_${PORTS//,/_}_${SWITCH}_${DATE}.json
+                rc=$?
+                if [ $rc -gt 0 ]; then
+                    echo "Warning! Port flaps of $PORTS on $IP failed!"
+                    polatisUnlock
+                    assert_fail $rc 0 "Exiting here..."
+                fi
+                checkDASDpath_status
+                Z=$CYCLES
+            elif [ "$MODE" == "concurrent" ]; then
+                # the ports are switched independently, the limits are checked before every port off
+                if [ -e ${TESTLIBDIR}/00_config-file ]; then
+                    source ${TESTLIBDIR}/00_config-file
+                    checkZfcpStatus
+                fi
+                python2 ${WDIR}/polatis/concurrent_cablepull.py --host ${IP} --username ${USERID} --password ${PASSWD} --ports ${PORTS} \
+                    --cycles ${CYCLES} --toff ${TIME_OFF} --ton ${TIME_ON} --max-dark ${MAX_DARK:-1} $(for p in ${PATHS}; do echo --paths $p; done) \
+                    --output ${WDIR}/connections/schedule_${PORTS//,/_}_${SWITCH}_${DATE}.json
+                rc=$?
+                if [ $rc -gt 0 ]; then
+                    echo "Warning! Concurrent cable pull of $PORTS on $IP failed!"
+                    polatisUnlock
+                    assert_fail $rc 0 "Exiting here..."
+                fi
+                checkDASDpath_status
+                Z=$CYCLES
+            fi
+            PORTS=$(echo $PORTS|tr ',' ' ')  # removing the delimiting commas
             while [ $Z -lt $CYCLES ]; do
                 Z=$[Z+1]
                 echo "++++ Cycle $Z @ $(date) ++++"
@@ -306,9 +405,10 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
                     rc=$?
                     if [ $rc -gt 0 ]; then
                         echo "Warning! Port $PORT on $IP could not be switched off!"
-                        concurrent::releaseLock -r autotest@bistro /tmp/$lockdir
+                        polatisUnlock
                         assert_fail $rc 0 "Exiting here..."
                     fi
+                    failoverMark off "port $PORT"
                     echo -e "sleeping for $toff sec...\n"
                     sleep $toff
 
@@ -328,10 +428,11 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
                     rc=$?
                     if [ $rc -gt 0 ]; then
                         echo "Warning! Ports $IPORT and $OPORT on $IP could not be reconnected!"
-                        concurrent::releaseLock -r autotest@bistro /tmp/$lockdir
+                        polatisUnlock
                         rm ${PORTSTAT}
                         assert_fail $rc 0 "Exiting here..."
                     fi
+                    failoverMark on "port $PORT"
                     echo "done: cross connection to: "
                     ${WDIR}/polatis_tl1.sh -h ${IP} -u ${USERID} -pw ${PASSWD} -c "RTRV-PATCH::${IPORT}:123:;" |grep '\"'
                     echo "sleeping for $ton sec..."
@@ -342,21 +443,27 @@ start_section 0 "Starting Switch Port Toggle / cable pull scenario"
                 done
                 echo ""
             done
+            stopFailoverMonitor
             echo "Ports $PORTS on switch $SWITCH had been switched off/on for $Z times!"
             echo -e "\n++++ end Cycle $Z @ $(date) ++++\n"
+            python2 ${WDIR}/polatis/tl1_broker.py stop --socket ${POLATIS_BROKER_SOCKET}
             ssh -S /tmp/.ssh-${SWITCH}-tunnel -O exit ${CONCURRENT_SSH_OPTIONS} autotest@bistro # remove ssh tunnel connection
-            concurrent::releaseLock -r autotest@bistro /tmp/$lockdir
-        else  # Polatis cable pull action is already running
+            polatisUnlock
+        elif [[ $lockrc -eq 1 ]]; then  # Polatis cable pull action is already running
             assert_warn 0 0 "Lock found, waiting for cable pull action to complete..."
-            concurrent::waitForUnlock -r autotest@bistro /tmp/$lockdir --retry-count 11111111 # more than 12 days
+            polatisWaitForUnlock
+        else  # no cable pull without the lease, the reason is logged above
+            assert_fail $lockrc 0 "Polatis lease server $POLATIS_LEASE_SERVER failed, no cable pull on ports $PORTS"
         fi
 
         assert_warn $? 0 "End of polatis cablepull test!"
 
         # clean up some files
         rm ${PORTSTAT}
-        keepFiles "${WDIR}/connections/all_connections_${SWITCH}_*"  10
-        keepFiles "${WDIR}/connections/portStates_*_${SWITCH}_*"  10
+        keepFiles "${WDIR}/connections/flap_*_${SWITCH}_*"  10
+        keepFiles "${WDIR}/connections/schedule_*_${SWITCH}_*"  10
+        keepFiles "${WDIR}/captures/*.tl1.jsonl"  500
+        keepFiles "${WDIR}/connections/failover_*_${SWITCH}_*"  10
 
     fi
 
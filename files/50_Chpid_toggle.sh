@@ -13,6 +13,7 @@ TESTLIBDIR="${TESTLIBDIR:-$(dirname $0)/lib}"
 source ${TESTLIBDIR}/common/results.sh || exit 1
 source ${TESTLIBDIR}/common/remote.sh || exit 1
 source ${TESTLIBDIR}/common/environment.sh || exit 1
+source $(dirname $0)/functions.sh || exit 1
 
 CYCLES=$1
 TIME_OFF=$2
@@ -37,6 +38,8 @@ function random()
 
 start_section 0 "Now switching paths off and on for $CYCLES times"
 init_tests
+# how long multipath takes to fail the paths and to reinstate them in every cycle
+startFailoverMonitor
 
 # main
 
@@ -61,15 +64,15 @@ while [ $n -le $CYCLES ] ; do
   echo "CHPID/Adapter toggle loop: $n of $CYCLES"
 
 ###  # check multipath
-  multipathd show topo |grep 'failed'
+  checkMultipathPaths
   rc=$?
-  if [ $rc -eq 0 ]; then  # add 25 seconds grace time
+  if [ $rc -ne 0 ]; then  # add 25 seconds grace time
       echo "Path check failed; retrying path check after 25 seconds..."
       sleep 25
-      multipathd show topo |grep 'failed'
+      checkMultipathPaths
       rc=$?
   fi
-  assert_fail $rc 1 "All paths are available"
+  assert_fail $rc 0 "All paths are available"
 
 # Scenario 1: LPAR & VM: CHPID vary off/on via chchp -v
 start_section 1 "Scenario 1: LPAR & VM: CHPID vary off/on"
@@ -77,23 +80,27 @@ start_section 1 "Scenario 1: LPAR & VM: CHPID vary off/on"
       echo  "varying CHPID $chpid off for $TIME_OFF sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### varying CHPID $chpid off for $TIME_OFF sec ###"
       chchp -v 0 $chpid
-      assert_fail $? 0 "CHPID $chpid varied off for $TIME_OFF sec via chchp -v 0"
+      rc=$?
+      failoverMark off "CHPID $chpid"
+      assert_fail $rc 0 "CHPID $chpid varied off for $TIME_OFF sec via chchp -v 0"
       sleep $TIME_OFF
       echo  "varying CHPID $chpid on for $TIME_ON sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### varying CHPID $chpid on for $TIME_ON sec ###"
       chchp -v 1 $chpid
-      assert_fail $? 0 "CHPID $chpid varied on for $TIME_ON sec via chchp -v 1"
+      rc=$?
+      failoverMark on "CHPID $chpid"
+      assert_fail $rc 0 "CHPID $chpid varied on for $TIME_ON sec via chchp -v 1"
       sleep $TIME_ON
     done
-    multipathd show topo |grep 'failed'
+    checkMultipathPaths
     rc=$?
-    if [ $rc -eq 0 ]; then  # add 25 seconds grace time
+    if [ $rc -ne 0 ]; then  # add 25 seconds grace time
         echo "Path check failed; retrying path check after 25 seconds..."
         sleep 25
-        multipathd show topo |grep 'failed'
+        checkMultipathPaths
         rc=$?
     fi
-    assert_fail $rc 1 "All paths are still available"
+    assert_fail $rc 0 "All paths are still available"
 end_section 1
 
 # Scenario 2: LPAR & VM: Adapter offline/online via chccwdev
@@ -102,23 +109,27 @@ start_section 1 "Scenario 2: LPAR & VM: Adapter offline/online"
       echo  "offline zfcp device $zfcpdev for $TIME_OFF sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### offline zfcp device $zfcpdev for $TIME_OFF sec ###"
       chccwdev -d $zfcpdev
-      assert_fail $? 0 "zfcp device $zfcpdev offline for $TIME_OFF sec"
+      rc=$?
+      failoverMark off "zfcp device $zfcpdev"
+      assert_fail $rc 0 "zfcp device $zfcpdev offline for $TIME_OFF sec"
       sleep $TIME_OFF
       echo  "online zfcp device $zfcpdev for $TIME_ON sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### online zfcp device $zfcpdev for $TIME_ON sec ###"
       chccwdev -e $zfcpdev
-      assert_fail $? 0 "zfcp device $zfcpdev online for $TIME_ON sec"
+      rc=$?
+      failoverMark on "zfcp device $zfcpdev"
+      assert_fail $rc 0 "zfcp device $zfcpdev online for $TIME_ON sec"
       sleep $TIME_ON
     done
-    multipathd show topo |grep 'failed'
+    checkMultipathPaths
     rc=$?
-    if [ $rc -eq 0 ]; then  # add 25 seconds grace time
+    if [ $rc -ne 0 ]; then  # add 25 seconds grace time
         echo "Path check failed; retrying path check after 25 seconds..."
         sleep 25
-        multipathd show topo |grep 'failed'
+        checkMultipathPaths
         rc=$?
     fi
-    assert_fail $rc 1 "All paths are still available"
+    assert_fail $rc 0 "All paths are still available"
 end_section 1
 
   if (isVM) ; then
@@ -128,23 +139,27 @@ start_section 1 "Scenario 3: z/VM only: detach/attach"
       echo  "detaching zfcp device $zfcpdev for $TIME_OFF sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### detaching zfcp device $zfcpdev for $TIME_OFF sec ###"
       vmcp det $zfcpdev
-      assert_fail $? 0 "zfcp device $zfcpdev detached for $TIME_OFF sec"
+      rc=$?
+      failoverMark off "zfcp device $zfcpdev"
+      assert_fail $rc 0 "zfcp device $zfcpdev detached for $TIME_OFF sec"
       sleep $TIME_OFF
       echo  "re-attaching zfcp device $zfcpdev for $TIME_ON sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### re-attaching zfcp device $zfcpdev for $TIME_ON sec ###"
       vmcp att $zfcpdev '*'
-      assert_fail $? 0 "zfcp device $zfcpdev re-attached for $TIME_ON sec"
+      rc=$?
+      failoverMark on "zfcp device $zfcpdev"
+      assert_fail $rc 0 "zfcp device $zfcpdev re-attached for $TIME_ON sec"
       sleep $TIME_ON
     done
-    multipathd show topo |grep 'failed'
+    checkMultipathPaths
     rc=$?
-    if [ $rc -eq 0 ]; then  # add 25 seconds grace time
+    if [ $rc -ne 0 ]; then  # add 25 seconds grace time
         echo "Path check failed; retrying path check after 25 seconds..."
         sleep 25
-        multipathd show topo |grep 'failed'
+        checkMultipathPaths
         rc=$?
     fi
-    assert_fail $rc 1 "All paths are still available"
+    assert_fail $rc 0 "All paths are still available"
 end_section 1
   else
 # Scenario 4: LPAR only: configure off/on via chchp -c
@@ -153,27 +168,32 @@ start_section 1 "Scenario 3: LPAR only: configure off/on"
       echo  "configuring CHPID $chpid off for $TIME_OFF sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### configuring CHPID $chpid off for $TIME_OFF sec ###"
       chchp -c 0 $chpid
-      assert_fail $? 0 "CHPID $chpid configured off for $TIME_OFF sec via chchp -c 0"
+      rc=$?
+      failoverMark off "CHPID $chpid"
+      assert_fail $rc 0 "CHPID $chpid configured off for $TIME_OFF sec via chchp -c 0"
       sleep $TIME_OFF
       echo  "configuring CHPID $chpid on for $TIME_ON sec"
       logger "$(date +"%Y-%m-%d %H:%M:%S.%N") ### configuring CHPID $chpid on for $TIME_ON sec ###"
       chchp -c 1 $chpid
-      assert_fail $? 0 "CHPID $chpid configured on for $TIME_ON sec via chchp -c 1"
+      rc=$?
+      failoverMark on "CHPID $chpid"
+      assert_fail $rc 0 "CHPID $chpid configured on for $TIME_ON sec via chchp -c 1"
       sleep $TIME_ON
     done
-    multipathd show topo |grep 'failed'
+    checkMultipathPaths
     rc=$?
-    if [ $rc -eq 0 ]; then  # add 25 seconds grace time
+    if [ $rc -ne 0 ]; then  # add 25 seconds grace time
         echo "Path check failed; retrying path check after 25 seconds..."
         sleep 25
-        multipathd show topo |grep 'failed'
+        checkMultipathPaths
         rc=$?
     fi
-    assert_fail $rc 1 "All paths are still available"
+    assert_fail $rc 0 "All paths are still available"
 end_section 1
   fi
   n=$[n+1]
 done
 
+stopFailoverMonitor
 show_test_results
 end_section 0
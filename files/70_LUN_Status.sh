@@ -26,8 +26,9 @@ end_section 0
 
 start_section 0 "Verifying multipath status at test end"
 
-    multipathd show topo
-    n=`multipathd show topo |grep "0:" |grep "failed\|faulty\|offline" |wc -l`
+    readMultipathTopo
+    echo "$MPTOPO"
+    n=${#MPFAILED[@]}
     if [ $n -eq 0 ]; then
       assert_warn 0 0 "All multipaths are ok after test"
     else
@@ -0,0 +1,60 @@
+### Measure the light transitions of a cable pull run from a telemetry file ###
+from pypolatis import telemetry
+from pypolatis import transitions
+import argparse
+
+
+
+def analyze_transitions(path, port, reverse, start, toff, ton, cycles, low, high):
+    """
+    Print one row per cable pull cycle with the requested and the actual
+    off and on times, the fall and rise times and the dark time error.
+
+    Arguments:
+    path       : Telemetry file written by collect_power.py
+    port       : Port to analyze
+    reverse    : Use the reverse power
+    start      : Start of the first cycle in seconds since the epoch
+    toff       : Time for port off in sec
+    ton        : Time for port on in sec
+    cycles     : Number of port off/on cycles
+    low        : Power level in dBm below which the light is off
+    high       : Power level in dBm above which the light is on
+    """
+    ports, samples = telemetry.load(path)
+    power = samples['reverse' if reverse else 'forward'][:, ports.index(port)]
+    offRequested, onRequested = transitions.schedule(start, toff, ton, cycles)
+    table = transitions.cycles(samples['time'], power, offRequested, onRequested, low, high)
+    print('%5s %10s %10s %10s %10s %10s %10s' % ('cycle', 'offDelay', 'fallTime', 'onDelay', 'riseTime', 'dark', 'darkError'))
+    for row in table:
+        print('%5d %10.3f %10.3f %10.3f %10.3f %10.3f %10.3f' % (row['cycle'], row['offDelay'], row['fallTime'],
+              row['onDelay'], row['riseTime'], row['dark'], row['darkError']))
+    for field, (mean, std, worst) in sorted(transitions.summary(table).items()):
+        print('%-10s mean %8.3f std %8.3f max %8.3f' % (field, mean, std, worst))
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    requiredNamed = parser.add_argument_group('required arguments')
+    requiredNamed.add_argument('--file', action='store', required=True,
+                        help='Telemetry file written by collect_power.py')
+    requiredNamed.add_argument('--port', action='store', type=int, required=True,
+                        help='Port to analyze')
+    requiredNamed.add_argument('--start', action='store', type=float, required=True,
+                        help='Start of the first cycle in seconds since the epoch')
+    requiredNamed.add_argument('--toff', action='store', type=float, required=True,
+                        help='Time for port off in sec')
+    requiredNamed.add_argument('--ton', action='store', type=float, required=True,
+                        help='Time for port on in sec')
+    requiredNamed.add_argument('--cycles', action='store', type=int, required=True,
+                        help='Number of port off/on cycles')
+    parser.add_argument('--reverse', action='store_true',
+                        help='Use the reverse power')
+    parser.add_argument('--low', action='store', type=float, default=-30,
+                        help='Power level in dBm below which the light is off; default: -30')
+    parser.add_argument('--high', action='store', type=float, default=-20,
+                        help='Power level in dBm above which the light is on; default: -20')
+    args = parser.parse_args()
+    analyze_transitions(args.file, args.port, args.reverse, args.start, args.toff, args.ton, args.cycles, args.low, args.high)
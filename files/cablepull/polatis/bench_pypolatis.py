@@ -0,0 +1,274 @@
+### Benchmark the pypolatis hot paths against the local TL1 simulator ###
+from pypolatis import _tl1
+from pypolatis.atten import Attenuation
+from pypolatis.capabilities import CapabilityCache
+from pypolatis.crossconnect import CrossConnection
+from pypolatis.session import Session
+from pypolatis.simulator import Simulator, SwitchModel
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+USER = 'admin'
+PASSWORD = 'root'
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of the sorted values.
+    """
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def stats(latencies, commands, elapsed):
+    """
+    Latency percentiles in ms and throughput of one scenario.
+    """
+    latencies = sorted(latencies)
+    return {
+        'runs': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1e3,
+        'p95_ms': percentile(latencies, 0.95) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+        'mean_ms': sum(latencies) / len(latencies) * 1e3,
+        'commands_per_s': commands / elapsed,
+    }
+
+
+def timed(runs, commands, operation):
+    """
+    Runs the operation runs times, commands is the TL1 commands one run sends.
+    """
+    latencies = []
+    start = time.time()
+    for run in range(runs):
+        begin = time.time()
+        operation(run)
+        latencies.append(time.time() - begin)
+    return stats(latencies, runs * commands, time.time() - start)
+
+
+def login(address):
+    session = Session(USER, address[0])
+    session._port = address[1]
+    session.login(PASSWORD)
+    return session
+
+
+def snapshot(size, shift):
+    """
+    Fully patched switch: ingress port i to egress port size/2 + (i + shift) mod size/2.
+    """
+    half = size // 2
+    return dict((port, half + 1 + (port - 1 + shift) % half) for port in range(1, half + 1))
+
+
+def scenario_login(address, runs, size):
+    def operation(run):
+        login(address).logout()
+    # act-user, opr-arc-eqpt and canc-user
+    return timed(runs, 3, operation)
+
+
+def scenario_toggle(address, runs, size):
+    session = login(address)
+    cross = CrossConnection(session.socket)
+    cross.setConnection([1], [size // 2 + 1])
+    def operation(run):
+        cross.removeConnection([1])
+        cross.setConnection([1], [size // 2 + 1])
+    try:
+        return timed(runs, 2, operation)
+    finally:
+        session.logout()
+
+
+def scenario_rtrv_patch(address, runs, size, switch):
+    switch.patches = snapshot(size, 0)
+    session = login(address)
+    cross = CrossConnection(session.socket)
+    def operation(run):
+        assert len(cross.connection()) == size // 2
+    try:
+        return timed(runs, 1, operation)
+    finally:
+        session.logout()
+
+
+def scenario_export_import(address, runs, size, switch):
+    switch.patches = snapshot(size, 0)
+    directory = tempfile.mkdtemp()
+    session = Session(USER, address[0])
+    session._port = address[1]
+    session.login(PASSWORD, opr='export')
+    cross = CrossConnection(session.socket)
+    base = os.path.join(directory, 'snapshot')
+    def operation(run):
+        # export the current state, then import a snapshot moving every patch
+        cross.export_connection(base)
+        switch.patches = snapshot(size, run + 1)
+        cross.import_connection(base + '.json')
+    try:
+        # export, rtrv-patch, dlt-patch and ent-patch
+        return timed(runs, 4, operation)
+    finally:
+        session.logout(opr='export')
+        shutil.rmtree(directory)
+
+
+def scenario_power(address, runs, size, depth):
+    session = login(address)
+    monitor = session.powerMonitor()
+    ports = '1-%d' % size
+    def operation(run):
+        with session.pipeline(depth):
+            futures = [monitor.power(ports) for i in range(depth)]
+        for future in futures:
+            assert len(future.result()) == size
+    try:
+        return timed(runs, depth, operation)
+    finally:
+        session.logout()
+
+
+def scenario_mixed(address, runs, size, switch):
+    """
+    Blocking calls around a pipelined one, after a blocking reader that
+    stops at the first line of its response.
+    """
+    switch.patches = snapshot(size, 0)
+    session = login(address)
+    # without a cache every Attenuation asks the switch for its mode
+    session.capabilityCache = None
+    cross = CrossConnection(session.socket)
+    def operation(run):
+        Attenuation(session)
+        with session.pipeline():
+            future = cross.connection()
+        assert len(future.result()) == size // 2
+        assert len(cross.connection()) == size // 2
+    try:
+        # rtrv-eqpt and two rtrv-patch
+        return timed(runs, 3, operation)
+    finally:
+        session.logout()
+
+
+def scenario_parser(size, runs):
+    """
+    Process time spent by the parser per KB of a full rtrv-patch reply.
+    """
+    model = SwitchModel(size)
+    model.patches = snapshot(size, 0)
+    class User(object):
+        user = USER
+    reply = model.execute(User(), 'rtrv-patch:::%d:' % _tl1._ctag)
+    clock = getattr(time, 'process_time', time.clock)
+    start = clock()
+    for run in range(runs):
+        parser = _tl1._Tl1Parser()
+        assert len(parser.feed(reply)) == size // 2 + 1
+    elapsed = clock() - start
+    return {'runs': runs, 'reply_bytes': len(reply), 'cpu_us_per_kb': elapsed / runs / (len(reply) / 1024.0) * 1e6}
+
+
+def run(args):
+    model = SwitchModel(args.ports)
+    simulator = Simulator(('127.0.0.1', 0), model, args.rtt / 1000.0, args.jitter / 1000.0).start()
+    address = simulator.server_address
+    results = {}
+    # the simulator ports are throwaway, keep them out of the user's cache
+    directory = tempfile.mkdtemp()
+    userCache = Session.capabilityCache
+    Session.capabilityCache = CapabilityCache(os.path.join(directory, 'capabilities.json'))
+    try:
+        scenarios = [
+            ('login', lambda: scenario_login(address, args.runs, args.ports)),
+            ('toggle', lambda: scenario_toggle(address, args.runs, args.ports)),
+            ('rtrv_patch', lambda: scenario_rtrv_patch(address, args.runs, args.ports, model)),
+            ('export_import', lambda: scenario_export_import(address, max(1, args.runs // 10), args.ports, model)),
+            ('power', lambda: scenario_power(address, max(1, args.runs // 10), args.ports, args.depth)),
+            ('mixed', lambda: scenario_mixed(address, max(1, args.runs // 10), args.ports, model)),
+            ('parser', lambda: scenario_parser(args.ports, args.runs * 10)),
+        ]
+        for name, scenario in scenarios:
+            if args.scenario and name not in args.scenario:
+                continue
+            results[name] = scenario()
+            print('%-14s %s' % (name, '  '.join('%s %.3f' % (key, value) if isinstance(value, float) else '%s %s' % (key, value)
+                                                   for key, value in sorted(results[name].items()))))
+    finally:
+        simulator.stop()
+        Session.capabilityCache = userCache
+        shutil.rmtree(directory)
+    return {'rtt_ms': args.rtt, 'jitter_ms': args.jitter, 'ports': args.ports, 'scenarios': results}
+
+
+# metric and whether a higher value is worse
+REGRESSION_METRICS = (('p50_ms', True), ('p95_ms', True), ('commands_per_s', False), ('cpu_us_per_kb', True))
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the metrics that regressed by more than threshold percent.
+    """
+    regressions = []
+    for key in ('rtt_ms', 'jitter_ms', 'ports'):
+        if baseline.get(key) != results[key]:
+            print('WARNING baseline %s %s differs from %s' % (key, baseline.get(key), results[key]))
+    for name, current in sorted(results['scenarios'].items()):
+        reference = baseline.get('scenarios', {}).get(name)
+        if reference is None:
+            continue
+        for metric, higherIsWorse in REGRESSION_METRICS:
+            if metric not in current or not reference.get(metric):
+                continue
+            change = (current[metric] - reference[metric]) / reference[metric] * 100
+            if (change if higherIsWorse else -change) > threshold:
+                regressions.append('%s %s %.3f -> %.3f (%+.1f%%)' % (name, metric, reference[metric], current[metric], change))
+    return regressions
+
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtt', action='store', type=float, default=1,
+                        help='Simulated switch response time in ms; default: 1')
+    parser.add_argument('--jitter', action='store', type=float, default=0,
+                        help='Random extra response time in ms; default: 0')
+    parser.add_argument('--ports', action='store', type=int, default=384,
+                        help='Port count of the simulated switch; default: 384')
+    parser.add_argument('--runs', action='store', type=int, default=100,
+                        help='Runs per latency scenario; default: 100')
+    parser.add_argument('--depth', action='store', type=int, default=8,
+                        help='Power queries in flight in the power scenario; default: 8')
+    parser.add_argument('--scenario', action='append',
+                        choices=('login', 'toggle', 'rtrv_patch', 'export_import', 'power', 'mixed', 'parser'),
+                        help='Scenario to run, repeatable; default: all')
+    parser.add_argument('--output', action='store',
+                        help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', action='store',
+                        help='JSON results to compare with; exit 1 on a regression')
+    parser.add_argument('--threshold', action='store', type=float, default=20,
+                        help='Allowed regression in percent against the baseline; default: 20')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        sys.exit(1 if regressions else 0)
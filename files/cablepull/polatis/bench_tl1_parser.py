@@ -0,0 +1,89 @@
+### Compare the legacy and the incremental TL1 response parser ###
+from pypolatis import _tl1
+import argparse
+import logging
+import timeit
+
+
+class FakeSocket(object):
+    """
+    Socket stand-in that returns a prepared reply in recv sized chunks.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def recv(self, size):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+    def recv_into(self, buff):
+        chunk = self.recv(len(buff))
+        buff[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def legacy_splitlines(socket):
+    """
+    The parser loop used by _tl1._splitlines before the incremental parser.
+    """
+    buff = socket.recv(_tl1._linesize)
+    buff = buff.split(_tl1._linesep, 2)[2]
+    while True:
+        line, separator, buff = buff.partition(_tl1._linesep)
+        if line == _tl1._respsep:
+            break
+        elif line.startswith(_tl1._responseCodeIdentifier):
+            continue
+        elif line.startswith(_tl1._autonomousCodeIdentifier):
+            continue
+        elif separator:
+            yield line
+        else:
+            buff += socket.recv(_tl1._linesize)
+
+
+def reply(ports, kind):
+    """
+    Builds a synthetic COMPLD reply of a fully patched switch.
+    """
+    lines = ['\n   POLATIS 2021-02-03 10:00:00', 'M  %d COMPLD' % _tl1._ctag]
+    for port in range(1, ports + 1):
+        if kind == 'patch':
+            lines.append('   "%d,%d"' % (port, port + ports))
+        else:
+            lines.append('   "%d:-%d.%02d"' % (port, port % 40, port % 100))
+    lines.append(_tl1._respsep)
+    return _tl1._linesep + _tl1._linesep.join(lines)
+
+
+def run_legacy(data):
+    return sum(1 for line in legacy_splitlines(FakeSocket(data)))
+
+
+def run_incremental(data):
+    socket = FakeSocket(data)
+    return sum(1 for line in _tl1._impexp_splitlines(socket, None))
+
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ports', action='store', type=int, default=384,
+                        help='Number of ports in the synthetic reply; default: 384')
+    parser.add_argument('--repeat', action='store', type=int, default=200,
+                        help='Number of parsed replies per measurement; default: 200')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    for kind in ('patch', 'power'):
+        data = reply(args.ports, kind)
+        assert run_incremental(data) == args.ports
+        lost = args.ports - run_legacy(data)
+        legacy = min(timeit.repeat(lambda: run_legacy(data), number=args.repeat, repeat=3))
+        incremental = min(timeit.repeat(lambda: run_incremental(data), number=args.repeat, repeat=3))
+        print('%-6s %5d ports %7d bytes  legacy %8.1f us  incremental %8.1f us  speedup %5.1fx  legacy lost %d lines' % (
+            kind, args.ports, len(data), legacy / args.repeat * 1e6,
+            incremental / args.repeat * 1e6, legacy / incremental, lost))
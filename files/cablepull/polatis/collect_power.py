@@ -0,0 +1,65 @@
+### Sample the optical power of switch ports to a telemetry file ###
+from pypolatis.session import Session
+from pypolatis.telemetry import PowerCollector
+import argparse
+import time
+
+
+
+def collect_power(host, username, password, ports, rate, duration, path, depth):
+    """
+    Sample the forward and reverse power of the ports at a fixed rate.
+    The samples are appended to the file, read it back with
+    pypolatis.telemetry.load.
+
+    Arguments:
+    host       : Switch IP address
+    username   : Valid username
+    password   : Valid password
+    ports      : Valid ports
+    rate       : Samples per second
+    duration   : Seconds to sample, 0 samples until interrupted
+    path       : Telemetry file
+    depth      : Samples in flight
+    """
+    ses = Session(username, host)
+    ses.login(password)
+    collector = PowerCollector(ses, ports, rate=rate, depth=depth, path=path)
+    collector.start()
+    try:
+        if duration:
+            time.sleep(duration)
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.stop()
+    print('%d ticks dropped' % collector.overruns)
+    ses.logout()
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    requiredNamed = parser.add_argument_group('required arguments')
+    requiredNamed.add_argument('--host', action='store', required=True,
+                        help='IP address of the switch')
+    requiredNamed.add_argument('--username', action='store', required=True,
+                        help='Username')
+    requiredNamed.add_argument('--password', action='store', required=True,
+                        help='Password')
+    requiredNamed.add_argument('--ports', action='store', required=True,
+                        help='\'prt\' or \'prt1,prt2\' or \'prt1-prt2\'; eg: 1 or 49,50 or 1-53')
+    requiredNamed.add_argument('--file', action='store', required=True,
+                        help='Telemetry file the samples are appended to')
+    parser.add_argument('--rate', action='store', type=float, default=10,
+                        help='Samples per second; default: 10')
+    parser.add_argument('--duration', action='store', type=float, default=0,
+                        help='Seconds to sample; default: until interrupted')
+    parser.add_argument('--depth', action='store', type=int, default=4,
+                        help='Samples in flight on the pipelined session; default: 4')
+    args = parser.parse_args()
+    collect_power(args.host, args.username, args.password, args.ports, args.rate, args.duration, args.file, args.depth)
@@ -0,0 +1,89 @@
+### Cable pull of many ports at the same time under path safety limits ###
+from pypolatis.cablepull import ConcurrentCablePull, MaxDark, randomOff, randomOn
+from pypolatis.portset import PortSet
+from pypolatis.session import Session
+import argparse
+import signal
+import sys
+
+
+
+def seconds(value, randomRange):
+    """
+    A time in seconds, or the random range for 'random'.
+    """
+    if value == 'random':
+        return randomRange
+    return float(value)
+
+def terminate(signum, frame):
+    # let the cable pull restore the patches when the caller kills the run
+    sys.exit(128 + signum)
+
+def concurrent_cablepull(host, username, password, ports, cycles, timeOff, timeOn, maxDark, paths, stagger, output):
+    """
+    Switch every port off and on cycles times, all ports on their own
+    timeline, while at most maxDark ports are dark and never all the ports
+    of a path group at once.
+
+    Arguments:
+    host       : Switch IP address
+    username   : Valid username
+    password   : Valid password
+    ports      : Valid ports
+    cycles     : Number of off/on cycles per port
+    timeOff    : Off time in seconds or random
+    timeOn     : On time in seconds or random
+    maxDark    : Ports dark at once, 0 for no limit
+    paths      : Port groups of the paths of one LUN or CHPID pair
+    stagger    : Seconds between the first outages of the ports
+    output     : JSON file of the executed schedule
+    """
+    groups = [PortSet(group) for group in paths]
+    constraints = [MaxDark(len(group) - 1, group) for group in groups]
+    if maxDark:
+        constraints.append(MaxDark(maxDark))
+    signal.signal(signal.SIGTERM, terminate)
+    ses = Session(username, host)
+    ses.login(password)
+    try:
+        pull = ConcurrentCablePull(ses, constraints)
+        executed = pull.run(ports, cycles, seconds(timeOff, randomOff), seconds(timeOn, randomOn), stagger)
+    finally:
+        ses.logout()
+    late = [transition['done'] - transition['planned'] for transition in executed]
+    print('%d transitions in %.1f sec, held back up to %.1f sec' % (len(executed), max([transition['done'] for transition in executed] or [0]), max(late or [0])))
+    if output:
+        pull.export(output)
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    requiredNamed = parser.add_argument_group('required arguments')
+    requiredNamed.add_argument('--host', action='store', required=True,
+                        help='IP address of the switch')
+    requiredNamed.add_argument('--username', action='store', required=True,
+                        help='Username')
+    requiredNamed.add_argument('--password', action='store', required=True,
+                        help='Password')
+    requiredNamed.add_argument('--ports', action='store', required=True,
+                        help='\'prt\' or \'prt1,prt2\' or \'prt1-prt2\'; eg: 1 or 49,50 or 1-53')
+    requiredNamed.add_argument('--cycles', action='store', type=int, required=True,
+                        help='Number of port off/on cycles per port')
+    requiredNamed.add_argument('--toff', action='store', required=True,
+                        help='Time for port off in sec or random (between 10 and 120 sec)')
+    requiredNamed.add_argument('--ton', action='store', required=True,
+                        help='Time for port on in sec or random (between 30 and 120 sec)')
+    parser.add_argument('--max-dark', action='store', type=int, default=0,
+                        help='Ports dark at the same time; default: no limit')
+    parser.add_argument('--paths', action='append', default=[],
+                        help='Ports of the paths of one LUN or CHPID pair that must not all be dark, repeatable; eg: 12,13')
+    parser.add_argument('--stagger', action='store', type=float, default=0,
+                        help='Seconds between the first outages of the ports; default: 0')
+    parser.add_argument('--output', action='store',
+                        help='Write the executed schedule as JSON to this file')
+    args = parser.parse_args()
+    concurrent_cablepull(args.host, args.username, args.password, args.ports, args.cycles, args.toff, args.ton,
+                         args.max_dark, args.paths, args.stagger, args.output)
@@ -0,0 +1,399 @@
+import errno
+import json
+import logging
+import os
+import re
+import select
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# netlink protocol and multicast group of the kernel uevents, see netlink(7)
+_ueventProtocol = 15
+_ueventGroup = 1
+_dmActions = {'PATH_FAILED': 'failed', 'PATH_REINSTATED': 'active'}
+_busid = re.compile(r'^[0-9a-f]\.[0-9a-f]\.[0-9a-f]{4}$')
+_nan = float('nan')
+
+def _read(path):
+    try:
+        with open(path) as stream:
+            return stream.read().strip()
+    except (IOError, OSError):
+        return None
+
+def _adaptorOf(path):
+    """
+        This function returns the bus ID of the zfcp adaptor a sysfs device
+        is attached to, the last bus ID in its real path, which comes after
+        the one of the subchannel.
+    """
+    adaptor = None
+    for part in os.path.realpath(path).split(os.sep):
+        if _busid.match(part):
+            adaptor = part
+    return adaptor
+
+def _uevent(data):
+    """
+        This function returns the environment of a kernel uevent, the
+        NUL separated KEY=value fields after the action@devpath header.
+    """
+    environment = {}
+    for field in data.split(b'\0')[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            environment[key.decode('latin-1')] = value.decode('latin-1')
+    return environment
+
+class FailoverMonitor(object):
+    """
+        Records how the paths of the host react to a cable pull: the
+        PATH_FAILED and PATH_REINSTATED uevents dm-multipath sends for every
+        path, and the state of the zfcp remote ports and SCSI devices polled
+        from sysfs. Every change is appended to an events file as a JSON
+        line with its time, together with the off and on marks the cable
+        pull scripts append to the same file, see :func:`cycles`.
+
+        The uevents are waited for in select, so the monitor only wakes up
+        for them and for the sysfs polls, which read one small file per
+        remote port and SCSI device. It hardly takes any CPU from the
+        workload under test. Without the uevent socket, e.g. when not run as
+        root, only the sysfs states are recorded.
+
+        Example::
+
+            monitor = FailoverMonitor('failover.jsonl').start()
+            ...
+            monitor.mark('off', 'port 12')
+            ...
+            monitor.stop()
+            rows = cycles(load('failover.jsonl'))
+    """
+    def __init__(self, path, interval=0.1, sysfs='/sys'):
+        """
+            :param path: the events file, appended to.
+            :type path: string
+
+            :param interval: the time in seconds between the sysfs polls.
+            :type interval: float
+
+            :param sysfs: the root of the sysfs tree.
+            :type sysfs: string
+        """
+        self.path = path
+        self.interval = interval
+        self.sysfs = sysfs
+        self.polls = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._states = {}
+        self._rports = {}
+        self._devices = {}
+        self._socket = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _write(self, kind, **fields):
+        fields['time'] = round(time.time(), 6)
+        fields['kind'] = kind
+        # one write with O_APPEND, so the lines of the scripts are never torn
+        os.write(self._fd, (json.dumps(fields, sort_keys=True) + '\n').encode('utf-8'))
+
+    def mark(self, action, target):
+        """
+            Records a toggle of the cable pull.
+
+            :param action: 'off' when the light of the target was switched off, 'on' when it was switched on again.
+            :type action: string
+
+            :param target: what was switched, e.g. 'port 12' or 'CHPID 34'.
+            :type target: string
+        """
+        self._write('mark', action=action, target=target)
+
+    def _changed(self, key, kind, state, **fields):
+        if self._states.get(key) != state:
+            self._states[key] = state
+            self._write(kind, state=state, **fields)
+
+    def _pollRports(self):
+        directory = os.path.join(self.sysfs, 'class', 'fc_remote_ports')
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(directory, name)
+            if name not in self._rports:
+                self._rports[name] = (_adaptorOf(path), (_read(os.path.join(path, 'port_name')) or '').lower())
+            adaptor, wwpn = self._rports[name]
+            state = _read(os.path.join(path, 'port_state'))
+            self._changed(('rport', name), 'rport', (state or 'gone').lower(), rport=name, adaptor=adaptor, wwpn=wwpn)
+        for name in set(self._rports) - set(names):
+            adaptor, wwpn = self._rports.pop(name)
+            self._changed(('rport', name), 'rport', 'gone', rport=name, adaptor=adaptor, wwpn=wwpn)
+
+    def _pollDevices(self):
+        directory = os.path.join(self.sysfs, 'class', 'scsi_device')
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(directory, name, 'device')
+            if name not in self._devices:
+                adaptor = _read(os.path.join(path, 'hba_id'))
+                # only the zfcp devices have an adaptor
+                self._devices[name] = adaptor and (adaptor, (_read(os.path.join(path, 'wwpn')) or '').lower(),
+                                                   (_read(os.path.join(path, 'fcp_lun')) or '').lower())
+            if not self._devices[name]:
+                continue
+            adaptor, wwpn, lun = self._devices[name]
+            state = _read(os.path.join(path, 'state'))
+            self._changed(('sdev', name), 'sdev', (state or 'gone').lower(), device=name, adaptor=adaptor, wwpn=wwpn, lun=lun)
+        for name in set(self._devices) - set(names):
+            identity = self._devices.pop(name)
+            if identity:
+                self._changed(('sdev', name), 'sdev', 'gone', device=name, adaptor=identity[0], wwpn=identity[1], lun=identity[2])
+
+    def poll(self):
+        """
+            Reads the remote port and SCSI device states from sysfs and
+            records the ones that changed.
+        """
+        self._pollRports()
+        self._pollDevices()
+        self.polls += 1
+
+    def _openUevents(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, _ueventProtocol)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            sock.bind((0, _ueventGroup))
+            return sock
+        except (AttributeError, socket.error) as err:
+            logger.warning('no uevents, only the sysfs states are recorded: %s', err)
+            return None
+
+    def _pathName(self, device):
+        """
+            This function returns the name of a block device given as
+            major:minor, e.g. sdb for 8:16.
+        """
+        path = os.path.join(self.sysfs, 'dev', 'block', device)
+        return os.path.basename(os.path.realpath(path)) if os.path.exists(path) else device
+
+    def _receive(self):
+        try:
+            data = self._socket.recv(65536)
+        except socket.error as err:
+            if err.errno == errno.ENOBUFS:
+                logger.warning('uevents lost, the kernel sent them faster than they were read')
+                return
+            raise
+        environment = _uevent(data)
+        state = _dmActions.get(environment.get('DM_ACTION'))
+        if state is None:
+            return
+        device = environment.get('DM_PATH', '')
+        mapName = environment.get('DM_NAME') or os.path.basename(environment.get('DEVPATH', ''))
+        self._write('dm', state=state, map=mapName, path=self._pathName(device), device=device,
+                    valid=int(environment.get('DM_NR_VALID_PATHS', -1)))
+
+    def run(self, until=None):
+        """
+            Records the events until :meth:`stop` is called or until returns
+            True, which is asked once per poll.
+
+            :param until: the function telling when to stop, e.g. when the cable pull script ended.
+            :type until: function
+        """
+        self._socket = self._openUevents()
+        self._write('start', interval=self.interval, uevents=self._socket is not None)
+        try:
+            due = time.time()
+            while not self._stopped.is_set():
+                now = time.time()
+                if now >= due:
+                    self.poll()
+                    if until is not None and until():
+                        break
+                    due = max(due + self.interval, now)
+                    continue
+                if self._socket is None:
+                    self._stopped.wait(due - now)
+                elif select.select([self._socket], [], [], due - now)[0]:
+                    self._receive()
+        finally:
+            self._write('stop', polls=self.polls)
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+    def start(self):
+        """
+            Starts recording in a background thread.
+        """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+            Stops recording and waits for the last events to be written.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """
+            Stops recording and closes the events file.
+        """
+        self.stop()
+        os.close(self._fd)
+
+def load(path):
+    """
+        This function reads an events file of :class:`FailoverMonitor`.
+
+        :returns: the events in the order of their time.
+        :rtype: list of dictionaries
+    """
+    with open(path) as stream:
+        events = [json.loads(line) for line in stream if line.strip()]
+    return sorted(events, key=lambda event: event['time'])
+
+def episodes(events, kind):
+    """
+        This function returns the outages of the paths or ports of a kind:
+        a dm path from failed to active, a remote port from any state but
+        online to online, a SCSI device from any state but running to
+        running.
+
+        :param kind: 'dm', 'rport' or 'sdev'.
+        :type kind: string
+
+        :returns: the key, down time and up time lists, the up time is None if it did not come back.
+        :rtype: list of lists
+    """
+    good = {'dm': 'active', 'rport': 'online', 'sdev': 'running'}[kind]
+    down = {}
+    result = []
+    for event in events:
+        if event['kind'] != kind:
+            continue
+        if kind == 'dm':
+            key = (event.get('map'), event.get('path'))
+        else:
+            key = event.get('rport' if kind == 'rport' else 'device')
+        if event['state'] != good:
+            if key not in down:
+                down[key] = [key, event['time'], None]
+                result.append(down[key])
+        elif key in down:
+            down.pop(key)[2] = event['time']
+    return result
+
+def _cycle(number, target, off, on, paths, ports):
+    row = {'cycle': number, 'target': target, 'off': off, 'on': on, 'paths': len(set(path[0] for path in paths)),
+           'detect': _nan, 'recover': _nan, 'degraded': _nan, 'rportDown': _nan, 'rportUp': _nan}
+    if paths:
+        first = min(path[1] for path in paths)
+        last = None if any(path[2] is None for path in paths) else max(path[2] for path in paths)
+        if off is not None:
+            row['detect'] = first - off
+        if last is not None:
+            row['degraded'] = last - first
+            if on is not None:
+                row['recover'] = last - on
+    if ports:
+        if off is not None:
+            row['rportDown'] = min(port[1] for port in ports) - off
+        if on is not None and all(port[2] is not None for port in ports):
+            row['rportUp'] = max(port[2] for port in ports) - on
+    return row
+
+def cycles(events, slack=5.0):
+    """
+        This function measures every cycle of a cable pull from the events
+        of a :class:`FailoverMonitor`.
+
+        A cycle starts with an off mark and takes the outages starting from
+        slack seconds before it, as the mark is written when the toggle
+        command returned, up to the next off mark. Without marks, e.g. when
+        the switch times the cycles, every stretch of overlapping path
+        outages is a cycle, with only its degraded time.
+
+        The times in seconds of a cycle are:
+
+        - detect: the off mark to the first path failed by multipath
+        - recover: the on mark to the last failed path reinstated
+        - degraded: the first path failed to the last reinstated, i.e. the time with reduced redundancy
+        - rportDown: the off mark to the first zfcp remote port leaving online
+        - rportUp: the on mark to the last remote port online again
+
+        A time that can not be measured is NaN, e.g. recover of a path that
+        did not come back.
+
+        :param events: the events, see :func:`load`.
+        :type events: list of dictionaries
+
+        :param slack: the time in seconds an outage may start before the off mark.
+        :type slack: float
+
+        :returns: one row per cycle with the cycle, target, off, on, paths and the times above.
+        :rtype: list of dictionaries
+    """
+    paths = episodes(events, 'dm')
+    ports = episodes(events, 'rport')
+    offs = [event for event in events if event['kind'] == 'mark' and event['action'] == 'off']
+    ons = [event for event in events if event['kind'] == 'mark' and event['action'] == 'on']
+    rows = []
+    if offs:
+        for number, off in enumerate(offs):
+            following = offs[number + 1]['time'] if number + 1 < len(offs) else float('inf')
+            start, end = off['time'] - slack, following - slack
+            on = [mark['time'] for mark in ons if off['time'] <= mark['time'] < following]
+            rows.append(_cycle(number + 1, off['target'], off['time'], on[0] if on else None,
+                               [path for path in paths if start <= path[1] < end],
+                               [port for port in ports if start <= port[1] < end]))
+        return rows
+    stretch = []
+    for path in sorted(paths, key=lambda path: path[1]):
+        if stretch and (any(other[2] is None for other in stretch) or path[1] <= max(other[2] for other in stretch)):
+            stretch.append(path)
+            continue
+        if stretch:
+            rows.append(_cycle(len(rows) + 1, None, None, None, stretch, []))
+        stretch = [path]
+    if stretch:
+        rows.append(_cycle(len(rows) + 1, None, None, None, stretch, []))
+    return rows
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summary(rows):
+    """
+        This function returns the distributions of the times of the cycles
+        over a run, ignoring the NaN ones.
+
+        :returns: the count, mean, median, 90th percentile and maximum tuples by field.
+        :rtype: dictionary
+    """
+    result = {}
+    for field in ('detect', 'recover', 'degraded', 'rportDown', 'rportUp'):
+        values = sorted(row[field] for row in rows if row[field] == row[field])
+        if values:
+            result[field] = (len(values), float(sum(values)) / len(values), _percentile(values, 0.5),
+                             _percentile(values, 0.9), values[-1])
+        else:
+            result[field] = (0, _nan, _nan, _nan, _nan)
+    return result
@@ -0,0 +1,71 @@
+### Measure how fast multipath fails the paths of a cable pull and reinstates them ###
+from failover import FailoverMonitor, cycles, load, summary
+import argparse
+import logging
+import os
+import signal
+import sys
+
+
+
+def terminate(signum, frame):
+    # let the monitor write its stop event when the caller kills it
+    sys.exit(128 + signum)
+
+def run(args):
+    """
+    Record the path events until interrupted or the parent process is gone.
+    """
+    def parentGone():
+        try:
+            os.kill(args.parent, 0)
+        except OSError:
+            return True
+        return False
+    signal.signal(signal.SIGTERM, terminate)
+    monitor = FailoverMonitor(args.events, args.interval, args.sysfs)
+    try:
+        monitor.run(parentGone if args.parent else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+    return 0
+
+def report(args):
+    """
+    Print one row per cycle with the detection, recovery and degraded
+    times, and their distribution over the run.
+    """
+    rows = cycles(load(args.events), args.slack)
+    print('%5s %-24s %5s %9s %9s %9s %9s %9s' % ('cycle', 'target', 'paths', 'detect', 'recover', 'degraded', 'rportDown', 'rportUp'))
+    for row in rows:
+        print('%5d %-24s %5d %9.3f %9.3f %9.3f %9.3f %9.3f' % (row['cycle'], row['target'] or '-', row['paths'], row['detect'],
+              row['recover'], row['degraded'], row['rportDown'], row['rportUp']))
+    for field, (count, mean, median, p90, worst) in sorted(summary(rows).items()):
+        print('%-10s n %4d mean %8.3f median %8.3f p90 %8.3f max %8.3f' % (field, count, mean, median, p90, worst))
+    return 0
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', action='store', required=True,
+                        help='Events file, the cable pull scripts append their off and on marks to it')
+    subparsers = parser.add_subparsers(dest='action')
+    runParser = subparsers.add_parser('run', help=run.__doc__.strip())
+    runParser.add_argument('--interval', action='store', type=float, default=0.1,
+                           help='Seconds between the sysfs polls of the remote ports and SCSI devices; default: 0.1')
+    runParser.add_argument('--sysfs', action='store', default='/sys',
+                           help='Root of the sysfs tree; default: /sys')
+    runParser.add_argument('--parent', action='store', type=int,
+                           help='Stop when this process ended')
+    reportParser = subparsers.add_parser('report', help=report.__doc__.strip().split('\n')[0])
+    reportParser.add_argument('--slack', action='store', type=float, default=5,
+                              help='Seconds a path may fail before the off mark of its cycle; default: 5')
+    args = parser.parse_args()
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.getLogger('failover').addHandler(ch)
+    sys.exit({'run': run, 'report': report}[args.action](args))
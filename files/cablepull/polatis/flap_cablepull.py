@@ -0,0 +1,87 @@
+### Cable pull timed by the switch with port flap programs ###
+from pypolatis.cablepull import FlapCablePull, flapPrograms, randomOff, randomOn
+from pypolatis.portset import PortSet
+from pypolatis.session import Session
+import argparse
+import json
+import signal
+import sys
+
+
+
+def seconds(value, randomRange):
+    """
+    A time in seconds, or the random range for 'random'.
+    """
+    if value == 'random':
+        return randomRange
+    return float(value)
+
+def terminate(signum, frame):
+    # let the cable pull restore the patches when the caller kills the run
+    sys.exit(128 + signum)
+
+def flap_cablepull(host, username, password, ports, cycles, timeOff, timeOn, together, grace, output):
+    """
+    Switch the ports off and on cycles times. Each cycle flaps every port
+    in turn like 50_Cablepull.sh, or all of them at once with together.
+    The off and on times are kept by the switch. The original patches of
+    the ports are restored if the run fails.
+
+    Arguments:
+    host       : Switch IP address
+    username   : Valid username
+    password   : Valid password
+    ports      : Valid ports
+    cycles     : Number of off/on cycles
+    timeOff    : Off time in seconds or random
+    timeOn     : On time in seconds or random
+    together   : Flap all the ports at once
+    grace      : Seconds a program may run past its duration
+    output     : JSON file of the executed programs
+    """
+    ports = PortSet(ports)
+    groups = [ports] if together else [[port] for port in ports]
+    programs = flapPrograms(groups, cycles, seconds(timeOff, randomOff), seconds(timeOn, randomOn))
+    signal.signal(signal.SIGTERM, terminate)
+    ses = Session(username, host)
+    ses.login(password)
+    try:
+        executed = FlapCablePull(ses, grace).run(programs)
+    finally:
+        ses.logout()
+    for program in executed:
+        print('ports %(ports)s off %(offMs)d ms on %(onMs)d ms cycles %(cycles)d done by %(detected)s after %(losEvents)d light changes' % program)
+    if output:
+        with open(output, 'w') as stream:
+            json.dump(executed, stream, indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    requiredNamed = parser.add_argument_group('required arguments')
+    requiredNamed.add_argument('--host', action='store', required=True,
+                        help='IP address of the switch')
+    requiredNamed.add_argument('--username', action='store', required=True,
+                        help='Username')
+    requiredNamed.add_argument('--password', action='store', required=True,
+                        help='Password')
+    requiredNamed.add_argument('--ports', action='store', required=True,
+                        help='\'prt\' or \'prt1,prt2\' or \'prt1-prt2\'; eg: 1 or 49,50 or 1-53')
+    requiredNamed.add_argument('--cycles', action='store', type=int, required=True,
+                        help='Number of port off/on cycles')
+    requiredNamed.add_argument('--toff', action='store', required=True,
+                        help='Time for port off in sec or random (between 10 and 120 sec)')
+    requiredNamed.add_argument('--ton', action='store', required=True,
+                        help='Time for port on in sec or random (between 30 and 120 sec)')
+    parser.add_argument('--together', action='store_true',
+                        help='Flap all the ports at once instead of one after another')
+    parser.add_argument('--grace', action='store', type=float, default=5,
+                        help='Seconds a flap program may run past its duration; default: 5')
+    parser.add_argument('--output', action='store',
+                        help='Write the executed programs as JSON to this file')
+    args = parser.parse_args()
+    flap_cablepull(args.host, args.username, args.password, args.ports, args.cycles,
+                   args.toff, args.ton, args.together, args.grace, args.output)
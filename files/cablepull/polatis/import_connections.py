@@ -5,20 +5,22 @@ import argparse
 
 
 
-def import_connections(host, username, password, filename):
+def import_connections(host, username, password, filename, dry_run=False):
     """
-    import json and create  cross-connections using imported json file
+    import json and create  cross-connections using imported json file,
+    changing only the connections that differ from the file
 
     Args:
     host : Switch IP address
     username : Valid username
     password : Valid password
     filename : JSON file
+    dry_run : only show the differences
     """
     ses = Session(username, host)
     login = ses.login(password, opr = 'import')
     add = CrossConnection(login)
-    add.import_connection(filename)
+    add.import_connection(filename, dryRun=dry_run)
     ses.logout(opr = 'import')
 
 if __name__ == '__main__':
@@ -35,6 +37,8 @@ if __name__ == '__main__':
                         help='Password')
     requiredNamed.add_argument('--filename', action='store', required=True,
                         help='Enter your previously exported JSON file; eg: \"connections.json\"')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only show the connections that would be deleted, moved or added')
     args = parser.parse_args()
-    import_connections(args.host, args.username, args.password, args.filename)
+    import_connections(args.host, args.username, args.password, args.filename, args.dry_run)
 
@@ -0,0 +1,140 @@
+### Lease switch ports so that cable pulls on other ports can run at the same time ###
+from pypolatis.leases import LeaseClient, LeaseError, LeaseServer
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+
+LEASE_SERVER = os.environ.get('POLATIS_LEASE_SERVER', 'localhost:3083')
+# exit codes of acquire besides 0, the callers wait on a conflict only
+CONFLICT = 1
+SERVER_ERROR = 2
+logger = logging.getLogger('lease_ports')
+
+
+def address(server):
+    host, port = server.rsplit(':', 1)
+    return host, int(port)
+
+
+def serve(args):
+    """
+    Run the lease server until it is interrupted.
+    """
+    server = LeaseServer(address(args.server))
+    print('lease server listening on %s:%d' % server.server_address)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def hold(lease, parent):
+    """
+    Keeps the lease alive in a detached process while the parent process
+    lives, and releases it when the parent is gone.
+    """
+    if os.fork():
+        return
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    renewed = time.time()
+    try:
+        while True:
+            time.sleep(min(2, lease.ttl / 3.0))
+            try:
+                os.kill(parent, 0)
+            except OSError:
+                break
+            if time.time() - renewed >= lease.ttl / 3.0:
+                try:
+                    lease.renew()
+                except socket.error as err:
+                    # the next tick may still come in time
+                    logger.warning('lease server not reachable: %s', err)
+                    continue
+                renewed = time.time()
+    finally:
+        try:
+            lease.release()
+        finally:
+            os._exit(0)
+
+
+def acquire(args):
+    """
+    Lease the ports and print the lease, wait up to --wait seconds for
+    other leases of the ports to go away. Exits with 1 if other leases
+    still hold the ports, with 2 if the lease server failed.
+    """
+    client = LeaseClient(address(args.server), args.owner)
+    try:
+        lease = client.acquire(args.switch, args.ports, args.ttl, args.wait)
+    except LeaseError as err:
+        sys.stderr.write('%s\n' % err.message)
+        return CONFLICT if err.conflicts else SERVER_ERROR
+    print(lease.lease)
+    sys.stdout.flush()
+    if args.parent:
+        hold(lease, args.parent)
+    return 0
+
+
+def release(args):
+    """
+    Release a lease.
+    """
+    LeaseClient(address(args.server))._request({'op': 'release', 'lease': args.lease})
+    return 0
+
+
+def list_leases(args):
+    """
+    List the current leases.
+    """
+    for lease in LeaseClient(address(args.server)).leases(args.switch):
+        print('%(switch)s  %(ports)s  %(owner)s  %(lease)s  %(remaining).0f sec left' % lease)
+    return 0
+
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', action='store', default=LEASE_SERVER,
+                        help='host:port of the lease server; default: $POLATIS_LEASE_SERVER or localhost:3083')
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.add_parser('serve', help=serve.__doc__.strip())
+    acquireParser = subparsers.add_parser('acquire', help=acquire.__doc__.strip().split('\n')[0])
+    acquireParser.add_argument('--switch', action='store', required=True,
+                               help='Name or IP address of the switch')
+    acquireParser.add_argument('--ports', action='store', required=True,
+                               help='\'prt\' or \'prt1,prt2\' or \'prt1-prt2\'; eg: 1 or 49,50 or 1-53')
+    acquireParser.add_argument('--ttl', action='store', type=float, default=120,
+                               help='Seconds after which the lease expires without heartbeat; default: 120')
+    acquireParser.add_argument('--wait', action='store', type=float,
+                               help='Seconds to wait for the ports; default: do not wait')
+    acquireParser.add_argument('--owner', action='store',
+                               help='Name shown to the others; default: host:pid')
+    acquireParser.add_argument('--parent', action='store', type=int,
+                               help='Keep the lease alive in the background while this process lives')
+    releaseParser = subparsers.add_parser('release', help=release.__doc__.strip())
+    releaseParser.add_argument('--lease', action='store', required=True, help='Lease printed by acquire')
+    listParser = subparsers.add_parser('list', help=list_leases.__doc__.strip())
+    listParser.add_argument('--switch', action='store', help='Only the leases of this switch')
+    args = parser.parse_args()
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(ch)
+    actions = {'serve': serve, 'acquire': acquire, 'release': release, 'list': list_leases}
+    try:
+        sys.exit(actions[args.action](args))
+    except socket.error as err:
+        sys.stderr.write('Lease server %s is not reachable: %s\n' % (args.server, err))
+        sys.exit(SERVER_ERROR)
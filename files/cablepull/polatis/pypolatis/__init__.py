@@ -10,6 +10,19 @@
 #
 #****************************************************************/
 
+import logging
+
+# One console handler and level for all the modules; the TL1 commands and
+# responses are logged at DEBUG
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+ch.setFormatter(formatter)
+logging.getLogger(__name__).addHandler(ch)
+logging.getLogger(__name__).setLevel(logging.INFO)
+# scripts configuring the root logger must not print every message twice
+logging.getLogger(__name__).propagate = False
+
 from pypolatis.atten import Attenuation, AttenuationError
 from pypolatis.crossconnect import CrossConnection, CrossConnectionError
 from pypolatis.pmon import PowerMonitor, PowerMonitorError
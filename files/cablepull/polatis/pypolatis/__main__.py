@@ -0,0 +1,215 @@
+#*****************************************************************
+#
+#  File:             __main__.py
+#
+#  Purpose:          Command line entry point: python -m pypolatis
+#
+#****************************************************************/
+
+"""
+Runs switch operations on one session, e.g.::
+
+    python -m pypolatis --host 10.30.222.136 --username admin --password root query 1-16
+    python -m pypolatis --host 10.30.222.136 --username admin --password root batch setup.txt
+
+A batch file holds one operation per line with the arguments of the
+subcommand, e.g. 'connect 1-4 33-36', 'shutter 5 10000,300,1' or 'query 1-8';
+empty lines and lines starting with '#' are skipped. All the operations of a
+batch run pipelined on the same login. Every result is printed as one JSON
+line.
+"""
+import argparse
+import json
+import logging
+import shlex
+import sys
+
+from pypolatis import _tl1
+from pypolatis.crossconnect import CrossConnection, CrossConnectionError
+from pypolatis.pmon import PowerMonitor, PowerMonitorError
+from pypolatis.session import Session, SessionError
+
+# subcommand, help
+_operations = (
+    ('connect', 'create or move cross connections'),
+    ('delete', 'delete cross connections'),
+    ('query', 'retrieve cross connections'),
+    ('shutter', 'configure a port flap'),
+    ('query-shutter', 'retrieve port flap settings'),
+    ('power', 'read the optical power'),
+    ('export', 'export the cross connections to a JSON file'),
+    ('import', 'apply the cross connections of a JSON file'),
+)
+
+def _connect(session, args):
+    return CrossConnection(session.socket).setConnection(args.inports, args.outports)
+
+def _delete(session, args):
+    return CrossConnection(session.socket).removeConnection(args.ports)
+
+def _query(session, args):
+    return CrossConnection(session.socket).connection(args.ports)
+
+def _shutter(session, args):
+    return CrossConnection(session.socket).setShutter(args.ports, args.interv)
+
+def _queryShutter(session, args):
+    return CrossConnection(session.socket).queryShutter(args.ports)
+
+def _power(session, args):
+    return PowerMonitor(session).power(args.ports, args.reverse)
+
+def _export(session, args):
+    CrossConnection(session.socket).export_connection(args.filename)
+    return args.filename + '.json'
+
+def _import(session, args):
+    return CrossConnection(session.socket).import_connection(args.filename, dryRun=args.dry_run)
+
+_handlers = {
+    'connect': _connect,
+    'delete': _delete,
+    'query': _query,
+    'shutter': _shutter,
+    'query-shutter': _queryShutter,
+    'power': _power,
+    'export': _export,
+    'import': _import,
+}
+
+def _addOperations(subparsers):
+    ports = '\'prt\' or \'prt1,prt2\' or \'prt1-prt2\' or ALL; eg: 1 or 49,50 or 1-53 or ALL'
+    parsers = dict((name, subparsers.add_parser(name, help=help)) for name, help in _operations)
+    parsers['connect'].add_argument('inports', help='ingress ports; ' + ports)
+    parsers['connect'].add_argument('outports', help='egress ports, paired with the ingress ports by position')
+    for name in ('delete', 'shutter'):
+        parsers[name].add_argument('ports', help=ports)
+    for name in ('query', 'query-shutter', 'power'):
+        parsers[name].add_argument('ports', nargs='?', help=ports + '; default: all')
+    parsers['shutter'].add_argument('interv', help='offintv,onintvl,cycles; eg: 10000,300,1')
+    parsers['power'].add_argument('--reverse', action='store_true', help='read the reverse power')
+    parsers['export'].add_argument('filename', help='JSON file name without the .json extension')
+    parsers['import'].add_argument('filename', help='JSON file written by export')
+    parsers['import'].add_argument('--dry-run', action='store_true', help='only show the differences')
+    return parsers
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='python -m pypolatis', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    requiredNamed = parser.add_argument_group('required arguments')
+    requiredNamed.add_argument('--host', action='store', required=True, help='IP address of the switch')
+    requiredNamed.add_argument('--username', action='store', required=True, help='Username')
+    requiredNamed.add_argument('--password', action='store', required=True, help='Password')
+    parser.add_argument('--port', action='store', type=int, default=3082, help='TL1 port; default: 3082')
+    parser.add_argument('--verbose', action='store_true', help='log the TL1 traffic')
+    subparsers = parser.add_subparsers(dest='operation')
+    _addOperations(subparsers)
+    batch = subparsers.add_parser('batch', help='run the operations of a file, - for stdin')
+    batch.add_argument('file', help='operations file, one per line; - for stdin')
+    return parser
+
+class _BatchError(Exception):
+    pass
+
+class _BatchParser(argparse.ArgumentParser):
+    """
+        Parser of a batch line that reports a bad line instead of exiting.
+    """
+    def error(self, message):
+        raise _BatchError(message)
+
+def _operationParser():
+    parser = _BatchParser(prog='batch', add_help=False)
+    _addOperations(parser.add_subparsers(dest='operation'))
+    return parser
+
+def _report(line, operation, result=None, error=None):
+    record = {'line': line, 'op': operation, 'ok': error is None}
+    if error is None:
+        record['result'] = result
+    else:
+        record['error'] = error
+    sys.stdout.write(json.dumps(record, sort_keys=True) + '\n')
+    sys.stdout.flush()
+    return error is None
+
+def _parse(stream):
+    """
+        Yields the line number and the parsed arguments, or the error, of
+        every operation of a batch stream.
+    """
+    parser = _operationParser()
+    for number, text in enumerate(stream, 1):
+        text = text.strip()
+        if not text or text.startswith('#'):
+            continue
+        try:
+            yield number, text.split()[0], parser.parse_args(shlex.split(text)), None
+        except (_BatchError, ValueError) as err:
+            yield number, text.split()[0], None, str(err)
+
+def _error(err):
+    """
+        Returns the text of an error of an operation for its JSON line.
+    """
+    if isinstance(err, _tl1._Tl1Error):
+        return '%s %s' % (err.code, err.message)
+    if isinstance(err, SystemExit):
+        # _tl1 exits on a denied login, one line must not end the batch
+        return 'exit %s' % err.code
+    if isinstance(err, (CrossConnectionError, PowerMonitorError, SessionError)):
+        return err.message or err.__class__.__name__
+    return str(err)
+
+# errors of an operation that are reported on its line instead of ending the run
+_errors = (_tl1._Tl1Error, CrossConnectionError, PowerMonitorError, SessionError, ValueError, SystemExit)
+
+def _execute(session, operations):
+    """
+        Runs the operations pipelined on the session: every operation is sent
+        as soon as it is read, and the results are reported in order once all
+        are sent. Returns whether all of them succeeded.
+    """
+    pending = []
+    with session.pipeline():
+        for number, operation, args, error in operations:
+            result = None
+            if error is None:
+                try:
+                    result = _handlers[args.operation](session, args)
+                except _errors as err:
+                    error = _error(err)
+            pending.append((number, operation, result, error))
+        ok = True
+        for number, operation, result, error in pending:
+            if error is None and isinstance(result, _tl1._Future):
+                try:
+                    result = result.result()
+                except _errors as err:
+                    error = _error(err)
+            ok = _report(number, operation, result, error) and ok
+    return ok
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    if args.verbose:
+        logging.getLogger('pypolatis').setLevel(logging.DEBUG)
+    else:
+        logging.disable(logging.INFO)
+    session = Session(args.username, args.host)
+    session._port = args.port
+    session.login(args.password)
+    try:
+        if args.operation != 'batch':
+            ok = _execute(session, [(0, args.operation, args, None)])
+        elif args.file == '-':
+            ok = _execute(session, _parse(sys.stdin))
+        else:
+            with open(args.file) as stream:
+                ok = _execute(session, _parse(stream))
+    finally:
+        session.logout()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,16 @@
+import collections
 import logging
 import socket
 import sys
-import re
+import select
+import time
+import weakref
 
-logger = logging.getLogger(__name__)
+import portset
+import tracing
+from portset import PortSet
 
-logger.setLevel(logging.INFO)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
+logger = logging.getLogger(__name__)
 
 class _Tl1Error(Exception):
     """
@@ -34,141 +34,536 @@ def _list(portList):
         This function returns a TL1 compatible port list format by
         resolving the details about the '&' and '&&' concatenation types.
 
-        portList: list of the ports specified
+        portList: None for all the ports, a PortSet, a port number, or a list
+                  or string of ports and ranges in any mix like
+                  '1-8,12,49-53', '1&&8&12' or 'ALL'. Lists and strings keep
+                  their order, since ent-patch pairs the ingress and egress
+                  ports by position, and only ascending runs become ranges.
     """
+    if portList is None:
+        return ''
     try:
-        egrSymbol = re.split(r'[\d]', portList)
-    except Exception as err:
-        egrSymbol = []
-        portList = portList
-    if ',' in egrSymbol:
-        portList = portList.split(',')
-        return '&'.join(str(v) for v in portList) if portList is not None else ''
-    elif '-' in egrSymbol:
-        portList = portList.split('-')
-        return '&&'.join(str(v) for v in portList) if portList is not None else ''
-    elif type(portList) == str:
-        return portList
-    elif type(portList) == list:
-        return '&'.join(str(v) for v in portList) if portList is not None else ''
-    else:
-        logger.error('Provide the correct range of port list\n')
+        if isinstance(portList, PortSet):
+            ports = list(portList)
+        else:
+            ports = []
+            for item in portset._items(portList):
+                if item == portset._all:
+                    return portset._all
+                elif isinstance(item, tuple):
+                    ports.extend(range(item[0], item[1] + 1))
+                else:
+                    ports.append(item)
+        if not ports:
+            raise ValueError('Empty port list')
+    except ValueError as err:
+        logger.error('Provide the correct range of port list: %s\n', err)
         exit(1)
+    return portset._render(portset._runs(ports))
+
+def _values(values):
+    """
+        This function returns the '&' joined TL1 form of a comma separated
+        value list such as the port flap 'offintv,onintvl,cycles'.
+    """
+    if isinstance(values, basestring):
+        values = values.split(_valsep)
+    return '&'.join(str(v).strip() for v in values)
 
 _linesize = 4096
 _linesep = '\r\n'
 _responseCodeIdentifier = 'M  %d ' % _ctag
 _ok_resp = 'COMPLD'
 _respsep = ';'
+_contsep = '>'
 _autonomousCodeIdentifier = 'A '
+_alarmCodes = ('*C', '**', '*', 'A')
 
-def _splitlines(socket, e):
+if bytes is str:
+    _text = str
+else:
+    def _text(data):
+        return data.decode('latin-1')
+
+_Autonomous = collections.namedtuple('_Autonomous', 'header alarmCode atag verb lines')
+
+class _Tl1Parser(object):
     """
-        Yields the next valid line to be parsed. If there is no expected
-        output other than success or failure, it just returns that line.
+        Incremental parser for the TL1 output stream of one switch connection.
+
+        The received bytes are appended to a single bytearray through a
+        reusable memoryview. Every receive is split into lines once, so each
+        byte is scanned a constant number of times no matter how large the
+        response is. The parser keeps its frame state between calls, so
+        partial lines and responses spanning several recv calls are handled,
+        and data that belongs to the next message is kept for the next reader.
+
+        The records produced are (kind, tag, data) tuples:
+
+        line
+            a response body line, tag is the ctag
+        deny
+            the (code, text) error of a denied command, tag is the ctag
+        done
+            the end of a response, data is the completion code
+        auto
+            a complete autonomous message, tag is the atag and data the
+            :class:`_Autonomous` tuple
+
+        Every autonomous message is also passed to the callables in
+        listeners as soon as it is parsed, and every command sent through
+        :meth:`send` to the callables in commandListeners.
 
-	There are two different messages types that we need to handle:
-
-	http://en.wikipedia.org/wiki/Transaction_Language_1#TL1_output_message
-
-	and
-
-	http://en.wikipedia.org/wiki/Transaction_Language_1#TL1_autonomous_message
-    """
-    sys.stdout.flush() 
-    buff = socket.recv(_linesize)
-    logger.info("buff : %s" % buff)
-    buff = buff.split(_linesep, 2)[2]
-    ign_sep = False
-    while True:
-        line, separator, buff = buff.partition(_linesep)
-        logger.debug(line)
-        if line == _respsep:
-            if ign_sep:
-        	ign_sep = False 
-            break
-        elif line.startswith(_responseCodeIdentifier):
-            ign_sep = False
-            if line[len(_responseCodeIdentifier):] == _ok_resp:
+        While a :class:`tracing.Tracer` is enabled every command sent opens a
+        span that is closed by the end of its response. The bytes received
+        are counted against the oldest open span.
+
+        http://en.wikipedia.org/wiki/Transaction_Language_1#TL1_output_message
+
+        http://en.wikipedia.org/wiki/Transaction_Language_1#TL1_autonomous_message
+    """
+    _IDLE, _HEADER, _RESPONSE, _AUTONOMOUS = range(4)
+
+    def __init__(self, socket=None):
+        self.socket = socket
+        self._buff = bytearray()
+        self._pos = 0
+        self._chunk = bytearray(_linesize)
+        self._view = memoryview(self._chunk)
+        self._records = collections.deque()
+        self._state = self._IDLE
+        self._header = None
+        self._tag = None
+        self._ok = False
+        self._code = None
+        self._error = []
+        self._auto = None
+        self._open = False
+        self.listeners = []
+        self.commandListeners = []
+        self._spans = collections.deque()
+
+    def feed(self, data):
+        """
+            Appends received bytes and returns the records completed by them.
+        """
+        self._buff.extend(data)
+        self._split()
+        records = list(self._records)
+        self._records.clear()
+        return records
+
+    def _fill(self, echo=False):
+        count = self.socket.recv_into(self._view)
+        if count == 0:
+            raise _Tl1Error('EOF', 'Connection closed by the switch')
+        if self._spans:
+            span = self._spans[0][1]
+            span.received += count
+            if span.firstByte is None:
+                span.firstByte = time.time()
+        if echo and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("buff : %s", self._view[:count].tobytes())
+        if self._pos and self._pos >= len(self._buff) // 2:
+            del self._buff[:self._pos]
+            self._pos = 0
+        self._buff.extend(self._view[:count])
+        self._split()
+
+    def _split(self):
+        buff = self._buff
+        lines = []
+        end = buff.rfind(b'\n', self._pos)
+        if end >= 0:
+            data = memoryview(buff)[self._pos:end].tobytes()
+            self._pos = end + 1
+            lines = _text(data.replace(b'\r', b'')).split('\n')
+        rest = buff[self._pos:].strip()
+        if rest == b';' or rest == b'>':
+            # The terminator is not followed by a line separator
+            self._pos = len(buff)
+            lines.append(_text(bytes(rest)))
+        self._parse(lines)
+
+    def _parse(self, lines):
+        append = self._records.append
+        body = self._state == self._RESPONSE and self._ok
+        tag = self._tag
+        for line in lines:
+            if body and line[:1] == ' ' and line.strip():
+                append(('line', tag, line))
                 continue
-            else:
-                errorCode, errorString, buff = buff.split(_linesep, 2)
-                logger.debug('%s (%s)' % (errorCode, errorString))
-                errorString = errorString.strip()[3:-3]
-                if errorCode == 'IICM':
-                    errorString = 'Not supported on this switch'
-                #e.setMessage(errorString)
-                elif 'PICC' in errorCode:
-                    logger.error("Authentication failure\n")
-                    exit(1)
-                else:
-                    pass
-                return
-                #raise e
-        elif line.startswith(_autonomousCodeIdentifier):
-            ign_sep = True
-            continue
-        elif separator:
-            yield line
+            record = self._line(line)
+            if record is not None:
+                append(record)
+                if record[0] == 'auto':
+                    for listener in self.listeners:
+                        listener(record[2])
+                elif self._spans and record[0] != 'line':
+                    self._finish(record)
+            body = self._state == self._RESPONSE and self._ok
+            tag = self._tag
+
+    def _line(self, line):
+        stripped = line.strip()
+        state = self._state
+        if state == self._RESPONSE:
+            if stripped == _respsep:
+                self._state = self._IDLE
+                if not self._ok and self._error:
+                    error = self._error
+                    self._error = []
+                    return ('deny', self._tag, (error[0], error[1] if len(error) > 1 else ''))
+                return ('done', self._tag, self._code)
+            elif stripped == _contsep:
+                self._state = self._IDLE
+            elif not stripped:
+                pass
+            elif self._ok:
+                return ('line', self._tag, line)
+            elif len(self._error) < 2:
+                self._error.append(stripped)
+            return None
+        if state == self._AUTONOMOUS:
+            if stripped == _respsep or stripped == _contsep:
+                self._state = self._IDLE
+                auto = self._auto
+                self._auto = None
+                return ('auto', auto.atag, auto)
+            if stripped:
+                self._auto.lines.append(line)
+            return None
+        if not stripped or stripped == _respsep or stripped == '<':
+            return None
+        fields = stripped.split(None, 3)
+        if fields[0] == 'M' and len(fields) >= 3:
+            self._state = self._RESPONSE
+            self._tag = fields[1]
+            self._code = fields[2]
+            self._ok = self._code == _ok_resp
+            self._error = []
+        elif fields[0] in _alarmCodes and len(fields) >= 2 and (state == self._HEADER or fields[0] == 'A'):
+            self._state = self._AUTONOMOUS
+            self._auto = _Autonomous(self._header, fields[0], fields[1], ' '.join(fields[2:]), [])
         else:
-            buff += socket.recv(_linesize)
+            self._state = self._HEADER
+            self._header = stripped
+        return None
 
+    def _finish(self, record):
+        kind, tag, data = record
+        for index, (tracer, span) in enumerate(self._spans):
+            if span.ctag == tag:
+                del self._spans[index]
+                tracer.finish(span, data if kind == 'done' else data[0])
+                return
 
-def _impexp_splitlines(socket, e):
-    """
-        Yields the next valid line to be parsed. If there is no expected
-        output other than success or failure, it just returns that line.
+    def poll(self):
+        """
+            Reads whatever the switch has already sent without blocking, so
+            the listeners see the autonomous messages received so far.
+        """
+        while select.select([self.socket], [], [], 0)[0]:
+            self._fill()
 
-        There are two different messages types that we need to handle:
+    def send(self, tl1_cmd):
+        """
+            Sends the command and tells the command listeners about it.
+        """
+        for listener in self.commandListeners:
+            listener(tl1_cmd)
+        tracer = tracing._active
+        if tracer is not None:
+            self._spans.append((tracer, tracer.start(tl1_cmd)))
+        self.socket.sendall(tl1_cmd)
 
-        http://en.wikipedia.org/wiki/Transaction_Language_1#TL1_output_message
+    def records(self, echo=False):
+        """
+            Yields the records as they arrive, receiving more data from the
+            socket whenever no complete record is buffered.
+        """
+        records = self._records
+        while True:
+            while records:
+                yield records.popleft()
+            self._fill(echo)
+
+    def response(self, echo=False):
+        """
+            Yields the records of the next response. Autonomous messages
+            received in between are skipped, as is the rest of a previous
+            response whose reader stopped early.
+        """
+        records = self._records
+        skip = self._open
+        self._open = True
+        while True:
+            while records:
+                record = records.popleft()
+                kind = record[0]
+                if kind == 'line':
+                    if not skip:
+                        yield record
+                    continue
+                elif kind == 'auto':
+                    continue
+                elif skip:
+                    skip = False
+                    continue
+                self._open = False
+                yield record
+                return
+            self._fill(echo)
 
-        and
+_parsers = weakref.WeakKeyDictionary()
 
-        http://en.wikipedia.org/wiki/Transaction_Language_1#TL1_autonomous_message
+def _parser(socket):
+    """
+        This function returns the parser bound to the given socket, creating
+        it on first use so the buffered state survives between commands.
+    """
+    try:
+        return _parsers[socket]
+    except KeyError:
+        parser = _parsers[socket] = _Tl1Parser(socket)
+        return parser
+
+def _lines(socket, e, impexp=False):
+    """
+        Yields the body lines of the next response. If there is no expected
+        output other than success or failure, it just returns.
     """
     sys.stdout.flush()
-    buff = socket.recv(_linesize)
-    #logger.info("buff : %s" % buff)
-    buff = buff.split(_linesep, 2)[2]
-    ign_sep = False
-    while True:
-        line, separator, buff = buff.partition(_linesep)
-        logger.debug(line)
-        if line == _respsep:
-            if ign_sep:
-                ign_sep = False
-            break
-        elif line.startswith(_responseCodeIdentifier):
-            ign_sep = False
-            if line[len(_responseCodeIdentifier):] == _ok_resp:
-                continue
-            else:
-                errorString = 'Empty'
-                errorCode, errorString, buff = buff.split(_linesep, 2)
-                logger.debug('%s (%s)' % (errorCode, errorString))
-                errorString = errorString.strip()[3:-3]
-                if errorCode == 'IICM':
-                    errorString = 'Not supported on this switch'
-                #e.setMessage(errorString)
-                elif 'PICC' in errorCode:
+    for record in _parser(socket).response(echo=not impexp):
+        kind, tag, data = record
+        if kind == 'line':
+            yield data
+        elif kind == 'deny':
+            errorCode, errorString = data
+            logger.debug('%s (%s)', errorCode, errorString)
+            errorString = errorString[3:-3]
+            if errorCode == 'IICM':
+                errorString = 'Not supported on this switch'
+            #e.setMessage(errorString)
+            elif 'PICC' in errorCode:
+                if impexp:
                     logger.error("Authentication failure. Please check the username or password.\n")
-                    exit(1)
-                elif 'IIAC' in errorCode:
-                    logger.error(errorString)
-                    logger.error("Import operation failed. HINT: Please check the port number.\n") 
-                    exit(1)
                 else:
-                    pass
-                return
-                #raise e
-        elif line.startswith(_autonomousCodeIdentifier):
-            ign_sep = True
-            continue
-        elif separator:
-            yield line
-        else:
-            buff += socket.recv(_linesize)
+                    logger.error("Authentication failure\n")
+                exit(1)
+            elif impexp and 'IIAC' in errorCode:
+                logger.error(errorString)
+                logger.error("Import operation failed. HINT: Please check the port number.\n")
+                exit(1)
+            else:
+                pass
+            #raise e
+
+def _splitlines(socket, e):
+    """
+        Yields the next valid line to be parsed. If there is no expected
+        output other than success or failure, it just returns that line.
+    """
+    return _lines(socket, e)
+
+def _impexp_splitlines(socket, e):
+    """
+        Same as :func:`_splitlines` for the import and export operations,
+        which do not echo the received data and stop on invalid ports.
+    """
+    return _lines(socket, e, impexp=True)
+
+def _discard(socket):
+    """
+        This function consumes the next response without checking its outcome.
+    """
+    for record in _parser(socket).response():
+        pass
+
+def _with_ctag(tl1_cmd, ctag):
+    """
+        This function returns the command with its ctag field replaced.
+    """
+    fields = tl1_cmd.split(_portsep, 4)
+    fields[3] = str(ctag)
+    return _portsep.join(fields)
+
+class _Future(object):
+    """
+        The pending result of a command sent in pipelined mode.
+    """
+    def __init__(self, pipeline, ctag, parse=None):
+        self._pipeline = pipeline
+        self.ctag = ctag
+        self._parse = parse
+        self._lines = []
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        """
+            Returns whether the response of the command has been received.
+        """
+        return self._done
+
+    def result(self):
+        """
+            Returns the parsed response, reading the responses of the commands
+            sent before this one as necessary.
+
+            :raises _Tl1Error: if the switch denied the command.
+        """
+        while not self._done:
+            self._pipeline._pump()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def _complete(self, code):
+        if code != _ok_resp:
+            self._fail(code, '')
+            return
+        try:
+            self._result = self._parse(self._lines) if self._parse else self._lines
+        except Exception as err:
+            self._exception = err
+        self._lines = None
+        self._done = True
+
+    def _fail(self, errorCode, errorString):
+        self._exception = _Tl1Error(errorCode, errorString)
+        self._lines = None
+        self._done = True
+
+class _Pipeline(object):
+    """
+        Keeps several commands in flight on one connection. Each command gets
+        its own ctag and each response is matched back to the future of the
+        command by the ctag of its M line, so a batch of queries costs about
+        one round trip instead of one per command.
+    """
+    _firstCtag = 1000
+    _lastCtag = 999999
+
+    def __init__(self, socket, depth=16):
+        self.socket = socket
+        self.depth = depth
+        self._parser = _parser(socket)
+        self._records = self._parser.records()
+        self._inflight = {}
+        self._ctag = self._firstCtag
+
+    def __enter__(self):
+        _pipelines[self.socket] = self
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            self.drain()
+        finally:
+            del _pipelines[self.socket]
+
+    def _nextCtag(self):
+        ctag = self._ctag
+        self._ctag = ctag + 1 if ctag < self._lastCtag else self._firstCtag
+        return ctag
+
+    def submit(self, tl1_cmd, parse=None):
+        """
+            Sends the command without waiting for its response.
+
+            :param tl1_cmd: the TL1 command, its ctag is replaced by a unique one.
+            :type tl1_cmd: string
+
+            :param parse: the function turning the list of body lines into the result.
+            :type parse: callable or None
+
+            :returns: the future of the result, the list of body lines if parse is not given.
+            :rtype: _Future
+        """
+        while len(self._inflight) >= self.depth:
+            self._pump()
+        ctag = self._nextCtag()
+        future = _Future(self, ctag, parse)
+        self._inflight[str(ctag)] = future
+        _parser(self.socket).send(_with_ctag(tl1_cmd, ctag))
+        return future
+
+    def _pump(self):
+        """
+            Reads the next record and hands it to the future it belongs to.
+        """
+        kind, tag, data = next(self._records)
+        future = self._inflight.get(tag)
+        if future is None:
+            if kind in ('deny', 'done') and self._parser._open:
+                # end of a response whose blocking reader stopped early, the
+                # next blocking response must not skip its own end instead
+                self._parser._open = False
+            return
+        if kind == 'line':
+            future._lines.append(data)
+        elif kind == 'deny':
+            del self._inflight[tag]
+            errorCode, errorString = data
+            future._fail(errorCode, errorString[3:-3] if errorString.startswith('/*') else errorString)
+        elif kind == 'done':
+            del self._inflight[tag]
+            future._complete(data)
+
+    def drain(self):
+        """
+            Waits until the responses of all the commands sent are received.
+        """
+        while self._inflight:
+            self._pump()
+
+_pipelines = weakref.WeakKeyDictionary()
+
+def _request(socket, tl1_cmd, e, parse=None, impexp=False):
+    """
+        This function sends the command and returns its parsed response. In
+        pipelined mode the command is only queued and its future is returned.
+    """
+    pipeline = _pipelines.get(socket)
+    if pipeline is not None:
+        return pipeline.submit(tl1_cmd, parse)
+    _parser(socket).send(tl1_cmd)
+    lines = _lines(socket, e, impexp)
+    if parse is not None:
+        return parse(lines)
+    for line in lines:
+        pass
+
+def _call(socket, tl1_cmd, e, parse=None, impexp=False):
+    """
+        Same as :func:`_request`, but waits for the result in pipelined mode.
+    """
+    result = _request(socket, tl1_cmd, e, parse, impexp)
+    if isinstance(result, _Future):
+        return result.result()
+    return result
+
+def _execute(socket, tl1_cmd, impexp=False):
+    """
+        This function sends a command without output and waits for it. Unlike
+        :func:`_call`, which only logs a deny, it raises the deny.
+
+        :raises _Tl1Error: if the switch denied the command.
+    """
+    pipeline = _pipelines.get(socket)
+    if pipeline is not None:
+        pipeline.submit(tl1_cmd).result()
+        return
+    parser = _parser(socket)
+    parser.send(tl1_cmd)
+    for kind, tag, data in parser.response(echo=not impexp):
+        if kind == 'deny':
+            errorCode, errorString = data
+            raise _Tl1Error(errorCode, errorString[3:-3] if errorString.startswith('/*') else errorString)
+        elif kind == 'done' and data != _ok_resp:
+            raise _Tl1Error(data, '')
 
 def _impexp_check_error(socket, e):
     """
@@ -21,6 +21,18 @@ class AttenuationError(Exception):
     def setMessage(self, message):
 	self.message = message
 
+def _modeOf(lines):
+    for line in lines:
+        return line.split('=')[1][:-1]
+
+def _settingsList(lines):
+    settingsList = []
+    for line in lines:
+        port, data = line.split(_tl1._portsep)
+        mode, level, ref = data[:-1].split(_tl1._valsep)
+        settingsList.append((int(port.strip()[1:]), mode, float(level) if level else None, int(ref) if ref else None))
+    return settingsList
+
 class Attenuation(object):
     _mode = None
     def __init__(self, session):
@@ -49,13 +61,20 @@ class Attenuation(object):
     def _check_error(self):
         self._parseTl1Error(_tl1._check_error)
 
+    def _request(self, tl1_cmd, parse=None):
+        """
+            Sends the command and returns the parsed response, or its future
+            when the session is in pipelined mode.
+        """
+        logger.debug(tl1_cmd)
+        return _tl1._request(self.session.socket, tl1_cmd, AttenuationError(), parse)
+
     def _get_mode(self):
         tl1_cmd = 'rtrv-eqpt::atten:%d:::parameter=config;\n' % _tl1._ctag
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        for line in self._splitlines_atten():
-            self._mode = line.split('=')[1][:-1]
-            return
+        def fetch():
+            logger.debug(tl1_cmd)
+            return _tl1._call(self.session.socket, tl1_cmd, AttenuationError(), _modeOf)
+        self._mode = self.session.capability('attenMode', fetch)
 
     def mode(self):
         """
@@ -78,10 +97,10 @@ class Attenuation(object):
             :type level: float
 
             :param refs: The reference ports for relative attenuation.
-            :type refs: list of integers
+            :type refs: list of integers or PortSet
 
             :param ports: the ports for which the attenuation is being set up.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :returns: None
             :rtype: None
@@ -118,9 +137,7 @@ class Attenuation(object):
             data += '%srefs=%s' % (separator, _tl1._list(refs))
 
         tl1_cmd = 'set-port-atten::%s:%d:::%s;\n' % (_tl1._list(ports), _tl1._ctag, data)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        self._check_error()
+        return self._request(tl1_cmd)
 
     def settings(self, ports):
         """
@@ -128,7 +145,7 @@ class Attenuation(object):
             specified in the corresponding argument.
             
             :param ports: The ports that the attenuation settings are queried for.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :returns: a list of items for each port, namely: mode, level and refs. The level and ref values left *None* for those ports for which they are not relevant. For example, if a port has maximum attenuation set then the reply for this port would return [(MAX,None,None)]
             :rtype: list of values
@@ -136,13 +153,6 @@ class Attenuation(object):
             See also :meth:`setSettings`.
         """
         tl1_cmd = 'rtrv-port-atten::%s:%d:;\n' % (_tl1._list(ports), _tl1._ctag)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        settingsList = []
-        for line in self._splitlines_atten():
-            port, data = line.split(_tl1._portsep)
-            mode, level, ref = data[:-1].split(_tl1._valsep)
-            settingsList.append((int(port.strip()[1:]), mode, float(level) if level else None, int(ref) if ref else None))
-        return settingsList
+        return self._request(tl1_cmd, _settingsList)
 
     mode = property(mode, doc='Attenuation mode (string enumeration) supported by the switch')
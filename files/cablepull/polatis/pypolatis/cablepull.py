@@ -0,0 +1,493 @@
+import ctypes
+import ctypes.util
+import heapq
+import json
+import logging
+import random
+import select
+import time
+
+import _tl1
+import events
+from crossconnect import CrossConnection, _connectionList
+from portset import PortSet
+
+logger = logging.getLogger(__name__)
+
+# the random off and on times of 50_Cablepull.sh in seconds
+randomOff = (10, 119)
+randomOn = (30, 119)
+
+class CablePullError(Exception):
+    """
+        Exception raised for errors during a cable pull.
+    """
+    def __init__(self, message = None):
+        """
+            :param message: explanation of the error.
+            :type message: string
+        """
+        super(CablePullError, self).__init__(message)
+        self.message = message
+
+def _monotonic():
+    """
+        This function returns a clock that never goes back, time.time if the
+        system has none.
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+    except OSError:
+        return time.time
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    clockMonotonic = 1
+    def monotonic():
+        spec = timespec()
+        librt.clock_gettime(clockMonotonic, ctypes.pointer(spec))
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    return monotonic
+
+def _seconds(value):
+    """
+        This function returns a fixed time in seconds or a random one out of
+        a (low, high) range of seconds.
+    """
+    if isinstance(value, tuple):
+        return random.uniform(*value)
+    return value
+
+def _interval(value):
+    """
+        This function returns the time in ms of a fixed time in seconds or a
+        random one out of a (low, high) range of seconds.
+    """
+    return int(round(_seconds(value) * 1000))
+
+def _call(session, tl1_cmd, parse=None):
+    """
+        This function sends the command and returns its parsed response.
+
+        :raises CablePullError: if the switch denied the command.
+    """
+    socket = session.socket
+    pipeline = _tl1._pipelines.get(socket) or _tl1._Pipeline(socket)
+    try:
+        return pipeline.submit(tl1_cmd, parse).result()
+    except _tl1._Tl1Error as err:
+        raise CablePullError('%s failed: %s %s' % (tl1_cmd.split(':', 1)[0], err.code, err.message))
+
+def _patches(session):
+    return dict(_call(session, 'rtrv-patch:::%d:;\n' % _tl1._ctag, _connectionList))
+
+def _restore(session, ports, original):
+    """
+        This function sets up the patches of the ports as they were before
+        the run. The patches of the other ports are kept and the ports that
+        are already patched as before are not touched.
+    """
+    egress = set(original.values())
+    target = dict((ingress, egressPort) for ingress, egressPort in _patches(session).items()
+                  if ingress not in ports and egressPort not in ports and egressPort not in egress)
+    target.update(original)
+    return CrossConnection(session.socket).apply(target)
+
+def flapPrograms(groups, cycles, timeOff, timeOn):
+    """
+        This function turns a cable pull run into port flap programs. Every
+        cycle switches each group of ports off and on in turn, like the port
+        loop of 50_Cablepull.sh. Consecutive cycles with the same times on
+        the same ports are merged into one program, so a run with fixed
+        times on one group is a single train timed by the switch, while
+        random times get one program per cycle.
+
+        :param groups: the port groups that are flapped together.
+        :type groups: list of port lists or PortSets
+
+        :param cycles: the number of off/on cycles.
+        :type cycles: integer
+
+        :param timeOff: the dark time in seconds, or the (low, high) range of a random one per cycle.
+        :type timeOff: float or tuple
+
+        :param timeOn: the light time in seconds, or the (low, high) range of a random one per cycle.
+        :type timeOn: float or tuple
+
+        :returns: the ports, off time in ms, on time in ms and cycles of every program.
+        :rtype: list of tuples
+    """
+    groups = [PortSet(ports) for ports in groups]
+    programs = []
+    for cycle in range(cycles):
+        for ports in groups:
+            program = (ports, _interval(timeOff), _interval(timeOn))
+            if programs and programs[-1][:3] == program:
+                programs[-1] = program + (programs[-1][3] + 1,)
+            else:
+                programs.append(program + (1,))
+    return programs
+
+class FlapCablePull(object):
+    """
+        Cable pull that leaves the timing of the outages to the switch.
+
+        Every program is sent as one ent-port-flap, so the off and on times
+        within a program are kept by the switch hardware instead of by
+        sleeps between separate dlt-patch and ent-patch commands. The end of
+        a program is taken from the autonomous flap event of its ports, or
+        from its programmed duration plus grace seconds if the switch does
+        not send one, in which case rtrv-port-flap is logged. The patches of
+        the ports are recorded first and restored if the run fails or is
+        interrupted.
+
+        Example::
+
+            programs = cablepull.flapPrograms([[12], [13]], 10, 60, cablepull.randomOn)
+            executed = cablepull.FlapCablePull(session).run(programs)
+    """
+    def __init__(self, session, grace=5.0):
+        """
+            Initializes a cable pull on a logged in session.
+
+            :param session: the session of the switch.
+            :type session: Session
+
+            :param grace: the time in seconds a program may run past its programmed duration.
+            :type grace: float
+        """
+        self.session = session
+        self.grace = grace
+        self.original = {}
+        self.executed = []
+        self._flapped = PortSet()
+        self._losEvents = 0
+        self._ports = PortSet()
+
+    def _flap(self, ports, offInterval, onInterval, cycles):
+        tl1_cmd = 'ent-port-flap::%s:%d::%s:;\n' % (_tl1._list(ports), _tl1._ctag, _tl1._values((offInterval, onInterval, cycles)))
+        logger.debug(tl1_cmd)
+        _call(self.session, tl1_cmd)
+
+    def _autonomous(self, message):
+        event = events._event(self.session.host, message, time.time())
+        if not (event.ports & self._ports):
+            return
+        if event.kind == 'flap':
+            self._flapped |= event.ports
+        elif event.kind == 'alarm' and event.condition == 'LOS':
+            self._losEvents += 1
+            logger.info('ports %s %s', event.ports & self._ports, 'on' if event.cleared else 'off')
+
+    def _wait(self, ports, deadline):
+        """
+            Waits for the flap event of the ports until the deadline plus the
+            grace time and returns how the end of the program was detected.
+        """
+        parser = _tl1._parser(self.session.socket)
+        limit = deadline + self.grace
+        while True:
+            parser.poll()
+            if not (ports - self._flapped):
+                return 'event'
+            now = time.time()
+            if now >= limit:
+                break
+            select.select([self.session.socket], [], [], limit - now)
+        flaps = _call(self.session, 'rtrv-port-flap::%s:%d::;\n' % (_tl1._list(ports), _tl1._ctag), lambda lines: [line.strip().strip('"') for line in lines])
+        logger.warning('no flap event for ports %s, switch reports %s', ports, ' '.join(flaps))
+        return 'timeout'
+
+    def run(self, programs):
+        """
+            This function runs the port flap programs one after another.
+
+            :param programs: the programs as returned by :func:`flapPrograms`.
+            :type programs: list of tuples
+
+            :returns: one record per program with its ports, off and on times in ms, cycles, the start and end times as returned by time.time(), and whether the end came from the 'event' or the 'timeout'.
+            :rtype: list of dictionaries
+
+            :raises CablePullError: if the switch denied a command. The original patches are restored first.
+
+            See also :meth:`abort`.
+        """
+        self._ports = PortSet()
+        for ports, offInterval, onInterval, cycles in programs:
+            self._ports |= ports
+        patches = _patches(self.session)
+        self.original = dict((ingress, egress) for ingress, egress in patches.items()
+                             if ingress in self._ports or egress in self._ports)
+        logger.info('cable pull of ports %s, patches %s', self._ports,
+                    ' '.join('%d,%d' % patch for patch in sorted(self.original.items())))
+        self.executed = []
+        parser = _tl1._parser(self.session.socket)
+        parser.listeners.append(self._autonomous)
+        try:
+            for ports, offInterval, onInterval, cycles in programs:
+                self._flapped = PortSet()
+                self._losEvents = 0
+                self._flap(ports, offInterval, onInterval, cycles)
+                start = time.time()
+                end = self._wait(ports, start + cycles * (offInterval + onInterval) / 1000.0)
+                self.executed.append({
+                    'ports': str(ports),
+                    'offMs': offInterval,
+                    'onMs': onInterval,
+                    'cycles': cycles,
+                    'start': start,
+                    'end': time.time(),
+                    'detected': end,
+                    'losEvents': self._losEvents,
+                })
+        except BaseException:
+            logger.error('cable pull of ports %s failed, restoring the patches', self._ports)
+            self.abort()
+            raise
+        finally:
+            parser.listeners.remove(self._autonomous)
+        if _patches(self.session) != patches:
+            logger.warning('patches changed during the cable pull, restoring them')
+            self.restore()
+        return self.executed
+
+    def abort(self):
+        """
+            This function stops the port flaps of the run with a program of
+            0 cycles and restores the original patches of its ports.
+        """
+        if self._ports:
+            try:
+                self._flap(self._ports, 0, 0, 0)
+            except CablePullError as err:
+                logger.warning('%s', err)
+        self.restore()
+
+    def restore(self):
+        """
+            This function sets up the patches of the cable pull ports as they
+            were before the run. The patches of the other ports are kept and
+            the ports that are already patched as before are not touched.
+
+            :returns: the plan of :meth:`CrossConnection.apply`.
+            :rtype: dictionary
+        """
+        return _restore(self.session, self._ports, self.original)
+
+class MaxDark(object):
+    """
+        Constraint that keeps at most count of the ports dark at once, e.g.
+        MaxDark(1, [12, 13]) never takes down both paths of a LUN whose
+        CHPIDs are cabled to the ports 12 and 13, and MaxDark(4) limits the
+        outages of the whole run.
+    """
+    def __init__(self, count, ports=None):
+        """
+            :param count: the number of ports allowed to be dark at once.
+            :type count: integer
+
+            :param ports: the ports the limit applies to. This defaults to all ports.
+            :type ports: list of integers or PortSet
+        """
+        self.count = count
+        self.ports = None if ports is None else PortSet(ports)
+
+    def __call__(self, dark, port):
+        if self.ports is not None:
+            if port not in self.ports:
+                return True
+            dark = dark & self.ports
+        return len(dark) < self.count
+
+    def __repr__(self):
+        return 'MaxDark(%d, %s)' % (self.count, 'ALL' if self.ports is None else self.ports)
+
+class ConcurrentCablePull(object):
+    """
+        Cable pull that runs the off/on cycles of many ports at the same time.
+
+        Every port follows its own timeline of deadlines on a monotonic
+        clock. Before a port is switched off, every constraint is called with
+        the set of ports that are dark and the port, and the port waits
+        until the next port comes back on if one of them returns False.
+        A held back port keeps its cycle count, so the run still covers every
+        port cycles times.
+        Transitions that fall due together are sent as one dlt-patch or
+        ent-patch. Switching on is never held back, as it only restores
+        paths. The executed schedule records when every transition was
+        planned and done, and the original patches are restored if the run
+        fails or is interrupted.
+
+        Example::
+
+            pull = cablepull.ConcurrentCablePull(session, [cablepull.MaxDark(1, [12, 13]), cablepull.MaxDark(4)])
+            pull.run('12-19', 10, cablepull.randomOff, cablepull.randomOn)
+            pull.export('schedule.json')
+    """
+    _on, _off = range(2)
+
+    def __init__(self, session, constraints=()):
+        """
+            Initializes a cable pull on a logged in session.
+
+            :param session: the session of the switch.
+            :type session: Session
+
+            :param constraints: the callables taking the dark PortSet and a port, returning whether the port may be switched off.
+            :type constraints: list of callables
+        """
+        self.session = session
+        self.constraints = list(constraints)
+        self.original = {}
+        self.executed = []
+        self._ports = PortSet()
+        self._patchOf = {}
+        self._clock = _monotonic()
+        self._start = None
+        self._wall = None
+
+    def _peers(self, ports):
+        """
+            This function returns the patch of every port, the port being the
+            ingress or the egress of it.
+        """
+        patches = {}
+        for ingress, egress in self.original.items():
+            for port in (ingress, egress):
+                if port in ports:
+                    if (egress if port == ingress else ingress) in ports:
+                        raise CablePullError('ports %d and %d are patched to each other' % (ingress, egress))
+                    patches[port] = (ingress, egress)
+        missing = PortSet(ports) - PortSet(patches)
+        if missing:
+            raise CablePullError('ports %s are not patched' % missing)
+        return patches
+
+    def _switch(self, action, ports):
+        if action == self._off:
+            tl1_cmd = 'dlt-patch::%s:%d:;\n' % (_tl1._list(ports), _tl1._ctag)
+        else:
+            pairs = sorted(self._patchOf[port] for port in ports)
+            tl1_cmd = 'ent-patch::%s,%s:%d:;\n' % (_tl1._list([ingress for ingress, egress in pairs]),
+                                                   _tl1._list([egress for ingress, egress in pairs]), _tl1._ctag)
+        logger.debug(tl1_cmd)
+        _call(self.session, tl1_cmd)
+        return self._clock() - self._start
+
+    def _allowed(self, dark, port):
+        for constraint in self.constraints:
+            if not constraint(dark, port):
+                return constraint
+        return None
+
+    def run(self, ports, cycles, timeOff, timeOn, stagger=0.0):
+        """
+            This function switches every port off and on cycles times.
+
+            :param ports: the ports to pull, each one must be the ingress or egress of a patch.
+            :type ports: list of integers or PortSet
+
+            :param cycles: the number of off/on cycles per port.
+            :type cycles: integer
+
+            :param timeOff: the dark time in seconds, or the (low, high) range of a random one per cycle.
+            :type timeOff: float or tuple
+
+            :param timeOn: the light time in seconds, or the (low, high) range of a random one per cycle.
+            :type timeOn: float or tuple
+
+            :param stagger: the time in seconds between the first outages of the ports.
+            :type stagger: float
+
+            :returns: the executed transitions, see :meth:`export`.
+            :rtype: list of dictionaries
+
+            :raises CablePullError: if a port is not patched, a constraint never lets a port go dark or the switch denied a command. The original patches are restored first.
+        """
+        self._ports = PortSet(ports)
+        patches = _patches(self.session)
+        self.original = dict((ingress, egress) for ingress, egress in patches.items()
+                             if ingress in self._ports or egress in self._ports)
+        self._patchOf = self._peers(self._ports)
+        self.executed = []
+        self._start = self._clock()
+        self._wall = time.time()
+        # deadline, on before off, port, cycle, planned time
+        pending = [(index * stagger, self._off, port, 1, index * stagger) for index, port in enumerate(self._ports)]
+        heapq.heapify(pending)
+        dark = PortSet()
+        try:
+            while pending:
+                now = self._clock() - self._start
+                if pending[0][0] > now:
+                    time.sleep(pending[0][0] - now)
+                    continue
+                due = []
+                while pending and pending[0][0] <= now:
+                    due.append(heapq.heappop(pending))
+                ons = [event for event in due if event[1] == self._on]
+                if ons:
+                    done = self._switch(self._on, [port for deadline, action, port, cycle, planned in ons])
+                    for deadline, action, port, cycle, planned in ons:
+                        dark.discard(port)
+                        self._record(port, cycle, 'on', planned, done)
+                        if cycle < cycles:
+                            later = done + _seconds(timeOn)
+                            heapq.heappush(pending, (later, self._off, port, cycle + 1, later))
+                offs = []
+                held = []
+                for event in due:
+                    deadline, action, port, cycle, planned = event
+                    if action != self._off:
+                        continue
+                    constraint = self._allowed(dark | offs, port)
+                    if constraint is None:
+                        offs.append(port)
+                    else:
+                        held.append((event, constraint))
+                if offs:
+                    done = self._switch(self._off, offs)
+                    for deadline, action, port, cycle, planned in due:
+                        if action == self._off and port in offs:
+                            dark.add(port)
+                            self._record(port, cycle, 'off', planned, done)
+                            later = done + _seconds(timeOff)
+                            heapq.heappush(pending, (later, self._on, port, cycle, later))
+                for (deadline, action, port, cycle, planned), constraint in held:
+                    if not dark:
+                        raise CablePullError('port %d can never be switched off with %r' % (port, constraint))
+                    # check again when the next port is back on
+                    again = min(later for later, laterAction, laterPort, laterCycle, laterPlanned in pending if laterAction == self._on)
+                    logger.debug('port %d held back by %r until %.1f', port, constraint, again)
+                    heapq.heappush(pending, (again, self._off, port, cycle, planned))
+        except BaseException:
+            logger.error('cable pull of ports %s failed, restoring the patches', self._ports)
+            _restore(self.session, self._ports, self.original)
+            raise
+        return self.executed
+
+    def _record(self, port, cycle, action, planned, done):
+        self.executed.append({
+            'port': port,
+            'cycle': cycle,
+            'action': action,
+            'planned': planned,
+            'done': done,
+            'time': self._wall + done,
+        })
+
+    def export(self, path):
+        """
+            This function writes the executed schedule as JSON: the ports,
+            the constraints and one record per transition with its port,
+            cycle, action 'off' or 'on', the planned and done seconds since
+            the start of the run and the done time as returned by time.time().
+
+            :param path: the file name.
+            :type path: string
+        """
+        with open(path, 'w') as output:
+            json.dump({'ports': str(self._ports),
+                       'constraints': [repr(constraint) for constraint in self.constraints],
+                       'transitions': self.executed}, output, indent=4, sort_keys=True)
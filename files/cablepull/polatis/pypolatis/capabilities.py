@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+import _tl1
+
+logger = logging.getLogger(__name__)
+
+_defaultPath = os.environ.get('POLATIS_CAPABILITY_CACHE',
+                              os.path.join(os.path.expanduser('~'), '.pypolatis_capabilities.json'))
+
+def _identityOf(lines):
+    """
+        This function returns the quoted fields of the rtrv-netype response,
+        i.e. the vendor, model, type and firmware version of the switch.
+    """
+    for line in lines:
+        return [field.replace('\\', '').strip().strip('"') for field in line.split(_tl1._valsep)]
+    return []
+
+class CapabilityCache(object):
+    """
+        File backed cache of what a switch is fitted with: the power monitor
+        ports and modes, the attenuation mode and the port count. These only
+        change with the hardware or the firmware, so every session of the
+        same switch can skip the queries for them.
+
+        An entry is keyed by the host and TL1 port of the switch and holds
+        the identity of the switch it was read from. It is dropped when it is
+        older than ttl seconds, or when the switch reports another identity
+        at login. The file is rewritten atomically, so concurrent scripts
+        never read half of it.
+    """
+    def __init__(self, path=None, ttl=7 * 24 * 3600):
+        """
+            :param path: the cache file. This defaults to $POLATIS_CAPABILITY_CACHE or ~/.pypolatis_capabilities.json.
+            :type path: string
+
+            :param ttl: the time in seconds an entry is used.
+            :type ttl: float
+        """
+        self.path = path or _defaultPath
+        self.ttl = ttl
+
+    def _load(self):
+        try:
+            with open(self.path) as stream:
+                entries = json.load(stream)
+        except (IOError, ValueError):
+            return {}
+        # every simulator, replay or benchmark port leaves an entry, drop
+        # them all once they are stale rather than only the one looked up
+        now = time.time()
+        expired = [switch for switch, entry in entries.items() if now - entry['time'] > self.ttl]
+        for switch in expired:
+            logger.info('capabilities of %s dropped: expired', switch)
+            del entries[switch]
+        if expired:
+            self._save(entries)
+        return entries
+
+    def _save(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            handle, temporary = tempfile.mkstemp(dir=directory)
+            with os.fdopen(handle, 'w') as output:
+                json.dump(entries, output, indent=1, sort_keys=True)
+            os.rename(temporary, self.path)
+        except (IOError, OSError) as err:
+            # the cache only saves round trips, the switch still answers
+            logger.warning('capability cache %s not written: %s', self.path, err)
+
+    def get(self, switch, identity=None):
+        """
+            This function returns the cached capabilities of a switch.
+
+            :param switch: the host and TL1 port of the switch, e.g. '10.30.222.136:3082'.
+            :type switch: string
+
+            :param identity: the identity the switch reports. This defaults to not checking it.
+            :type identity: list of strings
+
+            :returns: the capabilities by name, or None if there are none or they are stale.
+            :rtype: dictionary
+        """
+        entry = self.entry(switch)
+        if identity is None or entry is None:
+            return entry and entry['capabilities']
+        return self.check(switch, entry, identity)
+
+    def entry(self, switch):
+        """
+            This function returns the cache entry of a switch with its
+            'identity' and 'capabilities', or None if there is none or it is
+            stale.
+        """
+        return self._load().get(switch)
+
+    def check(self, switch, entry, identity):
+        """
+            This function returns the capabilities of an entry read by
+            :meth:`entry` if the switch still reports its identity, and drops
+            the entry otherwise. Login reads the cache once this way.
+
+            :returns: the capabilities by name, or None if the identity changed.
+            :rtype: dictionary
+        """
+        if entry['identity'] == identity:
+            return entry['capabilities']
+        logger.info('capabilities of %s dropped: identity %s instead of %s', switch, identity, entry['identity'])
+        self.invalidate(switch)
+        return None
+
+    def update(self, switch, identity, **capabilities):
+        """
+            This function adds capabilities of a switch to the cache.
+
+            :param identity: the identity the switch reports, an entry with another identity is replaced.
+            :type identity: list of strings
+        """
+        entries = self._load()
+        entry = entries.get(switch)
+        if entry is None or entry['identity'] != identity:
+            entry = entries[switch] = {'identity': identity, 'time': time.time(), 'capabilities': {}}
+        entry['capabilities'].update(capabilities)
+        self._save(entries)
+
+    def invalidate(self, switch=None):
+        """
+            This function drops the capabilities of a switch, of all switches
+            if not specified.
+        """
+        entries = self._load()
+        if switch is None:
+            entries.clear()
+        else:
+            entries.pop(switch, None)
+        self._save(entries)
@@ -0,0 +1,256 @@
+import SocketServer
+import itertools
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+import _tl1
+
+logger = logging.getLogger(__name__)
+
+_password = re.compile(r'(act-user(?::[^:;]*){4}:)[^;]*', re.IGNORECASE)
+_masked = r'\1****'
+_sessions = itertools.count(1)
+_deny = '\r\n\n   REPLAY %s\r\nM  %s DENY\r\n   IICM\r\n   /* Command not in the transcript */\r\n;'
+
+def _mask(data):
+    """
+        This function replaces the passwords of the act-user commands.
+    """
+    return _password.sub(_masked, data)
+
+def _verb(command):
+    return command.split(':', 1)[0].strip().lower()
+
+def _ctag(command):
+    fields = command.split(':')
+    return fields[3].strip() if len(fields) > 3 else '0'
+
+def transcriptPath(directory, host, port):
+    """
+        This function returns a new transcript file name in the directory,
+        unique for the host, port, time and process.
+    """
+    return os.path.join(directory, '%s_%d_%s_%d_%d.tl1.jsonl' % (
+        host, port, time.strftime('%Y%m%d_%H%M%S'), os.getpid(), next(_sessions)))
+
+def load(path):
+    """
+        This function reads a transcript.
+
+        :returns: the header and the time, direction, data lists of the events.
+        :rtype: tuple
+    """
+    with open(path) as stream:
+        header = json.loads(stream.readline())
+        return header, [json.loads(line) for line in stream if line.strip()]
+
+class CaptureSocket(object):
+    """
+        Socket wrapper writing a transcript of everything sent to and
+        received from the switch, with the passwords of act-user masked.
+
+        The transcript holds a JSON header line with the host, port and
+        start time, then one [seconds, direction, data] line per send ('s'),
+        receive ('r', empty when the switch closed the connection) and close
+        ('x'), the seconds counted from the start. Lines are written as they
+        happen, so the transcript of a crashed run is complete up to the
+        crash.
+    """
+    def __init__(self, sock, path, host=None, port=None):
+        """
+            :param sock: the connected socket.
+            :type sock: socket
+
+            :param path: the transcript file.
+            :type path: string
+        """
+        self._socket = sock
+        self.path = path
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._output = open(path, 'w', 1)
+        self._output.write(json.dumps({'host': host, 'port': port, 'start': self._start}) + '\n')
+
+    def _record(self, direction, data):
+        with self._lock:
+            if not self._output.closed:
+                self._output.write(json.dumps([round(time.time() - self._start, 6), direction, data.decode('latin-1')]) + '\n')
+
+    def sendall(self, data):
+        self._record('s', _mask(data))
+        return self._socket.sendall(data)
+
+    def send(self, data):
+        count = self._socket.send(data)
+        self._record('s', _mask(data[:count]))
+        return count
+
+    def recv(self, size, *flags):
+        data = self._socket.recv(size, *flags)
+        self._record('r', data)
+        return data
+
+    def recv_into(self, buffer, size=0, *flags):
+        count = self._socket.recv_into(buffer, size, *flags)
+        self._record('r', bytes(buffer[:count]) if not isinstance(buffer, memoryview) else buffer[:count].tobytes())
+        return count
+
+    def close(self):
+        self._record('x', '')
+        with self._lock:
+            self._output.close()
+        self._socket.close()
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+class _ReplayHandler(SocketServer.BaseRequestHandler):
+    """
+        Plays one transcript back to a client: every recorded receive is
+        sent after the recorded delay from the event before it, divided by
+        the speed, and every recorded send waits for the client to send as
+        many commands. A command with another verb than the recorded one is
+        denied at once, so the client does not wait for a response that is
+        not in the transcript.
+    """
+    def setup(self):
+        self.request.settimeout(self.server.clientTimeout)
+        self._buff = ''
+
+    def _command(self):
+        while _tl1._respsep not in self._buff:
+            data = self.request.recv(_tl1._linesize)
+            if not data:
+                raise EOFError()
+            self._buff += data
+        command, self._buff = self._buff.split(_tl1._respsep, 1)
+        return command
+
+    def _expect(self, path, want):
+        while True:
+            got = _mask(self._command()).strip()
+            if got == want:
+                return
+            self.server.mismatch(path, want, got)
+            if _verb(got) == _verb(want):
+                # same command with other parameters, the recorded response follows
+                return
+            self.request.sendall(_deny % (time.strftime('%y-%m-%d %H:%M:%S'), _ctag(got)))
+
+    def handle(self):
+        path, (header, events) = self.server._take()
+        if path is None:
+            logger.info('no transcript left for %s:%d', *self.client_address)
+            return
+        logger.info('replaying %s to %s:%d', path, self.client_address[0], self.client_address[1])
+        speed = self.server.speed
+        anchorWall, anchorTime = time.time(), 0.0
+        start = anchorWall
+        try:
+            for when, direction, data in events:
+                data = data.encode('latin-1')
+                if direction == 's':
+                    for want in data.split(_tl1._respsep)[:-1]:
+                        self._expect(path, want.strip())
+                elif direction == 'r':
+                    if speed > 0:
+                        delay = anchorWall + (when - anchorTime) / speed - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                    if not data:
+                        return
+                    self.request.sendall(data)
+                else:
+                    continue
+                anchorWall, anchorTime = time.time(), when
+        except EOFError:
+            logger.info('client closed %s after %.3f sec', path, time.time() - start)
+            return
+        except socket.timeout:
+            logger.warning('client sent nothing for %s sec, %s stopped', self.server.clientTimeout, path)
+            return
+        logger.info('replayed %s in %.3f sec (recorded %.3f sec)', path, time.time() - start, events[-1][0] if events else 0)
+
+class ReplayServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+        TCP server playing recorded transcripts back in place of a switch, so
+        that a run can be repeated without the switch. Each connection gets
+        the next transcript in the order they were recorded, like the
+        sessions of the run logged in.
+
+        Example::
+
+            replay = ReplayServer(glob.glob('captures/*.tl1.jsonl'), ('localhost', 0), speed=10).start()
+            session = Session('admin', 'localhost')
+            session._port = replay.server_address[1]
+            ...
+            replay.stop()
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, paths, address=('', 3082), speed=1.0, timeout=30.0, loop=False):
+        """
+            :param paths: the transcript files.
+            :type paths: list of strings
+
+            :param address: the host and port to listen on.
+            :type address: tuple
+
+            :param speed: the factor the recorded delays are divided by, 0 to send without delays.
+            :type speed: float
+
+            :param timeout: the time in seconds to wait for a command of the client.
+            :type timeout: float
+
+            :param loop: start again with the first transcript after the last one.
+            :type loop: bool
+        """
+        SocketServer.TCPServer.__init__(self, address, _ReplayHandler)
+        transcripts = [(path, load(path)) for path in paths]
+        self.transcripts = sorted(transcripts, key=lambda transcript: transcript[1][0]['start'])
+        self.speed = speed
+        self.clientTimeout = timeout
+        self.loop = loop
+        self.mismatches = []
+        self._lock = threading.Lock()
+        self._next = 0
+        self._thread = None
+
+    def _take(self):
+        with self._lock:
+            if self._next >= len(self.transcripts):
+                if not self.loop or not self.transcripts:
+                    return None, (None, None)
+                self._next = 0
+            self._next += 1
+            return self.transcripts[self._next - 1]
+
+    def mismatch(self, path, expected, received):
+        logger.warning('%s: expected %s, received %s', path, expected, received)
+        with self._lock:
+            self.mismatches.append((path, expected, received))
+
+    def start(self):
+        """
+            Starts serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+            Stops serving and closes the listening socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,310 @@
+import logging
+import threading
+
+import _tl1
+import portset
+
+logger = logging.getLogger(__name__)
+
+# Verbs whose single port operations can be merged into one command
+_verbs = ('ent-patch', 'dlt-patch', 'ent-port-flap', 'opr-port-shutter', 'rls-port-shutter')
+
+def _portsOf(aid):
+    """
+        This function returns the ports of a TL1 port list in their order.
+    """
+    ports = []
+    for item in portset._items(aid):
+        if item == portset._all:
+            raise ValueError('ALL can not be merged')
+        elif isinstance(item, tuple):
+            ports.extend(range(item[0], item[1] + 1))
+        else:
+            ports.append(item)
+    return ports
+
+def parse(tl1_cmd):
+    """
+        This function splits a TL1 command that can be coalesced into its
+        verb, ports, egress ports and the fields after the ctag.
+
+        :returns: the verb, ingress ports, egress ports (None but for ent-patch) and the rest of the command, or None if the command can not be merged.
+        :rtype: tuple
+    """
+    fields = tl1_cmd.strip().rstrip(_tl1._respsep).split(_tl1._portsep, 4)
+    verb = fields[0].strip().lower()
+    if verb not in _verbs or len(fields) < 4 or not fields[2].strip():
+        return None
+    rest = _tl1._portsep + fields[4] if len(fields) > 4 else ''
+    try:
+        if verb == 'ent-patch':
+            ingress, egress = fields[2].split(_tl1._valsep)
+            ingress, egress = _portsOf(ingress), _portsOf(egress)
+            if len(ingress) != len(egress):
+                return None
+            return verb, ingress, egress, rest
+        return verb, _portsOf(fields[2]), None, rest
+    except ValueError:
+        return None
+
+class _Operation(object):
+    """
+        The pending result of one operation given to a :class:`Coalescer`.
+    """
+    def __init__(self, coalescer, verb, ports, egress, rest):
+        self._coalescer = coalescer
+        self.verb = verb
+        self.ports = list(ports)
+        self.egress = list(egress) if egress is not None else None
+        self.rest = rest
+        self.command = None
+        self._event = threading.Event()
+        self._exception = None
+
+    def _touched(self):
+        return set(self.ports) | set(self.egress or ())
+
+    def done(self):
+        """
+            Returns whether the switch answered the operation.
+        """
+        return self._event.is_set()
+
+    def result(self):
+        """
+            Waits for the operation. Inside a batch, or without a window, the
+            pending operations are sent at once, otherwise they go when the
+            window closes, so that other threads can still add theirs.
+
+            :raises _Tl1Error: if the switch denied the operation.
+        """
+        coalescer = self._coalescer
+        if not self._event.is_set() and (coalescer.window <= 0 or coalescer._batches):
+            coalescer.flush()
+        self._event.wait()
+        if self._exception is not None:
+            raise self._exception
+
+    def _finish(self, command, exception=None):
+        self.command = command
+        self._exception = exception
+        self._event.set()
+
+def _merge(operations):
+    """
+        This function groups the operations into commands. An operation joins
+        the latest command with the same verb and parameters, unless that
+        command already has one of its ports or a command sent after it
+        touches them, so every port sees its operations in the order given.
+
+        :returns: the operations of every command in sending order.
+        :rtype: list of lists
+    """
+    commands = []
+    for operation in operations:
+        touched = operation._touched()
+        target = None
+        for command in reversed(commands):
+            if command['ports'] & touched:
+                break
+            if (command['verb'], command['rest']) == (operation.verb, operation.rest):
+                target = command
+                break
+        if target is None:
+            target = {'verb': operation.verb, 'rest': operation.rest, 'ports': set(), 'operations': []}
+            commands.append(target)
+        target['ports'].update(touched)
+        target['operations'].append(operation)
+    return [command['operations'] for command in commands]
+
+def _command(operations):
+    first = operations[0]
+    aid = _tl1._list([port for operation in operations for port in operation.ports])
+    if first.verb == 'ent-patch':
+        aid += _tl1._valsep + _tl1._list([port for operation in operations for port in operation.egress])
+    return '%s::%s:%d%s;\n' % (first.verb, aid, _tl1._ctag, first.rest)
+
+class Coalescer(object):
+    """
+        Merges the single port patch, port flap and shutter operations given
+        within a short window, or inside a :meth:`batch`, into the fewest
+        TL1 commands with '&' joined port lists, so that e.g. 16 ports are
+        switched by one command at nearly the same time.
+
+        Every operation returns its own pending result. The merged commands
+        are pipelined, so they cost about one round trip together. When the
+        switch denies a merged command, which then changed nothing, its
+        operations are sent again one by one, so each caller gets the deny of
+        its own ports only.
+
+        Example::
+
+            coalescer = session.coalescer()
+            with coalescer.batch():
+                results = [coalescer.removeConnection(port) for port in range(1, 17)]
+            for result in results:
+                result.result()
+    """
+    def __init__(self, session, window=0.0, lock=None):
+        """
+            :param session: the socket of the logged in session, like for :class:`CrossConnection`.
+            :type session: socket
+
+            :param window: the time in seconds operations are collected after the first one, 0 to send every operation at once outside a batch.
+            :type window: float
+
+            :param lock: the lock held while sending, when other threads use the socket too.
+            :type lock: threading.Lock
+        """
+        self.session = session
+        self.window = window
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._sending = lock or threading.Lock()
+        self._pending = []
+        self._batches = 0
+        self._timer = None
+
+    def submit(self, tl1_cmd):
+        """
+            This function queues a TL1 command that :func:`parse` accepts.
+
+            :returns: the pending result.
+            :rtype: _Operation
+
+            :raises ValueError: if the command can not be merged.
+        """
+        parsed = parse(tl1_cmd)
+        if parsed is None:
+            raise ValueError('Command can not be coalesced: %s' % tl1_cmd.strip())
+        return self._queue(_Operation(self, *parsed))
+
+    def _queue(self, operation):
+        with self._lock:
+            self._pending.append(operation)
+            if self._batches or self._timer is not None:
+                return operation
+            if self.window > 0:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+                return operation
+        self.flush()
+        return operation
+
+    def _forced(self, forced):
+        return ':frcd' if forced == True else ''
+
+    def setConnection(self, inputPorts, outputPorts, forced=False):
+        """
+            Queues ent-patch of the ports, see :meth:`CrossConnection.setConnection`.
+        """
+        return self._queue(_Operation(self, 'ent-patch', _portsOf(_tl1._list(inputPorts)), _portsOf(_tl1._list(outputPorts)),
+                                      _tl1._portsep + self._forced(forced)))
+
+    def removeConnection(self, ports, forced=False):
+        """
+            Queues dlt-patch of the ports, see :meth:`CrossConnection.removeConnection`.
+        """
+        return self._queue(_Operation(self, 'dlt-patch', _portsOf(_tl1._list(ports)), None, _tl1._portsep + self._forced(forced)))
+
+    def setShutter(self, ports, interv, forced=False):
+        """
+            Queues a port flap of the ports, see :meth:`CrossConnection.setShutter`.
+            Only ports with the same interv share a command.
+        """
+        return self._queue(_Operation(self, 'ent-port-flap', _portsOf(_tl1._list(ports)), None,
+                                      '%s%s%s%s%s' % (_tl1._portsep, _tl1._portsep, _tl1._values(interv), _tl1._portsep, self._forced(forced))))
+
+    def closeShutter(self, ports):
+        """
+            Queues opr-port-shutter, i.e. the ports go dark.
+        """
+        return self._queue(_Operation(self, 'opr-port-shutter', _portsOf(_tl1._list(ports)), None, _tl1._portsep))
+
+    def openShutter(self, ports):
+        """
+            Queues rls-port-shutter, i.e. the ports get light again.
+        """
+        return self._queue(_Operation(self, 'rls-port-shutter', _portsOf(_tl1._list(ports)), None, _tl1._portsep))
+
+    def batch(self):
+        """
+            This function returns a context manager collecting the operations
+            given inside it, they are sent when it is left.
+        """
+        return _Batch(self)
+
+    def flush(self):
+        """
+            Sends the pending operations and waits for their responses.
+        """
+        with self._sending:
+            with self._lock:
+                operations, self._pending = self._pending, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if operations:
+                self._send(operations)
+
+    def _send(self, operations):
+        """
+            Pipelines the merged commands. A command touching a port of one
+            still in flight waits for it, including the one by one retries of
+            a denied command, so the order of the operations of a port holds.
+        """
+        pipeline = _tl1._pipelines.get(self.session) or _tl1._Pipeline(self.session)
+        inflight = []
+        ports = set()
+        for group in _merge(operations):
+            touched = set().union(*[operation._touched() for operation in group])
+            if ports & touched:
+                self._complete(pipeline, inflight)
+                inflight, ports = [], set()
+            inflight.append((group, self._submit(pipeline, group)))
+            ports |= touched
+        self._complete(pipeline, inflight)
+
+    def _submit(self, pipeline, group):
+        tl1_cmd = _command(group)
+        logger.debug(tl1_cmd)
+        self.commands += 1
+        return tl1_cmd, pipeline.submit(tl1_cmd)
+
+    def _complete(self, pipeline, inflight):
+        retries = []
+        for group, (tl1_cmd, future) in inflight:
+            try:
+                future.result()
+            except _tl1._Tl1Error as err:
+                if len(group) > 1:
+                    logger.info('%s denied (%s), sending its %d operations one by one', tl1_cmd.strip(), err.code, len(group))
+                    retries.extend(([operation], self._submit(pipeline, [operation])) for operation in group)
+                    continue
+                exception = err
+            except Exception as err:
+                exception = err
+            else:
+                exception = None
+            for operation in group:
+                operation._finish(tl1_cmd, exception)
+        if retries:
+            self._complete(pipeline, retries)
+
+class _Batch(object):
+
+    def __init__(self, coalescer):
+        self._coalescer = coalescer
+
+    def __enter__(self):
+        with self._coalescer._lock:
+            self._coalescer._batches += 1
+        return self._coalescer
+
+    def __exit__(self, type, value, traceback):
+        with self._coalescer._lock:
+            self._coalescer._batches -= 1
+            last = self._coalescer._batches == 0
+        if last:
+            self._coalescer.flush()
@@ -3,18 +3,13 @@ import os.path
 import logging
 import socket
 import _tl1
+from portset import PortSet
 import sys
 import json
 import os
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
 
 class CrossConnectionError(Exception):
     """
@@ -33,6 +28,49 @@ class CrossConnectionError(Exception):
     def setMessage(self, message):
 	self.message = message
 
+def _connectionList(lines):
+    """
+        This function returns the ingress, egress tuples of rtrv-patch lines.
+    """
+    connectionList = []
+    for line in lines:
+        if line:
+            ingress, egress = line.split(_tl1._valsep)
+            connectionList.append((int(ingress.strip()[1:]), int(egress.strip()[:-1])))
+    return connectionList
+
+def _shutterList(lines):
+    """
+        This function returns the unquoted rtrv-port-flap lines.
+    """
+    return [line.strip().strip('"') for line in lines]
+
+def _diff(current, target):
+    """
+        This function computes the minimal changes that turn the current
+        patch table into the target one. Both are ingress to egress
+        dictionaries. The returned plan holds the patches to delete, the
+        ingress ports to move to another egress, the patches to add and the
+        moved ingress ports that have to be released first because the new
+        egress of a moved or added ingress is still in use by them.
+    """
+    plan = {'delete': [], 'move': [], 'add': [], 'release': []}
+    for ingress, egress in sorted(current.items()):
+        if ingress not in target:
+            plan['delete'].append((ingress, egress))
+    owner = dict((egress, ingress) for ingress, egress in current.items() if ingress in target)
+    for ingress, egress in sorted(target.items()):
+        if ingress not in current:
+            plan['add'].append((ingress, egress))
+        elif current[ingress] != egress:
+            plan['move'].append((ingress, current[ingress], egress))
+        else:
+            continue
+        if owner.get(egress, ingress) != ingress:
+            plan['release'].append(owner[egress])
+    plan['release'].sort()
+    return plan
+
 class CrossConnection(object):
 
     def __init__(self, session):
@@ -64,13 +102,23 @@ class CrossConnection(object):
     def _impexp_check_error(self):
         self._parseTl1Error(_tl1._impexp_check_error)
 
+    def _request(self, tl1_cmd, parse=None, opr=None):
+        """
+            Sends the command and returns the parsed response, or its future
+            when the session is in pipelined mode.
+        """
+        if opr == 'import' or opr == 'export':
+            return _tl1._request(self.session, tl1_cmd, CrossConnectionError(), parse, impexp=True)
+        logger.debug(tl1_cmd)
+        return _tl1._request(self.session, tl1_cmd, CrossConnectionError(), parse)
+
     def setConnection(self, inputPorts, outputPorts, forced=False, opr=None):
         """
             :param inputPorts: these are the ingress ports.
-            :type inputPorts: list of integers
+            :type inputPorts: list of integers or PortSet
 
             :param outputPorts: these are the egress ports.
-            :type outputPorts: list of integers
+            :type outputPorts: list of integers or PortSet
 
             :param forced: boolean parameter defining whether APS should affect the outcome of the attempt. If it is forced, then the ports are always added.
             :type forced: bool
@@ -83,26 +131,23 @@ class CrossConnection(object):
         if opr == 'import':
             tl1_cmd = 'dlt-patch::all:%d:%s;\n' % (_tl1._ctag, ':frcd' if forced == True else '')
             #logger.info(tl1_cmd)
-            self.session.sendall(tl1_cmd)
-            self._impexp_check_error()
+            _tl1._call(self.session, tl1_cmd, CrossConnectionError(), impexp=True)
         else:
             pass
         tl1_cmd = 'ent-patch::%s,%s:%d:%s;\n' % (_tl1._list(inputPorts), _tl1._list(outputPorts), _tl1._ctag, ':frcd' if forced == True else '')
-        self.session.sendall(tl1_cmd)
         if opr == 'import' or opr == 'export':
             try:
-                self._impexp_check_error()
+                _tl1._call(self.session, tl1_cmd, CrossConnectionError(), impexp=True)
                 logger.info("Import operation completed.")
             except Exception as err:
                 logger.info("Import operation failed.")
         else:
-            logger.info(tl1_cmd)
-            self._check_error()
+            return self._request(tl1_cmd)
 
     def removeConnection(self, ports=None, forced=False, opr=None):
         """
             :param ports: the number of the ingress and egress ports. This defaults to the all connected ports if not specified.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param forced: defines whether APS should affect the outcome of the attempt. If it is forced, then the ports are always deleted.
             :type forced: bool
@@ -113,12 +158,7 @@ class CrossConnection(object):
             See also :meth:`setConnection` and :meth:`connection`.
         """
         tl1_cmd = 'dlt-patch::%s:%d:%s;\n' % (_tl1._list(ports), _tl1._ctag, ':frcd' if forced == True else '')
-        self.session.sendall(tl1_cmd)
-        if opr == 'import' or opr == 'export':
-            self._impexp_check_error()
-        else:
-            logger.info(tl1_cmd)
-            self._check_error()
+        return self._request(tl1_cmd, opr=opr)
 
 #-------------------------------------------------------------------------------
 # THL input:    06.Dez 2019
@@ -126,7 +166,7 @@ class CrossConnection(object):
     def setShutter(self, ports=None, interv=None, forced=False, opr=None):
         """
             :param ports: the number of the ingress and egress ports. This defaults to the all connected ports if not specified.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :interv:  offintv,onintvl,cycles -  eg: 10000,300,1
 
@@ -138,13 +178,8 @@ class CrossConnection(object):
 
             See also :meth:`setConnection` and :meth:`connection`.
         """
-        tl1_cmd = 'ent-port-flap::%s:%d::%s:%s;\n' % (_tl1._list(ports), _tl1._ctag, _tl1._list(interv), ':frcd' if forced == True else '')
-        self.session.sendall(tl1_cmd)
-        if opr == 'import' or opr == 'export':
-            self._impexp_check_error()
-        else:
-            logger.info(tl1_cmd)
-            self._check_error()
+        tl1_cmd = 'ent-port-flap::%s:%d::%s:%s;\n' % (_tl1._list(ports), _tl1._ctag, _tl1._values(interv), ':frcd' if forced == True else '')
+        return self._request(tl1_cmd, opr=opr)
 
 
 #-------------------------------------------------------------------------------
@@ -153,23 +188,18 @@ class CrossConnection(object):
     def queryShutter(self, ports=None, forced=False, opr=None):
         """
             :param ports: the number of the ingress and egress ports. This defaults to the all connected ports if not specified.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param forced: defines whether APS should affect the outcome of the attempt. If it is forced, then the ports are always deleted.
             :type forced: bool
 
-            :returns: None
-            :rtype: None
+            :returns: the port flap settings as reported by the switch, one string per port.
+            :rtype: list of strings
 
             See also :meth:`setConnection` and :meth:`connection`.
         """
         tl1_cmd = 'rtrv-port-flap::%s:%d::%s;\n' % (_tl1._list(ports), _tl1._ctag, ':frcd' if forced == True else '')
-        self.session.sendall(tl1_cmd)
-        if opr == 'import' or opr == 'export':
-            self._impexp_check_error()
-        else:
-            logger.info(tl1_cmd)
-            self._check_error()
+        return self._request(tl1_cmd, _shutterList, opr=opr)
 
 #-------------------------------------------------------------------------------
 
@@ -179,7 +209,7 @@ class CrossConnection(object):
             specified.
 
             :param inputPorts: The number of the ingress ports. This defaults to the all connected input ports if not specified.
-            :type inputPorts: list of integers
+            :type inputPorts: list of integers or PortSet
 
             :returns: the connection list.
             :rtype: list of ingress, egress tuples
@@ -187,19 +217,64 @@ class CrossConnection(object):
             See also :meth:`setConnection` and :meth:`removeConnection`.
         """
         tl1_cmd = 'rtrv-patch::%s:%d:;\n' % (_tl1._list(inputPorts), _tl1._ctag)
-        self.session.sendall(tl1_cmd)
-        if opr == 'import' or opr == 'export':
-            self._impexp_check_error()
-        else:
-            logger.info(tl1_cmd)
-            #self._check_error()
+        return self._request(tl1_cmd, _connectionList, opr=opr)
+
+    def apply(self, target, forced=False, dryRun=False, opr=None):
+        """
+            Changes the cross connections of the switch to the target state
+            with the fewest port operations. The current patch table is read
+            once, then the patches not in the target are deleted with one
+            dlt-patch and the moved and missing patches are set up with one
+            ent-patch. Ports that already have their target connection are
+            not touched, so their light is never interrupted.
+
+            :param target: the connections the switch should have.
+            :type target: list of ingress, egress tuples or dictionary of ingress to egress
+
+            :param forced: defines whether APS should affect the outcome of the attempt.
+            :type forced: bool
 
-        connectionList = []
-        for line in self._splitlines():
-	    if line:
-		ingress, egress = line.split(_tl1._valsep)
-		connectionList.append((int(ingress.strip()[1:]), int(egress[:-1])))
-        #return connectionList
+            :param dryRun: only compute and log the plan, do not change anything.
+            :type dryRun: bool
+
+            :returns: the plan with the 'delete', 'move' and 'add' lists of the changes and the 'release' list of moved ingress ports that are deleted first.
+            :rtype: dictionary
+
+            :raises CrossConnectionError: if the switch denied the dlt-patch or the ent-patch.
+
+            See also :meth:`connection` and :meth:`setConnection`.
+        """
+        impexp = opr == 'import' or opr == 'export'
+        tl1_cmd = 'rtrv-patch:::%d:;\n' % (_tl1._ctag)
+        current = dict(_tl1._call(self.session, tl1_cmd, CrossConnectionError(), _connectionList, impexp))
+        target = dict((int(ingress), int(egress)) for ingress, egress in (target.items() if isinstance(target, dict) else target))
+        plan = _diff(current, target)
+        for ingress, egress in plan['delete']:
+            logger.info('- %d,%d', ingress, egress)
+        for ingress, egress, newEgress in plan['move']:
+            logger.info('~ %d,%d -> %d,%d', ingress, egress, ingress, newEgress)
+        for ingress, egress in plan['add']:
+            logger.info('+ %d,%d', ingress, egress)
+        logger.info('%d unchanged, %d to delete, %d to move, %d to add', len(target) - len(plan['move']) - len(plan['add']), len(plan['delete']), len(plan['move']), len(plan['add']))
+        if dryRun:
+            return plan
+        deletes = PortSet(ingress for ingress, egress in plan['delete']) | plan['release']
+        if deletes:
+            tl1_cmd = 'dlt-patch::%s:%d:%s;\n' % (_tl1._list(deletes), _tl1._ctag, ':frcd' if forced == True else '')
+            logger.debug(tl1_cmd)
+            self._execute(tl1_cmd, impexp)
+        patches = sorted([(ingress, egress) for ingress, oldEgress, egress in plan['move']] + plan['add'])
+        if patches:
+            tl1_cmd = 'ent-patch::%s,%s:%d:%s;\n' % (_tl1._list([ingress for ingress, egress in patches]), _tl1._list([egress for ingress, egress in patches]), _tl1._ctag, ':frcd' if forced == True else '')
+            logger.debug(tl1_cmd)
+            self._execute(tl1_cmd, impexp)
+        return plan
+
+    def _execute(self, tl1_cmd, impexp):
+        try:
+            _tl1._execute(self.session, tl1_cmd, impexp)
+        except _tl1._Tl1Error as err:
+            raise CrossConnectionError('%s denied: %s %s' % (tl1_cmd.strip(), err.code, err.message))
 
     def export_connection(self, filename, opr=None):
         """
@@ -209,34 +284,37 @@ class CrossConnection(object):
             :type filename: string.
         """
         tl1_cmd = 'rtrv-patch:::%d:;\n' % (_tl1._ctag)
-        self.session.sendall(tl1_cmd)
         logger.info("Exporting the current connection state in a file...")
+        lines = _tl1._call(self.session, tl1_cmd, CrossConnectionError(), list, impexp=True)
 
         key = 'portconns'
         connectionDict = {}
 
-        for line in self._impexp_splitlines():
+        for line in lines:
             connectionDict.setdefault(key, [])
             c = line[4:-1]
             out =  c.split(',')
             connectionDict[key].append(out)
-        j =  json.dumps(connectionDict , ensure_ascii=False)
-        obj = json.loads(j)
-        json_output =  json.dumps(obj,sort_keys=True, indent=4)
+        json_output =  json.dumps(connectionDict, sort_keys=True, indent=4)
         #filename  = filename+ '_' + strftime("%Y-%m-%dT%H-%M-%S") +'.json'
         filename  = filename +'.json'
-        f_open = open(filename, 'wb')
-        f_open.write(json_output)
-        f_open.close
+        with open(filename, 'wb') as f_open:
+            f_open.write(json_output)
         logger.info("Export operation completed.")
 
 
-    def import_connection(self, filename):
+    def import_connection(self, filename, dryRun=False):
         """
-            Read json file and create cross connections based on that.
+            Read json file and create cross connections based on that. Only
+            the connections that differ from the file are changed.
 
             :param filename: file with json extension.
             :type filename: string.
+
+            :param dryRun: only log the differences, do not change anything.
+            :type dryRun: bool
+
+            See also :meth:`apply`.
         """
         if os.path.isfile(filename):
             pass
@@ -267,7 +345,8 @@ class CrossConnection(object):
                     for ind in range(0,len(conn_list_1)):
                         ingrlst.append(str(python_obj.values()[index][ind][0]))
                         egrlst.append(str(python_obj.values()[index][ind][1]))
-                self.setConnection(ingrlst, egrlst, opr = 'import')
+                self.apply(zip(ingrlst, egrlst), dryRun=dryRun, opr = 'import')
+                logger.info("Import operation completed.")
         except ValueError, e:
             logger.error('Not a valid file.Import operation failed.')
             exit(1)
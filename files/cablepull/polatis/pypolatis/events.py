@@ -0,0 +1,302 @@
+import Queue
+import logging
+import re
+import socket
+import threading
+import time
+from datetime import datetime
+
+import _tl1
+from portset import PortSet
+from session import Session
+
+logger = logging.getLogger(__name__)
+
+_conditions = ('LOS', 'DEGRADED')
+_cleared = 'CL'
+_portField = re.compile(r'^\s*"?\s*(\d+(?:\s*(?:&&|&|-)\s*\d+)*)')
+_timestamp = re.compile(r'(\d{2,4}-\d{2}-\d{2})\s+(\d{2}:\d{2}:\d{2})\s*$')
+
+def _switchTime(header):
+    """
+        This function returns the time stamp of an autonomous message header
+        like 'SWITCH 2021-02-03 10:00:00', or None if it has none.
+    """
+    match = _timestamp.search(header or '')
+    if match is None:
+        return None
+    date, clock = match.groups()
+    for layout in ('%Y-%m-%d %H:%M:%S', '%y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime('%s %s' % (date, clock), layout)
+        except ValueError:
+            continue
+    return None
+
+def _ports(lines):
+    ports = PortSet()
+    for line in lines:
+        match = _portField.match(line)
+        if match is None:
+            continue
+        ports |= match.group(1)
+    return ports
+
+def _fields(lines):
+    return [field.strip().strip('"\\').upper() for line in lines for field in re.split(r'[,:]', line)]
+
+class Event(object):
+    """
+        An autonomous message of a switch.
+
+        kind is 'patch', 'alarm', 'flap' or 'event' for the other messages,
+        switchTime the time stamp of the message header as reported by the
+        switch and hostTime the time.time() at which it was received.
+    """
+    kind = 'event'
+
+    def __init__(self, host, message, hostTime):
+        self.host = host
+        self.atag = message.atag
+        self.alarmCode = message.alarmCode
+        self.verb = message.verb
+        self.lines = [line.strip() for line in message.lines]
+        self.switchTime = _switchTime(message.header)
+        self.hostTime = hostTime
+        self.ports = _ports(self.lines)
+
+    def __repr__(self):
+        return '%s(%s %s %s ports=%s)' % (type(self).__name__, self.host, self.atag, self.verb, self.ports)
+
+class PatchEvent(Event):
+    """
+        A cross connection has been made or removed.
+    """
+    kind = 'patch'
+
+class AlarmEvent(Event):
+    """
+        A power monitor alarm has been raised or cleared. condition is 'LOS'
+        or 'DEGRADED' and cleared tells whether the alarm went away.
+    """
+    kind = 'alarm'
+
+    def __init__(self, host, message, hostTime):
+        super(AlarmEvent, self).__init__(host, message, hostTime)
+        fields = _fields(self.lines)
+        self.condition = next((field for field in fields if field in _conditions), None)
+        self.cleared = _cleared in fields
+
+class FlapEvent(Event):
+    """
+        A port flap sequence has completed.
+    """
+    kind = 'flap'
+
+def _event(host, message, hostTime):
+    """
+        This function returns the typed event of an autonomous message.
+    """
+    verb = message.verb.upper()
+    if 'FLAP' in verb or 'SHUTTER' in verb:
+        return FlapEvent(host, message, hostTime)
+    if 'PATCH' in verb:
+        return PatchEvent(host, message, hostTime)
+    if 'ALM' in verb or 'PMON' in verb or any(field in _conditions for field in _fields(message.lines)):
+        return AlarmEvent(host, message, hostTime)
+    return Event(host, message, hostTime)
+
+class _Subscription(object):
+
+    def __init__(self, callback, kinds, ports, condition):
+        self.callback = callback
+        self.kinds = None if kinds is None else set([kinds] if isinstance(kinds, basestring) else kinds)
+        self.ports = None if ports is None else PortSet(ports)
+        self.condition = condition
+
+    def matches(self, event):
+        if self.kinds is not None and event.kind not in self.kinds:
+            return False
+        if self.ports is not None and not (self.ports & event.ports):
+            return False
+        if self.condition is not None and getattr(event, 'condition', None) != self.condition:
+            return False
+        return True
+
+class EventListener(object):
+    """
+        Receives the autonomous messages of a switch on a dedicated session
+        and hands them to the subscribers as typed events.
+
+        The session runs in a background thread that keeps it alive with a
+        header retrieval when the switch has been quiet for keepalive
+        seconds, and logs in again when the switch drops it.
+
+        Example::
+
+            listener = EventListener('admin', 'root', '10.30.222.136')
+            listener.start()
+            event = listener.waitFor('alarm', ports=[12], condition='LOS', timeout=30)
+            listener.stop()
+    """
+    def __init__(self, username, password, host='localhost', keepalive=60, retry=5):
+        """
+            Initializes an event listener.
+
+            :param username: the name of the user.
+            :type username: string
+
+            :param password: the password credential of the user.
+            :type password: string
+
+            :param host: the host address of the switch.
+            :type host: string
+
+            :param keepalive: the idle time in seconds after which the session is kept alive.
+            :type keepalive: float
+
+            :param retry: the time in seconds to wait before logging in again after a dropped session.
+            :type retry: float
+        """
+        self.username = username
+        self.password = password
+        self.host = host
+        self.keepalive = keepalive
+        self.retry = retry
+        self._session = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    def start(self):
+        """
+            Starts listening in a background thread.
+        """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+            Stops listening and closes the session.
+        """
+        self._stopped.set()
+        session = self._session
+        if session is not None and session.socket is not None:
+            try:
+                session.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def subscribe(self, callback, kinds=None, ports=None, condition=None):
+        """
+            This function registers a callback for the matching events. The
+            callback runs in the listener thread and must not block.
+
+            :param callback: the function called with every matching :class:`Event`.
+            :type callback: callable
+
+            :param kinds: the event kinds out of 'patch', 'alarm', 'flap' and 'event'. This defaults to all kinds.
+            :type kinds: string or list of strings
+
+            :param ports: the ports of interest. This defaults to all ports.
+            :type ports: list of integers or PortSet
+
+            :param condition: the alarm condition, *LOS* or *DEGRADED*. This defaults to any condition.
+            :type condition: string
+
+            :returns: the subscription to pass to :meth:`unsubscribe`.
+        """
+        subscription = _Subscription(callback, kinds, ports, condition)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+            This function removes a subscription.
+        """
+        with self._lock:
+            self._subscriptions.remove(subscription)
+
+    def events(self, kinds=None, ports=None, condition=None, timeout=None):
+        """
+            This function yields the matching events as they arrive.
+
+            :param timeout: the time in seconds to wait for the next event. This defaults to waiting forever.
+            :type timeout: float
+
+            The other parameters are those of :meth:`subscribe`. The iteration
+            ends when no event arrived within the timeout.
+        """
+        queue = Queue.Queue()
+        subscription = self.subscribe(queue.put, kinds, ports, condition)
+        try:
+            while True:
+                try:
+                    yield queue.get(timeout=timeout)
+                except Queue.Empty:
+                    return
+        finally:
+            self.unsubscribe(subscription)
+
+    def waitFor(self, kinds=None, ports=None, condition=None, timeout=None):
+        """
+            This function waits for the first matching event, e.g. the LOS
+            alarm of the port whose cable has been pulled.
+
+            The parameters are those of :meth:`events`.
+
+            :returns: the event, or None if none arrived within the timeout.
+            :rtype: Event
+        """
+        for event in self.events(kinds, ports, condition, timeout):
+            return event
+        return None
+
+    def _dispatch(self, message):
+        event = _event(self.host, message, time.time())
+        logger.debug('%r', event)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                try:
+                    subscription.callback(event)
+                except Exception:
+                    logger.exception('event callback failed')
+
+    def _listen(self):
+        session = Session(self.username, self.host)
+        session.timeout = self.keepalive
+        self._session = session
+        session.login(self.password)
+        parser = _tl1._parser(session.socket)
+        parser.listeners.append(self._dispatch)
+        records = parser.records()
+        while not self._stopped.is_set():
+            try:
+                next(records)
+            except socket.timeout:
+                parser.send('rtrv-hdr:::%d:;\n' % _tl1._ctag)
+                records = parser.records()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except (socket.error, _tl1._Tl1Error, SystemExit) as err:
+                # Session.login exits on connection and authentication failures
+                if self._stopped.is_set():
+                    break
+                logger.info('event session to %s dropped (%s), logging in again', self.host, err)
+            finally:
+                if self._session is not None and self._session.socket is not None:
+                    self._session.socket.close()
+                self._session = None
+            self._stopped.wait(self.retry)
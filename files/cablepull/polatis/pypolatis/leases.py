@@ -0,0 +1,329 @@
+import SocketServer
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from cablepull import _monotonic
+from portset import PortSet
+
+logger = logging.getLogger(__name__)
+
+class LeaseError(Exception):
+    """
+        Exception raised when a lease could not be granted or kept.
+    """
+    def __init__(self, message = None, conflicts=None):
+        """
+            :param message: explanation of the error.
+            :type message: string
+
+            :param conflicts: the leases holding ports that were asked for, as returned by :meth:`LeaseClient.leases`.
+            :type conflicts: list of dictionaries
+        """
+        super(LeaseError, self).__init__(message)
+        self.message = message
+        self.conflicts = conflicts or []
+
+class LeaseTable(object):
+    """
+        The leases of ports on switches. A lease expires ttl seconds after it
+        was granted or last renewed. Two leases on the same switch never hold
+        a common port. The table is thread safe and works on a monotonic
+        clock, expired leases are dropped whenever the table is used.
+    """
+    def __init__(self, clock=None):
+        self._clock = clock or _monotonic()
+        self._lock = threading.Lock()
+        self._leases = {}
+
+    def _expire(self, now):
+        for lease, entry in self._leases.items():
+            if entry['expires'] <= now:
+                logger.info('lease %s of %s on %s ports %s expired', lease, entry['owner'], entry['switch'], entry['ports'])
+                del self._leases[lease]
+
+    def _public(self, lease, entry, now):
+        return {'lease': lease, 'switch': entry['switch'], 'ports': str(entry['ports']),
+                'owner': entry['owner'], 'ttl': entry['ttl'], 'remaining': entry['expires'] - now}
+
+    def acquire(self, switch, ports, owner, ttl):
+        """
+            Grants a lease of the ports, or returns the conflicting leases.
+
+            :returns: the lease and None, or None and the conflicting leases.
+            :rtype: tuple
+        """
+        ports = PortSet(ports)
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            conflicts = [self._public(lease, entry, now) for lease, entry in sorted(self._leases.items())
+                         if entry['switch'] == switch and entry['ports'] & ports]
+            if conflicts:
+                return None, conflicts
+            lease = uuid.uuid4().hex
+            self._leases[lease] = {'switch': switch, 'ports': ports, 'owner': owner, 'ttl': ttl, 'expires': now + ttl}
+            logger.info('lease %s of %s on %s ports %s granted', lease, owner, switch, ports)
+            return self._public(lease, self._leases[lease], now), None
+
+    def renew(self, lease):
+        """
+            Extends a lease by its ttl.
+
+            :returns: the lease, or None if it is unknown or expired.
+            :rtype: dictionary
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            entry = self._leases.get(lease)
+            if entry is None:
+                return None
+            entry['expires'] = now + entry['ttl']
+            return self._public(lease, entry, now)
+
+    def release(self, lease):
+        """
+            Drops a lease.
+
+            :returns: whether the lease was held.
+            :rtype: bool
+        """
+        with self._lock:
+            entry = self._leases.pop(lease, None)
+            if entry is not None:
+                logger.info('lease %s of %s on %s ports %s released', lease, entry['owner'], entry['switch'], entry['ports'])
+            return entry is not None
+
+    def leases(self, switch=None):
+        """
+            Returns the current leases, of one switch if given.
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            return [self._public(lease, entry, now) for lease, entry in sorted(self._leases.items())
+                    if switch is None or entry['switch'] == switch]
+
+class _LeaseHandler(SocketServer.StreamRequestHandler):
+    """
+        Handles one JSON request line and answers with one JSON line.
+    """
+    def handle(self):
+        table = self.server.table
+        try:
+            request = json.loads(self.rfile.readline())
+            op = request['op']
+            if op == 'acquire':
+                lease, conflicts = table.acquire(request['switch'], request['ports'], request['owner'], float(request['ttl']))
+                response = {'ok': lease is not None, 'lease': lease, 'conflicts': conflicts}
+            elif op == 'renew':
+                lease = table.renew(request['lease'])
+                response = {'ok': lease is not None, 'lease': lease}
+            elif op == 'release':
+                response = {'ok': table.release(request['lease'])}
+            elif op == 'leases':
+                response = {'ok': True, 'leases': table.leases(request.get('switch'))}
+            else:
+                response = {'ok': False, 'error': 'unknown op %s' % op}
+        except (KeyError, ValueError, TypeError) as err:
+            response = {'ok': False, 'error': 'invalid request: %s' % err}
+        self.wfile.write(json.dumps(response) + '\n')
+
+class LeaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+        TCP server granting port leases to the cable pull runs of all hosts.
+
+        Example::
+
+            server = LeaseServer(('localhost', 0)).start()
+            client = LeaseClient(server.server_address)
+            ...
+            server.stop()
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('', 3083), table=None):
+        """
+            Initializes a lease server.
+
+            :param address: the host and port to listen on.
+            :type address: tuple
+
+            :param table: the lease table. This defaults to an empty one.
+            :type table: LeaseTable
+        """
+        SocketServer.TCPServer.__init__(self, address, _LeaseHandler)
+        self.table = table or LeaseTable()
+        self._thread = None
+
+    def start(self):
+        """
+            Starts serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+            Stops serving and closes the listening socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class Lease(object):
+    """
+        A granted lease. It expires unless it is renewed within its ttl,
+        :meth:`keepAlive` renews it in a background thread. Used as a context
+        manager the lease is kept alive inside the block and released at its
+        end.
+    """
+    def __init__(self, client, lease):
+        self.client = client
+        self.lease = lease['lease']
+        self.switch = lease['switch']
+        self.ports = PortSet(lease['ports'])
+        self.ttl = lease['ttl']
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def renew(self):
+        """
+            Extends the lease by its ttl.
+
+            :raises LeaseError: if the lease expired.
+        """
+        if not self.client._request({'op': 'renew', 'lease': self.lease})['ok']:
+            raise LeaseError('lease %s on %s ports %s expired' % (self.lease, self.switch, self.ports))
+
+    def _heartbeat(self):
+        while not self._stopped.wait(self.ttl / 3.0):
+            try:
+                self.renew()
+            except LeaseError as err:
+                logger.error('%s', err)
+                return
+            except socket.error as err:
+                # the next heartbeat may still come in time
+                logger.warning('lease server not reachable: %s', err)
+
+    def keepAlive(self):
+        """
+            Renews the lease every third of its ttl in a background thread
+            until it is released.
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._heartbeat)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def release(self):
+        """
+            Stops the heartbeats and gives the ports free.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.client._request({'op': 'release', 'lease': self.lease})
+
+    def __enter__(self):
+        return self.keepAlive()
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+class LeaseClient(object):
+    """
+        Client of a :class:`LeaseServer`.
+
+        Example::
+
+            client = LeaseClient(('bistro', 3083))
+            with client.acquire('10.30.222.136', '12-13', ttl=60, wait=3600):
+                ...
+    """
+    def __init__(self, address, owner=None, timeout=10):
+        """
+            :param address: the host and port of the lease server.
+            :type address: tuple
+
+            :param owner: the name shown to the runs waiting for the ports. This defaults to the host name and process id.
+            :type owner: string
+
+            :param timeout: the time in seconds to wait for the server.
+            :type timeout: float
+        """
+        self.address = address
+        self.owner = owner or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.timeout = timeout
+
+    def _request(self, message):
+        sock = socket.create_connection(self.address, self.timeout)
+        try:
+            sock.sendall(json.dumps(message) + '\n')
+            response = sock.makefile().readline()
+        finally:
+            sock.close()
+        if not response:
+            raise socket.error('lease server closed the connection')
+        return json.loads(response)
+
+    def acquire(self, switch, ports, ttl=60, wait=None, poll=5):
+        """
+            This function leases ports of a switch.
+
+            :param switch: the name or address of the switch.
+            :type switch: string
+
+            :param ports: the ports.
+            :type ports: list of integers or PortSet
+
+            :param ttl: the time in seconds after which the lease expires unless renewed.
+            :type ttl: float
+
+            :param wait: the time in seconds to wait for conflicting leases to go away. This defaults to not waiting.
+            :type wait: float
+
+            :param poll: the time in seconds between attempts while waiting.
+            :type poll: float
+
+            :returns: the lease.
+            :rtype: Lease
+
+            :raises LeaseError: if other leases hold some of the ports, its conflicts lists them.
+        """
+        clock = _monotonic()
+        deadline = None if wait is None else clock() + wait
+        while True:
+            response = self._request({'op': 'acquire', 'switch': switch, 'ports': str(PortSet(ports)), 'owner': self.owner, 'ttl': ttl})
+            if response['ok']:
+                return Lease(self, response['lease'])
+            if 'error' in response:
+                raise LeaseError(response['error'])
+            conflicts = response['conflicts']
+            if deadline is None or clock() >= deadline:
+                raise LeaseError('ports of %s held by %s' % (switch, ', '.join('%s (%s)' % (conflict['owner'], conflict['ports']) for conflict in conflicts)), conflicts)
+            logger.info('waiting for %s', ', '.join('%s (%s)' % (conflict['owner'], conflict['ports']) for conflict in conflicts))
+            time.sleep(min(poll, max(0, deadline - clock())))
+
+    def leases(self, switch=None):
+        """
+            This function returns the current leases.
+
+            :returns: the lease, switch, ports, owner, ttl and remaining seconds of every lease.
+            :rtype: list of dictionaries
+        """
+        return self._request({'op': 'leases', 'switch': switch})['leases']
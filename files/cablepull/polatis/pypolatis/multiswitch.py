@@ -0,0 +1,158 @@
+import logging
+import socket
+import threading
+import time
+
+import _tl1
+import crossconnect
+import pmon
+from session import Session
+
+logger = logging.getLogger(__name__)
+
+_switches = ('10.30.222.136', '10.30.222.137', '10.30.222.138', '10.30.222.139')
+
+class MultiSwitchError(Exception):
+    """
+        Exception raised for a switch that failed during a multi-switch operation.
+    """
+    def __init__(self, host, message = None):
+        """
+            :param host: the host address of the switch that failed.
+            :type host: string
+
+            :param message: explanation of the error.
+            :type message: string
+
+            See also :class:`MultiSwitch`.
+        """
+        super(MultiSwitchError, self).__init__('Failed on switch {0}: {1}'.format(host, message))
+        self.host = host
+        self.message = message
+
+def _snapshot(session):
+    return crossconnect.CrossConnection(session.socket).connection()
+
+def _setShutter(session, ports, interv):
+    return crossconnect.CrossConnection(session.socket).setShutter(ports, interv)
+
+def _power(session, ports, reverse):
+    return _tl1._call(session.socket, 'rtrv-port-%spower::%s:%d:;\n' % (_tl1._reverse(reverse), _tl1._list(ports), _tl1._ctag), pmon.PowerMonitorError(), pmon._powerList)
+
+class MultiSwitch(object):
+    """
+        Runs the same operation against several switches at once. Every switch
+        gets its own session in its own thread, so the wall-clock time of an
+        operation is that of the slowest switch rather than the sum of all.
+    """
+    def __init__(self, username, password, hosts=_switches, timeout=30):
+        """
+            Initializes a multi-switch object.
+
+            :param username: the name of the user on all the switches.
+            :type username: string
+
+            :param password: the password credential of the user.
+            :type password: string
+
+            :param hosts: the host addresses of the switches. This defaults to the switches of the cable pull lab.
+            :type hosts: list of strings
+
+            :param timeout: the time in seconds a single switch may take for the login, the operation and the logout.
+            :type timeout: float
+        """
+        self.username = username
+        self.password = password
+        self.hosts = list(hosts)
+        self.timeout = timeout
+
+    def _worker(self, session, operation, args, kwargs, slot):
+        try:
+            session.login(self.password)
+            slot['result'] = operation(session, *args, **kwargs)
+            session.logout()
+        except BaseException as err:
+            # Session.login exits on connection failures, keep that per switch
+            slot['error'] = err
+            if session.socket is not None:
+                session.socket.close()
+
+    def run(self, operation, *args, **kwargs):
+        """
+            This function logs into all the switches concurrently and calls
+            operation(session, \*args, \*\*kwargs) for each of them. A switch
+            that does not finish within the timeout is cut off without delaying
+            the others.
+
+            :param operation: the function to call with the logged in :class:`Session` of each switch.
+            :type operation: callable
+
+            :returns: the results by host and the :class:`MultiSwitchError` of each failed switch by host.
+            :rtype: tuple of two dictionaries
+        """
+        deadline = time.time() + self.timeout
+        workers = []
+        for host in self.hosts:
+            session = Session(self.username, host)
+            session.timeout = self.timeout
+            slot = {}
+            thread = threading.Thread(target=self._worker, args=(session, operation, args, kwargs, slot))
+            thread.daemon = True
+            thread.start()
+            workers.append((host, session, slot, thread))
+        results = {}
+        errors = {}
+        for host, session, slot, thread in workers:
+            thread.join(max(0, deadline - time.time()))
+            if thread.is_alive():
+                if session.socket is not None:
+                    try:
+                        session.socket.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass
+                errors[host] = MultiSwitchError(host, 'timed out after %s seconds' % self.timeout)
+            elif 'error' in slot:
+                errors[host] = MultiSwitchError(host, slot['error'])
+            else:
+                results[host] = slot.get('result')
+        for host, error in errors.items():
+            logger.error(error.args[0])
+        return results, errors
+
+    def snapshot(self):
+        """
+            This function retrieves the complete patch table of all switches.
+
+            :returns: the ingress, egress tuples by host and the errors by host.
+            :rtype: tuple of two dictionaries
+        """
+        return self.run(_snapshot)
+
+    def setShutter(self, ports, interv):
+        """
+            This function programs the same port flap on all switches.
+
+            :param ports: the ports to flap on every switch.
+            :type ports: list of integers or PortSet
+
+            :interv:  offintv,onintvl,cycles -  eg: 10000,300,1
+
+            :returns: the results by host and the errors by host.
+            :rtype: tuple of two dictionaries
+        """
+        return self.run(_setShutter, ports, interv)
+
+    def power(self, ports=None, reverse=False):
+        """
+            This function reads the measured power of the ports on all switches.
+
+            :param ports: the ports to query on every switch.
+            :type ports: list of integers or PortSet
+
+            :param reverse: whether it is a reverse or forward power query.
+            :type reverse: bool
+
+            :returns: the port, power tuples by host and the errors by host.
+            :rtype: tuple of two dictionaries
+        """
+        return self.run(_power, ports, reverse)
@@ -21,6 +21,36 @@ class PowerMonitorError(Exception):
     def setMessage(self, message):
 	self.message = message
 
+def _portModeList(lines):
+    portModeList = []
+    for line in lines:
+        port, mode = line.split(_tl1._valsep)
+        portModeList.append((int(port.split('=')[1]), mode.split('=')[1][:-1]))
+    return portModeList
+
+def _settingsList(lines):
+    settingsList = []
+    for line in lines:
+        port, data = line.split(_tl1._portsep)
+        wavelength, offset, averagingTime = data[:-1].split(_tl1._valsep)
+        settingsList.append((int(port.strip()[1:]), float(wavelength), float(offset), int(averagingTime)))
+    return settingsList
+
+def _powerList(lines):
+    powerList = []
+    for line in lines:
+        port, power = line.split(_tl1._portsep)
+        powerList.append((int(port.strip()[1:]), float(power[:-1])))
+    return powerList
+
+def _alarmStateList(lines):
+    alarmStateList = []
+    for line in lines:
+        # TODO: Once TL1 supports more than just mode name, extend this
+        port, data = line.split(_tl1._portsep)
+        alarmStateList.append((int(port.strip()[1:]), data[:-1]))
+    return alarmStateList
+
 class PowerMonitor(object):
     def __init__(self, session):
         """
@@ -37,8 +67,12 @@ class PowerMonitor(object):
         self._testPowerMonitorSupport()
 
     def _testPowerMonitorSupport(self):
-        self.ports()
-        self.ports(reverse=True)
+        self._portModes = {}
+        for reverse, name in ((False, 'pmon'), (True, 'revpmon')):
+            tl1_cmd = 'rtrv-eqpt::%spmon:%d:::parameter=config;\n' % (_tl1._reverse(reverse), _tl1._ctag)
+            portModes = self.session.capability(name, lambda: _tl1._call(self.session.socket, tl1_cmd, PowerMonitorError(), _portModeList))
+            self._portModes[reverse] = [tuple(portMode) for portMode in portModes or ()]
+        self._ports = sorted(set(port for portModes in self._portModes.values() for port, mode in portModes))
 
     def _parseTl1Error(self, tl1Func):
 	return tl1Func(self.session.socket, PowerMonitorError())
@@ -49,6 +83,14 @@ class PowerMonitor(object):
     def _check_error(self):
         self._parseTl1Error(_tl1._check_error)
 
+    def _request(self, tl1_cmd, parse=None):
+        """
+            Sends the command and returns the parsed response, or its future
+            when the session is in pipelined mode.
+        """
+        logger.debug(tl1_cmd)
+        return _tl1._request(self.session.socket, tl1_cmd, PowerMonitorError(), parse)
+
     def ports(self, reverse=False):
         """
             This function is used to query which ports have power monitors
@@ -62,13 +104,7 @@ class PowerMonitor(object):
             :rtype: list of tuples
         """
         tl1_cmd = 'rtrv-eqpt::%spmon:%d:::parameter=config;\n' % (_tl1._reverse(reverse), _tl1._ctag)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        portModeList = []
-        for line in self._splitlines():
-            port, mode = line.split(_tl1._valsep)
-            portModeList.append((int(port.split('=')[1]), mode.split('=')[1][:-1]))
-        return portModeList
+        return self._request(tl1_cmd, _portModeList)
 
     def setConfiguration(self, ports, wavelength, offset, averageTime, reverse=False):
         """
@@ -76,7 +112,7 @@ class PowerMonitor(object):
             specified in the desired direction.
 
             :param ports: the list of ports for which to set up the power monitor configuration.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param wavelength: The optical power monitors need to be configured with the wavelength of light in use on each port. This is used to compensate for the wavelength dependence of power monitor response.  It is important to specify the correct wavelength for each port to ensure accurate power monitor readings.
             :type wavelength: float
@@ -113,9 +149,7 @@ class PowerMonitor(object):
         if not any([wavelength, offset, averageTime]):
             raise ValueError("At least one of the arguments has to be provided: wavelength, offset or averaging time")
         tl1_cmd = 'set-port-%spmon::%s:%d:::wave=%s,offset=%s,atime=%d;\n' % (_tl1._reverse(reverse), _tl1._list(ports), _tl1._ctag, wavelength, offset, averageTime)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        self._check_error()
+        return self._request(tl1_cmd)
 
     def configuration(self, ports=None, reverse=False):
         """
@@ -125,7 +159,7 @@ class PowerMonitor(object):
             a single port.
 
             :param ports: the list of ports for which to query the power monitor settings.  This defaults to all if not specified.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param reverse: whether it is a reverse or forward power monitor query. This defaults to False if not specified, which means forward direction.
             :type reverse: bool
@@ -134,21 +168,14 @@ class PowerMonitor(object):
             :rtype: list of tuples
         """
         tl1_cmd = 'rtrv-port-%spmon::%s:%d:;\n' % (_tl1._reverse(reverse), _tl1._list(ports), _tl1._ctag)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        settingsList = []
-        for line in self._splitlines():
-            port, data = line.split(_tl1._portsep)
-            wavelength, offset, averagingTime = data[:-1].split(_tl1._valsep)
-            settingsList.append((int(port.strip()[1:]), float(wavelength), float(offset), int(averagingTime)))
-        return settingsList
+        return self._request(tl1_cmd, _settingsList)
 
     def power(self, ports=None, reverse=False):
         """
             This function queries the measured power on the ports specified.
 
             :param ports: the list of ports for which to query the power monitor power settings. This defaults to all if not specified.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param reverse: whether it is a reverse or forward power monitor query. This defaults to False if not specified, which means forward direction.
             :type reverse: bool
@@ -157,13 +184,7 @@ class PowerMonitor(object):
             :rtype: list of tuples
         """
         tl1_cmd = 'rtrv-port-%spower::%s:%d:;\n' % (_tl1._reverse(reverse), _tl1._list(ports), _tl1._ctag)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        powerList = []
-        for line in self._splitlines():
-            port, power = line.split(_tl1._portsep)
-            powerList.append((int(port.strip()[1:]), float(power[:-1])))
-        return powerList
+        return self._request(tl1_cmd, _powerList)
 
     def setAlarmThreshold(self, ports, alarmType=None, mode=None, edge=None, high=None, low=None, reverse=False):
         """
@@ -172,7 +193,7 @@ class PowerMonitor(object):
             at least one parameter must be given.
 
             :param ports: the list of ports to set the alarm threshold for.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param alarmType: This can be *LOS* (Loss of Service) or *DEGRADED*.  This defaults to *LOS* if not specified. If it is *DEGRADED*, the edge parameter must be omitted since the value will be fixed low. The low parameter is then used to set the threshold at which the degraded signal alarm fires. The high parameter must also be omitted since it is not relevant.
             :type alarmType: enum
@@ -207,9 +228,7 @@ class PowerMonitor(object):
                 data += '%s%s=%s' % (separator, keyword, var if var >= 0 else '(%s)' % var)
                 separator=_tl1._valsep
         tl1_cmd = 'set-th-%spmon::%s:%d:::%s;\n' % (_tl1._reverse(reverse), _tl1._list(ports), _tl1._ctag, data)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        self._check_error()
+        return self._request(tl1_cmd)
 
     def alarmThreshold(self, ports=None, alarmType=None, reverse=False):
         """
@@ -217,7 +236,7 @@ class PowerMonitor(object):
             desired ports and alarm type in the specified direction.
 
             :param ports: the list of ports to query the alarm threshold for. It defaults to all ports in the specified direction.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param alarmType: This can be *LOS* (Loss of Service) or *DEGRADE default is *LOS*. This defaults to *LOS* if not specified.
             :type alarmType: enum
@@ -231,14 +250,14 @@ class PowerMonitor(object):
             See also :meth:`setAlarmThreshold`.
         """
         tl1_cmd = 'rtrv-th-%spmon::%s:%d:%s;\n' % (_tl1._reverse(reverse), _tl1._list(ports), _tl1._ctag, _tl1._alarm_type(alarmType))
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        alarmThresholdList = []
-        for line in self._splitlines():
-            port, data = line.split(_tl1._portsep)
-            mode, edge, high, low = data.split(_tl1._valsep)
-            alarmThresholdList.append((int(port.strip()[1:]), mode, edge, None if alarmType == 'DEGRADED' else float(high), float(low[:-1])))
-        return alarmThresholdList
+        def alarmThresholdList(lines):
+            alarmThresholdList = []
+            for line in lines:
+                port, data = line.split(_tl1._portsep)
+                mode, edge, high, low = data.split(_tl1._valsep)
+                alarmThresholdList.append((int(port.strip()[1:]), mode, edge, None if alarmType == 'DEGRADED' else float(high), float(low[:-1])))
+            return alarmThresholdList
+        return self._request(tl1_cmd, alarmThresholdList)
 
     def alarmState(self, ports=None, alarmType=None, reverse=False):
         """
@@ -262,7 +281,7 @@ class PowerMonitor(object):
             alarm has fired then the alarm state will be CONT *and* TRIGGERED.
 
             :param ports: the list of ports to query the alarm state for. It defaults to all ports in the specified direction if not specified.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param alarmType: This can be LOS (Loss of Service) or DEGRADED. If it is not provided, the default is LOS.
             :type alarmType: enum
@@ -276,14 +295,7 @@ class PowerMonitor(object):
             See also :meth:`clearAlarmState`.
         """
         tl1_cmd = 'rtrv-state-%spmon::%s:%d:%s;\n' % (_tl1._reverse(reverse), _tl1._list(ports), _tl1._ctag, _tl1._alarm_type(alarmType))
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        alarmStateList = []
-        for line in self._splitlines():
-            # TODO: Once TL1 supports more than just mode name, extend this
-            port, data = line.split(_tl1._portsep)
-            alarmStateList.append((int(port.strip()[1:]), data[:-1]))
-        return alarmStateList
+        return self._request(tl1_cmd, _alarmStateList)
 
 
     def clearAlarmState(self, ports=None, alarmType=None, reverse=False):
@@ -293,7 +305,7 @@ class PowerMonitor(object):
             specified.
 
             :param ports: the list of ports to clean the alarm state for.  It defaults to all ports in the specified direction if not specified.
-            :type ports: list of integers
+            :type ports: list of integers or PortSet
 
             :param reverse: this parameter determines whether a forward or reverse clean is being executed.
             :type reverse: bool
@@ -307,6 +319,4 @@ class PowerMonitor(object):
             See also :meth:`alarmState`.
         """
         tl1_cmd = 'set-state-%s;\n' % _tl1._reversePortsCtagAlarmType(reverse, ports, alarmType)
-        logger.info(tl1_cmd)
-        self.session.socket.sendall(tl1_cmd)
-        self._check_error()
+        return self._request(tl1_cmd)
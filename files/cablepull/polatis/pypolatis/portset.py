@@ -0,0 +1,199 @@
+import re
+
+_all = 'ALL'
+_rangeSymbols = re.compile(r'\s*(?:&&|-)\s*')
+_listSymbols = re.compile(r'\s*(?:(?<!&)&(?!&)|,)\s*')
+
+def _items(ports):
+    """
+        This function yields the single ports and (first, last) ranges of a
+        port list given as a string like '1-8,12,49&&53' or as an iterable.
+    """
+    if isinstance(ports, (int, long)):
+        yield ports
+        return
+    if isinstance(ports, basestring):
+        ports = _listSymbols.split(ports.strip())
+    for item in ports:
+        if isinstance(item, (int, long)):
+            yield item
+            continue
+        item = str(item).strip()
+        if not item:
+            continue
+        if item.upper() == _all:
+            yield _all
+            continue
+        bounds = _rangeSymbols.split(item)
+        if len(bounds) == 1:
+            yield int(bounds[0])
+        elif len(bounds) == 2:
+            yield (int(bounds[0]), int(bounds[1]))
+        else:
+            raise ValueError('Invalid port range: %s' % item)
+
+def _render(runs):
+    """
+        This function returns the shortest TL1 form of (first, last) runs.
+    """
+    parts = []
+    for first, last in runs:
+        if first == last:
+            parts.append(str(first))
+        elif last == first + 1:
+            parts.append('%d&%d' % (first, last))
+        else:
+            parts.append('%d&&%d' % (first, last))
+    return '&'.join(parts)
+
+def _runs(ports):
+    """
+        This function groups consecutive ascending ports into (first, last)
+        runs without changing the order of the ports.
+    """
+    runs = []
+    for port in ports:
+        if runs and port == runs[-1][1] + 1:
+            runs[-1][1] = port
+        else:
+            runs.append([port, port])
+    return runs
+
+class PortSet(object):
+    """
+        A set of switch ports stored as the bits of an integer.
+
+        It can be created from anything the command builders accept, e.g. a
+        TL1 or command line string such as '1-8,12,49-53', '1&&8&12' or 'ALL',
+        a list of port numbers or another port set. It supports the set
+        algebra operators and renders itself in the shortest TL1 form, where
+        runs of ports become '&&' ranges joined by '&'.
+    """
+    __slots__ = ('_bits',)
+
+    def __init__(self, ports=None, size=None):
+        """
+            Initializes a port set.
+
+            :param ports: the ports of the set. This defaults to the empty set if not specified.
+            :type ports: string, list of integers or PortSet
+
+            :param size: the port count of the switch, required to resolve 'ALL'.
+            :type size: integer
+
+            :raises ValueError: if a port number or range is invalid, or 'ALL' is given without the port count.
+        """
+        self._bits = 0
+        if isinstance(ports, PortSet):
+            self._bits = ports._bits
+        elif ports is not None:
+            for item in _items(ports):
+                if item == _all:
+                    if size is None:
+                        raise ValueError('The port count of the switch is required to resolve ALL')
+                    self._addRange(1, size)
+                elif isinstance(item, tuple):
+                    self._addRange(*item)
+                else:
+                    self.add(item)
+
+    @classmethod
+    def all(cls, size):
+        """
+            Returns the set of all the ports of a switch with the given port count.
+        """
+        portSet = cls()
+        portSet._addRange(1, size)
+        return portSet
+
+    @classmethod
+    def _fromBits(cls, bits):
+        portSet = cls()
+        portSet._bits = bits
+        return portSet
+
+    def _addRange(self, first, last):
+        if first < 1 or last < first:
+            raise ValueError('Invalid port range: %d-%d' % (first, last))
+        self._bits |= ((1 << (last - first + 1)) - 1) << first
+
+    def add(self, port):
+        """
+            Adds a single port to the set.
+        """
+        if port < 1:
+            raise ValueError('Invalid port: %d' % port)
+        self._bits |= 1 << port
+
+    def discard(self, port):
+        """
+            Removes a single port from the set if it is present.
+        """
+        self._bits &= ~(1 << port)
+
+    def __contains__(self, port):
+        return port >= 0 and bool(self._bits >> port & 1)
+
+    def __iter__(self):
+        bits = self._bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __len__(self):
+        return bin(self._bits).count('1')
+
+    def __nonzero__(self):
+        return self._bits != 0
+
+    __bool__ = __nonzero__
+
+    def __eq__(self, other):
+        return isinstance(other, PortSet) and self._bits == other._bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __or__(self, other):
+        return self._fromBits(self._bits | PortSet(other)._bits)
+
+    def __and__(self, other):
+        return self._fromBits(self._bits & PortSet(other)._bits)
+
+    def __sub__(self, other):
+        return self._fromBits(self._bits & ~PortSet(other)._bits)
+
+    def __xor__(self, other):
+        return self._fromBits(self._bits ^ PortSet(other)._bits)
+
+    union = __or__
+    intersection = __and__
+    difference = __sub__
+    symmetric_difference = __xor__
+
+    def clip(self, size):
+        """
+            Returns the ports of the set that exist on a switch with the given port count.
+        """
+        return self & PortSet.all(size)
+
+    def ranges(self):
+        """
+            Returns the set as a list of (first, last) runs of consecutive ports.
+        """
+        return [tuple(run) for run in _runs(self)]
+
+    def tl1(self):
+        """
+            Returns the shortest TL1 port list of the set.
+        """
+        return _render(_runs(self))
+
+    def __str__(self):
+        return self.tl1()
+
+    def __repr__(self):
+        return 'PortSet(%r)' % ','.join(str(first) if first == last else '%d-%d' % (first, last) for first, last in self.ranges())
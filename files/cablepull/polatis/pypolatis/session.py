@@ -1,19 +1,18 @@
 import logging
+import os
 import socket
 import sys
 
 import atten
+import capabilities
+import capture
+import coalesce
 import crossconnect
 import pmon
+import statecache
 import _tl1
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
 
 class SessionError(Exception):
     """
@@ -27,8 +26,15 @@ class SessionError(Exception):
         #super(SessionError, self).__init__('Failed to use the Session functionality: {0}'.format(message))
         self.message = message
 
+_identityCmd = 'rtrv-netype:::%d:;\n' % _tl1._ctag
+
 class Session(object):
     _port = 3082
+    timeout = None
+    # shared by all sessions, None to always ask the switch
+    capabilityCache = capabilities.CapabilityCache()
+    # directory of the TL1 transcripts of all sessions, None to record nothing
+    captureDirectory = os.environ.get('POLATIS_CAPTURE_DIR')
     def __init__(self, username, host='localhost'):
         """
             Initializes a session object.
@@ -42,6 +48,8 @@ class Session(object):
         self.host = host
         self.username = username
         self.socket = None
+        self._identity = None
+        self._capabilities = {}
 
     def __enter__(self):
         self.login(self.username, self.password)
@@ -75,22 +83,40 @@ class Session(object):
             See also :meth:`logout`.
         """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
+        # pipelined commands are small writes that must not wait for the ACK of the previous one
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         try:
             self.socket.connect((self.host, self._port))
         except socket.error as err:
             logger.error("Invalid IP address\n")
             exit(1)
+        if self.captureDirectory:
+            path = capture.transcriptPath(self.captureDirectory, self.host, self._port)
+            self.socket = capture.CaptureSocket(self.socket, path, self.host, self._port)
+            logger.info('recording the session in %s', path)
         tl1_cmd = 'act-user::%s:%d::%s;\n' % (self.username, _tl1._ctag, password)
         self.socket.sendall(tl1_cmd)
         if opr == 'import' or opr == 'export':
             self._impexp_check_error()
         else:
-            logger.info(tl1_cmd)
+            logger.debug(capture._mask(tl1_cmd))
             self._check_error()
         tl1_cmd = 'opr-arc-eqpt::repmgr:%d::ind;\n' % (_tl1._ctag)
         #logger.info(tl1_cmd)
         self.socket.sendall(tl1_cmd)
-        self.socket.recv(1024)
+        self._identity = None
+        self._capabilities = {}
+        cache = self._capabilityCache()
+        entry = cache.entry(self._switch()) if cache is not None else None
+        if entry is not None:
+            # check the cached capabilities still belong to this switch, sent
+            # behind opr-arc-eqpt so it adds no round trip
+            self.socket.sendall(_identityCmd)
+        _tl1._discard(self.socket)
+        if entry is not None:
+            self._identity = capabilities._identityOf(_tl1._lines(self.socket, SessionError()))
+            self._capabilities = cache.check(self._switch(), entry, self._identity) or {}
         #self._check_error()
         return self.socket
 
@@ -108,10 +134,99 @@ class Session(object):
         if opr == 'import' or opr == 'export':
             self._impexp_check_error()
         else:
-            logger.info(tl1_cmd)
+            logger.debug(tl1_cmd)
             self._check_error()
         self.socket.close()
 
+    def _switch(self):
+        return '%s:%d' % (self.host, self._port)
+
+    def _capabilityCache(self):
+        # a recorded session must not depend on what the cache knew about the
+        # switch address, its replay runs on another one
+        return None if self.captureDirectory else self.capabilityCache
+
+    def capability(self, name, fetch):
+        """
+            This function returns a capability of the switch out of the
+            capability cache, it only asks the switch if the capability is
+            not cached yet. The cache is not used while the session is
+            recorded.
+
+            :param name: the name of the capability, e.g. 'attenMode'.
+            :type name: string
+
+            :param fetch: the function reading the capability from the switch. Its result must be JSON serializable, empty results are not cached.
+            :type fetch: function
+
+            :returns: the capability.
+
+            See also :class:`CapabilityCache`.
+        """
+        if name in self._capabilities:
+            return self._capabilities[name]
+        value = fetch()
+        cache = self._capabilityCache()
+        if value and cache is not None:
+            if self._identity is None:
+                self._identity = _tl1._call(self.socket, _identityCmd, SessionError(), capabilities._identityOf)
+            self._capabilities[name] = value
+            cache.update(self._switch(), self._identity, **{name: value})
+        return value
+
+    def portCount(self):
+        """
+            This function returns the number of ports of the switch, taken
+            from its power monitor inventory.
+
+            :returns: the number of ports.
+            :rtype: integer
+        """
+        return self.capability('ports', lambda: len(self.powerMonitor()._ports))
+
+    def pipeline(self, depth=16):
+        """
+            This function returns a context manager that switches the session
+            into pipelined mode. Inside the context every command gets its own
+            ctag and is sent without waiting for the previous responses. The
+            methods of :class:`CrossConnection`, :class:`PowerMonitor` and
+            :class:`Attenuation` then return a future instead of the result;
+            calling its result() method returns what the method returns in
+            blocking mode. All outstanding responses are read when the context
+            is left.
+
+            :param depth: the maximum number of commands in flight.
+            :type depth: integer
+
+            :returns: the pipeline bound to the session socket.
+            :rtype: _tl1._Pipeline
+
+            Example::
+
+                with session.pipeline():
+                    patches = crossConnection.connection('1-16')
+                    flaps = crossConnection.queryShutter('1-16')
+                    power = powerMonitor.power('1-16')
+                print patches.result(), flaps.result(), power.result()
+        """
+        return _tl1._Pipeline(self.socket, depth)
+
+    def stateCache(self, maxAge=None):
+        """
+            This function returns a local mirror of the switch state that
+            answers the patch, port flap, attenuation and alarm state queries
+            from memory.
+
+            :param maxAge: the staleness in seconds accepted for the cached data. This defaults to no limit.
+            :type maxAge: float or None
+
+            :returns: the cache attached to this session.
+            :rtype: SwitchStateCache
+
+            See also :class:`SwitchStateCache`.
+        """
+        return statecache.SwitchStateCache(self, maxAge)
+
     def crossConnection(self):
         """
             This function returns a cross connection instance that can be used
@@ -126,6 +241,21 @@ class Session(object):
         """
         return crossconnect.CrossConnection(self)
 
+    def coalescer(self, window=0.0):
+        """
+            This function returns a coalescer that merges the patch, port flap
+            and shutter operations on single ports into multi port commands.
+
+            :param window: the time in seconds operations are collected before they are sent, 0 to only merge inside :meth:`Coalescer.batch`.
+            :type window: float
+
+            :returns: the coalescer bound to the session socket.
+            :rtype: Coalescer
+
+            See also :meth:`crossConnection` and :class:`Coalescer`.
+        """
+        return coalesce.Coalescer(self.socket, window)
+
     def attenuation(self):
         """
             This function returns an attenuation instance that can be used for
@@ -0,0 +1,565 @@
+import Queue
+import SocketServer
+import logging
+import random
+import socket
+import threading
+import time
+
+import _tl1
+import portset
+
+logger = logging.getLogger(__name__)
+
+_errors = {
+    'IICM': 'Input, Invalid Command',
+    'IIAC': 'Input, Invalid Access identifier',
+    'IIFM': 'Input, Invalid data Format',
+    'PICC': 'Privilege, Illegal Command Code',
+    'PLNA': 'Privilege, Login Not Active',
+    'SAIS': 'Status, Already In Service',
+}
+_dark = -60.0
+
+class _Deny(Exception):
+
+    def __init__(self, code, text=None):
+        super(_Deny, self).__init__(code)
+        self.code = code
+        self.text = text or _errors.get(code, code)
+
+def _stamp():
+    return time.strftime('%y-%m-%d %H:%M:%S')
+
+def _params(fields):
+    """
+        This function returns the keyword=value parameters of the command
+        fields, with the parentheses around negative numbers removed.
+    """
+    params = {}
+    for field in fields:
+        for item in field.split(_tl1._valsep):
+            if '=' in item:
+                key, value = item.split('=', 1)
+                params[key.strip().lower()] = value.strip().strip('()')
+    return params
+
+def _number(params, key, convert=float):
+    try:
+        return convert(params[key])
+    except ValueError:
+        raise _Deny('IIFM', 'Input, Invalid data Format: %s=%s' % (key, params[key]))
+
+class SwitchModel(object):
+    """
+        State of the simulated switch shared by all its sessions.
+
+        The model keeps the patches, port flaps, attenuation and power
+        monitor settings, derives the optical power of every port from them,
+        and sends autonomous messages to all the logged in sessions when a
+        patch changes, light is lost or restored, or a port flap completes.
+        A port flap program replaces the one running on its ports, so a
+        program of 0 cycles stops a flap and turns the light back on.
+    """
+    def __init__(self, size=384, name='SIMULATOR', users=None, attenMode='ABSOLUTE', autonomous=True, firmware='6.6.1.0'):
+        """
+            Initializes a switch model.
+
+            :param size: the port count of the switch.
+            :type size: integer
+
+            :param name: the target identifier in the message headers.
+            :type name: string
+
+            :param users: the passwords by user name. This defaults to admin with the password root.
+            :type users: dictionary
+
+            :param attenMode: the attenuation mode reported, *NONE* for a switch without attenuation.
+            :type attenMode: string
+
+            :param autonomous: whether autonomous messages are sent.
+            :type autonomous: bool
+
+            :param firmware: the firmware version reported by rtrv-netype.
+            :type firmware: string
+        """
+        self.size = size
+        self.name = name
+        self.users = dict(users or {'admin': 'root'})
+        self.attenMode = attenMode
+        self.autonomous = autonomous
+        self.firmware = firmware
+        self.lock = threading.RLock()
+        self.patches = {}
+        self.flaps = {}
+        self._trains = {}
+        self.dark = set()
+        self.shutters = set()
+        self.atten = {}
+        self.pmon = {}
+        self.thresholds = {}
+        self.triggered = set()
+        self._sessions = set()
+        self._atag = 0
+        self._denies = []
+        self._commands = {
+            'act-user': self._actUser,
+            'canc-user': self._cancUser,
+            'rtrv-hdr': self._nothing,
+            'opr-arc-eqpt': self._nothing,
+            'rls-arc-eqpt': self._nothing,
+            'rtrv-eqpt': self._rtrvEqpt,
+            'rtrv-netype': self._rtrvNetype,
+            'ent-patch': self._entPatch,
+            'dlt-patch': self._dltPatch,
+            'rtrv-patch': self._rtrvPatch,
+            'ent-port-flap': self._entPortFlap,
+            'rtrv-port-flap': self._rtrvPortFlap,
+            'opr-port-shutter': self._oprPortShutter,
+            'rls-port-shutter': self._rlsPortShutter,
+            'set-port-atten': self._setPortAtten,
+            'rtrv-port-atten': self._rtrvPortAtten,
+            'set-port-pmon': self._setPortPmon,
+            'rtrv-port-pmon': self._rtrvPortPmon,
+            'rtrv-port-power': self._rtrvPortPower,
+            'set-th-pmon': self._setThPmon,
+            'rtrv-th-pmon': self._rtrvThPmon,
+            'set-state-pmon': self._setStatePmon,
+            'rtrv-state-pmon': self._rtrvStatePmon,
+        }
+
+    def injectDeny(self, code, text=None, count=1):
+        """
+            Makes the next count commands of any session fail with the error code.
+
+            :param code: the TL1 error code, e.g. *IICM*, *PICC* or *IIAC*.
+            :type code: string
+        """
+        with self.lock:
+            self._denies.extend([(code, text)] * count)
+
+    def attach(self, session):
+        with self.lock:
+            self._sessions.add(session)
+
+    def detach(self, session):
+        with self.lock:
+            self._sessions.discard(session)
+
+    def emit(self, verb, lines, alarmCode='A'):
+        """
+            Sends an autonomous message to all the logged in sessions.
+
+            :param verb: the message verb, e.g. *REPT EVT PATCH*.
+            :type verb: string
+
+            :param lines: the unquoted message body lines.
+            :type lines: list of strings
+
+            :param alarmCode: *A* for an event, *CR*, *MJ* or *MN* alarms are sent as *\*C*, *\*\** and *\**.
+            :type alarmCode: string
+        """
+        if not self.autonomous or not lines:
+            return
+        with self.lock:
+            self._atag += 1
+            message = '\r\n\n   %s %s\r\n%-2s %d %s\r\n%s;' % (
+                self.name, _stamp(), alarmCode, self._atag, verb,
+                ''.join('   "%s"\r\n' % line for line in lines))
+            for session in self._sessions:
+                if session.user is not None:
+                    session.send(message)
+
+    def execute(self, session, tl1_cmd):
+        """
+            Runs one command of a session and returns the response.
+        """
+        fields = tl1_cmd.strip().split(_tl1._portsep)
+        verb = fields[0].strip().lower()
+        aid = fields[2].strip() if len(fields) > 2 else ''
+        ctag = fields[3].strip() if len(fields) > 3 and fields[3].strip() else '0'
+        reverse = 'revp' in verb or aid.lower() == 'revpmon'
+        try:
+            with self.lock:
+                if self._denies:
+                    raise _Deny(*self._denies.pop(0))
+                command = self._commands.get(verb.replace('revp', 'p'))
+                if command is None:
+                    raise _Deny('IICM')
+                if session.user is None and command != self._actUser:
+                    raise _Deny('PLNA')
+                lines = command(session, aid, fields[4:], reverse)
+        except _Deny as deny:
+            return '\r\n\n   %s %s\r\nM  %s DENY\r\n   %s\r\n   /* %s */\r\n;' % (
+                self.name, _stamp(), ctag, deny.code, deny.text)
+        return '\r\n\n   %s %s\r\nM  %s COMPLD\r\n%s;' % (
+            self.name, _stamp(), ctag, ''.join('   "%s"\r\n' % line for line in lines or ()))
+
+    def _ports(self, aid, default=None):
+        """
+            This function returns the ports of an access identifier in their
+            order, the default or all ports if it is empty.
+        """
+        if not aid or aid.upper() == portset._all:
+            return list(default) if default is not None and not aid else range(1, self.size + 1)
+        ports = []
+        try:
+            for item in portset._items(aid):
+                if item == portset._all:
+                    return range(1, self.size + 1)
+                elif isinstance(item, tuple):
+                    ports.extend(range(item[0], item[1] + 1))
+                else:
+                    ports.append(item)
+        except ValueError:
+            raise _Deny('IIAC')
+        for port in ports:
+            if not 1 <= port <= self.size:
+                raise _Deny('IIAC', 'Input, Invalid Access identifier: port %d' % port)
+        return ports
+
+    def _lit(self, port):
+        if port in self.dark or port in self.shutters:
+            return False
+        return port in self.patches or port in self.patches.values()
+
+    def _lightChange(self, before):
+        lost = sorted(port for port in before if not self._lit(port))
+        found = sorted(port for port in set(self.patches) | set(self.patches.values())
+                       if self._lit(port) and port not in before)
+        for port in lost:
+            self.triggered.add((False, 'LOS', port))
+        self.emit('REPT ALM OPM', ['%d:CR,LOS,SA' % port for port in lost], '*C')
+        self.emit('REPT ALM OPM', ['%d:CL,LOS,SA' % port for port in found])
+
+    def _litPorts(self):
+        return set(port for port in range(1, self.size + 1) if self._lit(port))
+
+    def _nothing(self, session, aid, fields, reverse):
+        return None
+
+    def _actUser(self, session, aid, fields, reverse):
+        password = fields[1].strip() if len(fields) > 1 else ''
+        if self.users.get(aid) != password:
+            raise _Deny('PICC', 'Privilege, Illegal Command Code: login failed')
+        session.user = aid
+
+    def _cancUser(self, session, aid, fields, reverse):
+        session.user = None
+
+    def _rtrvEqpt(self, session, aid, fields, reverse):
+        if aid.lower() == 'atten':
+            return ['MODE=%s' % self.attenMode]
+        return ['PORT=%d,MODE=%s' % (port, 'REV' if reverse else 'FWD') for port in range(1, self.size + 1)]
+
+    def _rtrvNetype(self, session, aid, fields, reverse):
+        return ['\\"POLATIS\\",\\"SIMULATOR-%dxCC\\",\\"OXC\\",\\"%s\\"' % (self.size, self.firmware)]
+
+    def _entPatch(self, session, aid, fields, reverse):
+        if _tl1._valsep not in aid:
+            raise _Deny('IIAC', 'Input, Invalid Access identifier: ingress,egress expected')
+        ingressAid, egressAid = aid.split(_tl1._valsep, 1)
+        ingress = self._ports(ingressAid)
+        egress = self._ports(egressAid)
+        if len(ingress) != len(egress) or set(ingress) & set(egress):
+            raise _Deny('IIAC', 'Input, Invalid Access identifier: unmatched port lists')
+        owners = dict((out, port) for port, out in self.patches.items())
+        for port, out in zip(ingress, egress):
+            if owners.get(out, port) != port or port in owners:
+                raise _Deny('SAIS', 'Status, Already In Service: port %d' % (out if port not in owners else port))
+        before = self._litPorts()
+        for port, out in zip(ingress, egress):
+            self.patches[port] = out
+        self.emit('REPT EVT PATCH', ['%d,%d' % pair for pair in zip(ingress, egress)])
+        self._lightChange(before)
+
+    def _dltPatch(self, session, aid, fields, reverse):
+        ports = set(self._ports(aid))
+        removed = sorted((port, out) for port, out in self.patches.items() if port in ports or out in ports)
+        before = self._litPorts()
+        for port, out in removed:
+            del self.patches[port]
+        self.emit('REPT EVT PATCH', ['%d,0' % port for port, out in removed])
+        self._lightChange(before)
+
+    def _rtrvPatch(self, session, aid, fields, reverse):
+        if not aid:
+            return ['%d,%d' % (port, self.patches[port]) for port in sorted(self.patches)]
+        ports = self._ports(aid)
+        owners = dict((out, port) for port, out in self.patches.items())
+        lines = []
+        for port in ports:
+            if port in self.patches:
+                lines.append('%d,%d' % (port, self.patches[port]))
+            elif port in owners:
+                lines.append('%d,%d' % (owners[port], port))
+        return lines
+
+    def _entPortFlap(self, session, aid, fields, reverse):
+        ports = self._ports(aid)
+        try:
+            offInterval, onInterval, cycles = [int(value) for value in fields[1].replace('&', _tl1._valsep).split(_tl1._valsep)]
+        except (IndexError, ValueError):
+            raise _Deny('IIFM', 'Input, Invalid data Format: offintv,onintvl,cycles expected')
+        before = self._litPorts()
+        for port in ports:
+            self.flaps[port] = (offInterval, onInterval, cycles)
+            if port in self._trains:
+                # the running program stops on all its ports with the light on
+                train, trainPorts = self._trains[port]
+                train.set()
+                for trainPort in trainPorts:
+                    self.dark.discard(trainPort)
+                    if self._trains.get(trainPort, (None,))[0] is train:
+                        del self._trains[trainPort]
+        self._lightChange(before)
+        stopped = threading.Event()
+        for port in ports:
+            self._trains[port] = (stopped, ports)
+        flapper = threading.Thread(target=self._flap, args=(ports, offInterval / 1000.0, onInterval / 1000.0, cycles, stopped))
+        flapper.daemon = True
+        flapper.start()
+
+    def _toggle(self, ports, dark, stopped):
+        with self.lock:
+            if stopped.is_set():
+                return False
+            before = self._litPorts()
+            if dark:
+                self.dark.update(ports)
+            else:
+                self.dark.difference_update(ports)
+            self._lightChange(before)
+            return True
+
+    def _flap(self, ports, offTime, onTime, cycles, stopped):
+        for cycle in range(cycles):
+            if not self._toggle(ports, True, stopped) or stopped.wait(offTime):
+                return
+            if not self._toggle(ports, False, stopped) or stopped.wait(onTime):
+                return
+        with self.lock:
+            if stopped.is_set():
+                return
+            for port in ports:
+                del self._trains[port]
+            self.emit('REPT EVT FLAP', [_tl1._list(ports)])
+
+    def _oprPortShutter(self, session, aid, fields, reverse):
+        ports = self._ports(aid)
+        before = self._litPorts()
+        self.shutters.update(ports)
+        self._lightChange(before)
+
+    def _rlsPortShutter(self, session, aid, fields, reverse):
+        ports = self._ports(aid)
+        before = self._litPorts()
+        self.shutters.difference_update(ports)
+        self._lightChange(before)
+
+    def _rtrvPortFlap(self, session, aid, fields, reverse):
+        ports = self._ports(aid, sorted(self.flaps))
+        return ['%d:%d,%d,%d' % ((port,) + self.flaps[port]) for port in ports if port in self.flaps]
+
+    def _setPortAtten(self, session, aid, fields, reverse):
+        params = _params(fields)
+        level = _number(params, 'level') if 'level' in params else None
+        for port in self._ports(aid):
+            self.atten[port] = (params.get('mode', 'NONE').upper(), level, params.get('refs'))
+
+    def _rtrvPortAtten(self, session, aid, fields, reverse):
+        lines = []
+        for port in self._ports(aid):
+            mode, level, refs = self.atten.get(port, ('NONE', None, None))
+            lines.append('%d:%s,%s,%s' % (port, mode, '' if level is None else '%.1f' % level, refs or ''))
+        return lines
+
+    def _setPortPmon(self, session, aid, fields, reverse):
+        params = _params(fields)
+        for port in self._ports(aid):
+            wave, offset, atime = self.pmon.get((reverse, port), (1550.0, 0.0, 4))
+            self.pmon[(reverse, port)] = (
+                _number(params, 'wave') if 'wave' in params else wave,
+                _number(params, 'offset') if 'offset' in params else offset,
+                _number(params, 'atime', int) if 'atime' in params else atime)
+
+    def _rtrvPortPmon(self, session, aid, fields, reverse):
+        return ['%d:%.3f,%.2f,%d' % ((port,) + self.pmon.get((reverse, port), (1550.0, 0.0, 4)))
+                for port in self._ports(aid)]
+
+    def _rtrvPortPower(self, session, aid, fields, reverse):
+        lines = []
+        for port in self._ports(aid):
+            if self._lit(port):
+                offset = self.pmon.get((reverse, port), (1550.0, 0.0, 4))[1]
+                power = -3.0 - (port % 10) * 0.1 + offset + random.gauss(0, 0.02)
+            else:
+                power = _dark
+            lines.append('%d:%.2f' % (port, power))
+        return lines
+
+    def _alarmType(self, fields):
+        params = _params(fields)
+        if 'type' in params:
+            return params['type'].upper()
+        for field in fields:
+            if field.strip().upper() in ('LOS', 'DEGRADED'):
+                return field.strip().upper()
+        return 'LOS'
+
+    def _threshold(self, reverse, alarmType, port):
+        return self.thresholds.get((reverse, alarmType, port), ('SINGLE', 'LOW', -10.0, -30.0))
+
+    def _setThPmon(self, session, aid, fields, reverse):
+        params = _params(fields)
+        alarmType = self._alarmType(fields)
+        for port in self._ports(aid):
+            mode, edge, high, low = self._threshold(reverse, alarmType, port)
+            self.thresholds[(reverse, alarmType, port)] = (
+                params.get('mode', mode).upper(), edge,
+                _number(params, 'high') if 'high' in params else high,
+                _number(params, 'low') if 'low' in params else low)
+
+    def _rtrvThPmon(self, session, aid, fields, reverse):
+        alarmType = self._alarmType(fields)
+        lines = []
+        for port in self._ports(aid):
+            mode, edge, high, low = self._threshold(reverse, alarmType, port)
+            lines.append('%d:%s,%s,%s,%.2f' % (port, mode, edge, '' if alarmType == 'DEGRADED' else '%.2f' % high, low))
+        return lines
+
+    def _setStatePmon(self, session, aid, fields, reverse):
+        alarmType = self._alarmType(fields)
+        for port in self._ports(aid):
+            self.triggered.discard((reverse, alarmType, port))
+
+    def _rtrvStatePmon(self, session, aid, fields, reverse):
+        alarmType = self._alarmType(fields)
+        lines = []
+        for port in self._ports(aid):
+            if (reverse, alarmType, port) in self.triggered:
+                state = 'TRIGGERED'
+            else:
+                state = self._threshold(reverse, alarmType, port)[0]
+            lines.append('%d:%s' % (port, state))
+        return lines
+
+class _SessionHandler(SocketServer.BaseRequestHandler):
+    """
+        One TL1 session. Responses and autonomous messages are queued and
+        written by a separate thread once their simulated latency has
+        passed, so pipelined commands overlap like on a real switch.
+    """
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.user = None
+        self._due = 0
+        self._lock = threading.Lock()
+        self._outbox = Queue.Queue()
+        self._writer = threading.Thread(target=self._write)
+        self._writer.daemon = True
+        self._writer.start()
+        self.server.switch.attach(self)
+
+    def send(self, data):
+        with self._lock:
+            self._due = max(self._due, time.time() + self.server.delay())
+            self._outbox.put((self._due, data))
+
+    def _write(self):
+        while True:
+            item = self._outbox.get()
+            if item is None:
+                return
+            due, data = item
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.request.sendall(data)
+            except socket.error:
+                return
+
+    def handle(self):
+        buff = ''
+        while True:
+            try:
+                data = self.request.recv(_tl1._linesize)
+            except socket.error:
+                return
+            if not data:
+                return
+            buff += data
+            while _tl1._respsep in buff:
+                tl1_cmd, buff = buff.split(_tl1._respsep, 1)
+                if tl1_cmd.strip():
+                    self.send(self.server.switch.execute(self, tl1_cmd))
+
+    def finish(self):
+        self.server.switch.detach(self)
+        self._outbox.put(None)
+        self._writer.join()
+
+class Simulator(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+        TCP server that speaks the TL1 dialect of a Polatis switch as far as
+        pypolatis uses it. Every connection is a session served by its own
+        thread, so load tests can open many sessions at once.
+
+        Example::
+
+            simulator = Simulator(('localhost', 0), SwitchModel(size=64), latency=0.005)
+            simulator.start()
+            session = Session('admin', 'localhost')
+            session._port = simulator.server_address[1]
+            session.login('root')
+            ...
+            simulator.stop()
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address=('', 3082), switch=None, latency=0.0, jitter=0.0):
+        """
+            Initializes a simulator.
+
+            :param address: the host and port to listen on.
+            :type address: tuple
+
+            :param switch: the simulated switch. This defaults to a 384 port switch.
+            :type switch: SwitchModel
+
+            :param latency: the minimal response time in seconds.
+            :type latency: float
+
+            :param jitter: the maximal random time in seconds added to the latency.
+            :type jitter: float
+        """
+        SocketServer.TCPServer.__init__(self, address, _SessionHandler)
+        self.switch = switch or SwitchModel()
+        self.latency = latency
+        self.jitter = jitter
+        self._thread = None
+
+    def delay(self):
+        return self.latency + random.uniform(0, self.jitter)
+
+    def start(self):
+        """
+            Starts serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+            Stops serving and closes the listening socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
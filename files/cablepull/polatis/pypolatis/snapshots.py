@@ -0,0 +1,264 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+
+import crossconnect
+import statecache
+
+logger = logging.getLogger(__name__)
+
+_indexName = 'index.jsonl'
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+def _diff(old, new):
+    """
+        This function returns the changes from the old to the new state, by
+        section the values to set and the keys to delete.
+    """
+    changes = {}
+    for section in sorted(set(old) | set(new)):
+        before = old.get(section, {})
+        after = new.get(section, {})
+        change = {}
+        values = dict((key, value) for key, value in after.items() if before.get(key) != value)
+        deleted = sorted(key for key in before if key not in after)
+        if values:
+            change['set'] = values
+        if deleted:
+            change['delete'] = deleted
+        if change:
+            changes[section] = change
+    return changes
+
+def _patch(state, changes):
+    state = dict((section, dict(values)) for section, values in state.items())
+    for section, change in changes.items():
+        values = state.setdefault(section, {})
+        values.update(change.get('set', {}))
+        for key in change.get('delete', ()):
+            values.pop(key, None)
+    return state
+
+def capture(session):
+    """
+        This function reads the patches, port flap settings and attenuation
+        settings of a switch with one pipelined bulk retrieval.
+
+        :param session: the logged in session.
+        :type session: Session
+
+        :returns: the 'patches', 'flaps' and 'atten' sections by port number string.
+        :rtype: dictionary
+    """
+    cache = session.stateCache()
+    try:
+        return {
+            'patches': dict((str(ingress), egress) for ingress, egress in cache.connection()),
+            'flaps': dict((str(statecache._portOf(line)), line) for line in cache.queryShutter()),
+            'atten': dict((str(row[0]), list(row[1:])) for row in cache.settings()),
+        }
+    finally:
+        cache.close()
+
+class SnapshotStore(object):
+    """
+        Versioned store of the switch states.
+
+        A state is kept as a diff against the previous version of the same
+        switch, with a full copy every checkpoint versions so a restore never
+        replays a long chain. Every version is a zlib compressed JSON object
+        named by the SHA-1 of its content, so identical versions are stored
+        once. The index file holds one JSON line per version with the
+        switch, the time and the version name. Recording a state equal to
+        the latest version of the switch stores nothing.
+
+        Example::
+
+            store = SnapshotStore('cablepull/connections/snapshots')
+            before = store.record('10.30.222.136', snapshots.capture(session))
+            ...
+            store.restore(session, before)
+    """
+    def __init__(self, directory, checkpoint=64):
+        """
+            Opens a store, creating the directory if necessary.
+
+            :param directory: the directory of the store.
+            :type directory: string
+
+            :param checkpoint: the number of diffs after which a full state is stored.
+            :type checkpoint: integer
+        """
+        self.directory = directory
+        self.checkpoint = checkpoint
+        self._index = {}
+        self._objects = {}
+        self._states = {}
+        if not os.path.isdir(os.path.join(directory, 'objects')):
+            os.makedirs(os.path.join(directory, 'objects'))
+        path = os.path.join(directory, _indexName)
+        if os.path.exists(path):
+            with open(path) as index:
+                for line in index:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._index.setdefault(entry['switch'], []).append((entry['time'], entry['version']))
+        for entries in self._index.values():
+            entries.sort()
+
+    def _path(self, version):
+        return os.path.join(self.directory, 'objects', version[:2], version[2:])
+
+    def _write(self, content):
+        data = _canonical(content)
+        version = hashlib.sha1(data).hexdigest()
+        path = self._path(version)
+        if not os.path.exists(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(handle, 'wb') as output:
+                output.write(zlib.compress(data, 9))
+            os.rename(temporary, path)
+        self._objects[version] = content
+        return version
+
+    def _read(self, version):
+        content = self._objects.get(version)
+        if content is None:
+            with open(self._path(version), 'rb') as stream:
+                content = self._objects[version] = json.loads(zlib.decompress(stream.read()))
+        return content
+
+    def resolve(self, name):
+        """
+            This function returns the full version name of a unique prefix.
+
+            :raises KeyError: if no version or more than one starts with the prefix.
+        """
+        matches = set(version for entries in self._index.values() for stamp, version in entries if version.startswith(name))
+        if len(matches) != 1:
+            raise KeyError('%d versions match %s' % (len(matches), name))
+        return matches.pop()
+
+    def state(self, version):
+        """
+            This function returns the state of a version.
+
+            :param version: the version name or a unique prefix of it.
+            :type version: string
+
+            :returns: the sections of the state, see :func:`capture`.
+            :rtype: dictionary
+        """
+        if version not in self._states:
+            if not os.path.exists(self._path(version)):
+                version = self.resolve(version)
+            chain = []
+            content = self._read(version)
+            while 'full' not in content and content['parent'] not in self._states:
+                chain.append(content)
+                content = self._read(content['parent'])
+            state = content['full'] if 'full' in content else self._states[content['parent']]
+            if 'full' not in content:
+                chain.append(content)
+            for content in reversed(chain):
+                state = _patch(state, content['diff'])
+            self._states[version] = state
+        return self._states[version]
+
+    def versions(self, switch, start=None, end=None):
+        """
+            This function returns the versions of a switch recorded between
+            the start and the end time, as returned by time.time().
+
+            :returns: the time, version tuples in time order.
+            :rtype: list of tuples
+        """
+        return [(stamp, version) for stamp, version in self._index.get(switch, [])
+                if (start is None or stamp >= start) and (end is None or stamp <= end)]
+
+    def switches(self):
+        """
+            Returns the switches with recorded versions.
+        """
+        return sorted(self._index)
+
+    def at(self, switch, when):
+        """
+            This function returns the version of a switch that was current at
+            the given time, or None if there was none yet.
+        """
+        versions = self.versions(switch, end=when)
+        return versions[-1][1] if versions else None
+
+    def record(self, switch, state, when=None):
+        """
+            This function adds a state of a switch to the store.
+
+            :param switch: the name of the switch.
+            :type switch: string
+
+            :param state: the state as returned by :func:`capture`.
+            :type state: dictionary
+
+            :param when: the time of the state. This defaults to now.
+            :type when: float
+
+            :returns: the version name, that of the latest version if the state did not change.
+            :rtype: string
+        """
+        state = json.loads(_canonical(state))
+        when = time.time() if when is None else when
+        entries = self._index.get(switch)
+        parent = entries[-1][1] if entries else None
+        if parent is not None:
+            changes = _diff(self.state(parent), state)
+            if not changes:
+                return parent
+            depth = self._read(parent).get('depth', 0) + 1
+        if parent is None or depth >= self.checkpoint:
+            version = self._write({'full': state})
+        else:
+            version = self._write({'parent': parent, 'diff': changes, 'depth': depth})
+        self._states[version] = state
+        with open(os.path.join(self.directory, _indexName), 'a') as index:
+            index.write(_canonical({'switch': switch, 'time': when, 'version': version}) + '\n')
+        self._index.setdefault(switch, []).append((when, version))
+        logger.info('recorded %s version %s', switch, version[:12])
+        return version
+
+    def diff(self, old, new):
+        """
+            This function compares two versions.
+
+            :returns: by section, the 'set' values of the new version that differ and the 'delete' keys that are gone.
+            :rtype: dictionary
+        """
+        return _diff(self.state(old), self.state(new))
+
+    def restore(self, session, version, dryRun=False):
+        """
+            This function sets the patches of the switch back to a version
+            with one minimal :meth:`CrossConnection.apply`.
+
+            :param session: the logged in session of the switch.
+            :type session: Session
+
+            :param version: the version name or a unique prefix of it.
+            :type version: string
+
+            :param dryRun: only compute and log the changes.
+            :type dryRun: bool
+
+            :returns: the plan of :meth:`CrossConnection.apply`.
+            :rtype: dictionary
+        """
+        patches = self.state(version)['patches']
+        return crossconnect.CrossConnection(session.socket).apply(dict((int(ingress), egress) for ingress, egress in patches.items()), dryRun=dryRun)
@@ -0,0 +1,221 @@
+import logging
+import time
+
+import _tl1
+import atten
+import crossconnect
+import pmon
+from portset import PortSet
+
+logger = logging.getLogger(__name__)
+
+_sections = ('patches', 'flaps', 'atten', 'alarms', 'ralarms')
+
+# Words in the verb of a command or autonomous message and the sections they change
+_verbSections = (
+    ('PATCH', ('patches',)),
+    ('FLAP', ('flaps',)),
+    ('SHUTTER', ('flaps',)),
+    ('ATTEN', ('atten',)),
+    ('REVPMON', ('ralarms',)),
+    ('PMON', ('alarms', 'ralarms')),
+    # REPT ALM OPM: loss of signal raised or cleared on a port
+    ('ALM', ('alarms', 'ralarms')),
+)
+
+_changingVerbs = ('ENT-', 'DLT-', 'SET-', 'OPR-', 'RLS-', 'ED-')
+
+def _sectionsOf(verb):
+    """
+        This function returns the cached sections a command or autonomous
+        message verb refers to.
+    """
+    verb = verb.upper()
+    for word, sections in _verbSections:
+        if word in verb:
+            return sections
+    return ()
+
+def _portOf(line):
+    return int(line.split(_tl1._portsep, 1)[0].split(_tl1._valsep, 1)[0])
+
+def _flapDict(lines):
+    return dict((_portOf(line), line) for line in crossconnect._shutterList(lines))
+
+def _byPort(rows):
+    return dict((row[0], row) for row in rows)
+
+class SwitchStateCache(object):
+    """
+        Local mirror of the patch, port flap, attenuation and power monitor
+        alarm state of a switch.
+
+        The mirror is filled with one pipelined bulk retrieval. Autonomous
+        messages and the changing commands sent on the session mark the
+        sections they touch as dirty, and a gap in the autonomous message
+        tags forces a complete resync. The read methods answer from memory
+        and only go to the switch for dirty sections or sections older than
+        maxAge seconds.
+    """
+    def __init__(self, session, maxAge=None):
+        """
+            Initializes the cache of a logged in session.
+
+            :param session: the session whose switch is mirrored.
+            :type session: Session
+
+            :param maxAge: the staleness in seconds accepted for the cached sections. This defaults to no limit, i.e. only autonomous messages and local changes invalidate the cache.
+            :type maxAge: float or None
+        """
+        self.session = session
+        self.maxAge = maxAge
+        self.generation = 0
+        self._state = {}
+        self._fetched = {}
+        self._dirty = set(_sections)
+        self._atag = None
+        self._parser = _tl1._parser(session.socket)
+        self._parser.listeners.append(self._autonomous)
+        self._parser.commandListeners.append(self._command)
+
+    def close(self):
+        """
+            Detaches the cache from the session.
+        """
+        self._parser.listeners.remove(self._autonomous)
+        self._parser.commandListeners.remove(self._command)
+
+    def _autonomous(self, message):
+        try:
+            atag = int(message.atag)
+        except ValueError:
+            atag = None
+        if atag is not None and self._atag is not None and atag != self._atag + 1:
+            logger.info('autonomous message %s missed after %s, resyncing', atag, self._atag)
+            self.invalidate()
+        self._atag = atag
+        sections = _sectionsOf(message.verb)
+        if not sections:
+            # Unknown report: the cheapest safe assumption is that anything changed
+            sections = _sections
+        self.invalidate(sections)
+
+    def _command(self, tl1_cmd):
+        verb = tl1_cmd.split(_tl1._portsep, 1)[0].strip().upper()
+        if verb.startswith(_changingVerbs):
+            self.invalidate(_sectionsOf(verb))
+
+    def invalidate(self, sections=_sections):
+        """
+            Marks cached sections as dirty, all of them if not specified.
+
+            :param sections: the names of the sections, out of 'patches', 'flaps', 'atten', 'alarms' and 'ralarms'.
+            :type sections: list of strings
+        """
+        self._dirty.update(sections)
+
+    def resync(self):
+        """
+            Forces a complete reload of the cache.
+        """
+        self.invalidate()
+        self._load(_sections)
+
+    def _load(self, sections):
+        queries = {
+            'patches': ('rtrv-patch:::%d:;\n' % _tl1._ctag, lambda lines: dict(crossconnect._connectionList(lines))),
+            'flaps': ('rtrv-port-flap:::%d::;\n' % _tl1._ctag, _flapDict),
+            'atten': ('rtrv-port-atten:::%d:;\n' % _tl1._ctag, lambda lines: _byPort(atten._settingsList(lines))),
+            'alarms': ('rtrv-state-pmon:::%d:%s;\n' % (_tl1._ctag, _tl1._alarm_type(None)), lambda lines: _byPort(pmon._alarmStateList(lines))),
+            'ralarms': ('rtrv-state-%spmon:::%d:%s;\n' % (_tl1._reverse(True), _tl1._ctag, _tl1._alarm_type(None)), lambda lines: _byPort(pmon._alarmStateList(lines))),
+        }
+        socket = self.session.socket
+        pipeline = _tl1._pipelines.get(socket) or _tl1._Pipeline(socket)
+        futures = {}
+        for section in sections:
+            # a change reported while the query is in flight marks it dirty again
+            self._dirty.discard(section)
+            futures[section] = pipeline.submit(*queries[section])
+        now = time.time()
+        for section, future in futures.items():
+            try:
+                self._state[section] = future.result()
+            except (_tl1._Tl1Error, ValueError) as err:
+                # the function is not supported on this switch
+                logger.debug('%s not available: %s', section, err)
+                self._state[section] = {}
+            self._fetched[section] = now
+        self.generation += 1
+
+    def _section(self, name):
+        self._parser.poll()
+        now = time.time()
+        stale = [section for section in _sections
+                 if section in self._dirty
+                 or section not in self._fetched
+                 or (self.maxAge is not None and now - self._fetched[section] > self.maxAge)]
+        if name in stale:
+            # refresh everything that is out of date in the same round trip
+            self._load(stale)
+        return self._state[name]
+
+    def _select(self, name, ports):
+        state = self._section(name)
+        if ports is None:
+            return [state[port] for port in sorted(state)]
+        return [state[port] for port in PortSet(ports) if port in state]
+
+    def connection(self, inputPorts=None):
+        """
+            Returns the cross connections of the input ports, like
+            :meth:`CrossConnection.connection`.
+
+            :param inputPorts: the ingress ports. This defaults to all the connected ports if not specified.
+            :type inputPorts: list of integers or PortSet
+
+            :returns: the connection list.
+            :rtype: list of ingress, egress tuples
+        """
+        patches = self._section('patches')
+        ports = sorted(patches) if inputPorts is None else PortSet(inputPorts)
+        return [(port, patches[port]) for port in ports if port in patches]
+
+    def queryShutter(self, ports=None):
+        """
+            Returns the port flap settings, like :meth:`CrossConnection.queryShutter`.
+
+            :param ports: the ports to query. This defaults to all the ports if not specified.
+            :type ports: list of integers or PortSet
+
+            :returns: the port flap settings as reported by the switch, one string per port.
+            :rtype: list of strings
+        """
+        return self._select('flaps', ports)
+
+    def settings(self, ports=None):
+        """
+            Returns the attenuation settings, like :meth:`Attenuation.settings`.
+
+            :param ports: the ports to query. This defaults to all the ports if not specified.
+            :type ports: list of integers or PortSet
+
+            :returns: the port, mode, level and refs tuples.
+            :rtype: list of tuples
+        """
+        return self._select('atten', ports)
+
+    def alarmState(self, ports=None, reverse=False):
+        """
+            Returns the LOS alarm state of the power monitors, like
+            :meth:`PowerMonitor.alarmState`.
+
+            :param ports: the ports to query. This defaults to all the ports if not specified.
+            :type ports: list of integers or PortSet
+
+            :param reverse: whether the reverse power monitors are queried.
+            :type reverse: bool
+
+            :returns: the port, state tuples.
+            :rtype: list of tuples
+        """
+        return self._select('ralarms' if reverse else 'alarms', ports)
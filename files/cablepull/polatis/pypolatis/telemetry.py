@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+
+import numpy
+
+import _tl1
+import pmon
+from portset import PortSet
+
+logger = logging.getLogger(__name__)
+
+_magic = b'PPWR0001'
+
+def _recordType(portCount):
+    return numpy.dtype([('time', '<f8'), ('forward', '<f4', (portCount,)), ('reverse', '<f4', (portCount,))])
+
+def load(path):
+    """
+        This function reads a file written by :class:`PowerCollector`.
+
+        :param path: the name of the file.
+        :type path: string
+
+        :returns: the ports and the samples with the time, forward and reverse fields.
+        :rtype: tuple of a list of integers and a NumPy structured array
+    """
+    with open(path, 'rb') as stream:
+        if stream.read(len(_magic)) != _magic:
+            raise ValueError('%s is not a power telemetry file' % path)
+        portCount = int(numpy.fromfile(stream, '<u4', 1)[0])
+        ports = [int(port) for port in numpy.fromfile(stream, '<u4', portCount)]
+        return ports, numpy.fromfile(stream, _recordType(portCount))
+
+class PowerCollector(object):
+    """
+        Samples the forward and reverse power of a set of ports at a fixed rate.
+
+        The samples are kept in preallocated NumPy ring buffers, so the memory
+        used stays the same however long the collector runs, and are
+        optionally appended to a binary file in chunks. Up to depth samples
+        are in flight at a time on the pipelined session, which hides the
+        round trip time of the switch at high rates. A missing power reading
+        is stored as NaN.
+
+        Example::
+
+            collector = PowerCollector(session, '1-16', rate=20, path='power.bin')
+            collector.start()
+            ...
+            collector.stop()
+            times, power = collector.series(12, start=time.time() - 10)
+    """
+    def __init__(self, session, ports, rate=10, history=3600, reverse=True, depth=4, path=None, flush=256):
+        """
+            Initializes a power collector.
+
+            :param session: the logged in session used for polling only.
+            :type session: Session
+
+            :param ports: the ports to sample.
+            :type ports: list of integers or PortSet
+
+            :param rate: the samples per second.
+            :type rate: float
+
+            :param history: the time in seconds kept in memory.
+            :type history: float
+
+            :param reverse: whether the reverse power is sampled too.
+            :type reverse: bool
+
+            :param depth: the maximum number of samples in flight.
+            :type depth: integer
+
+            :param path: the file the samples are appended to. This defaults to memory only if not specified.
+            :type path: string
+
+            :param flush: the number of samples written to the file at once.
+            :type flush: integer
+        """
+        self.session = session
+        self.ports = list(PortSet(ports))
+        self.rate = float(rate)
+        self.reverse = reverse
+        self.depth = depth
+        self.path = path
+        self.flush = flush
+        self.overruns = 0
+        self._column = dict((port, column) for column, port in enumerate(self.ports))
+        self._capacity = max(1, int(history * self.rate))
+        self._times = numpy.full(self._capacity, numpy.nan)
+        self._forward = numpy.full((self._capacity, len(self.ports)), numpy.nan, numpy.float32)
+        self._reverse = numpy.full((self._capacity, len(self.ports)), numpy.nan, numpy.float32)
+        self._count = 0
+        self._written = 0
+        self._stream = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+            Starts sampling in a background thread.
+        """
+        if self.path is not None:
+            self._stream = open(self.path, 'ab')
+            if self._stream.tell() == 0:
+                self._stream.write(_magic)
+                numpy.array([len(self.ports)] + self.ports, '<u4').tofile(self._stream)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+            Stops sampling and writes the remaining samples to the file.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._stream is not None:
+            self._write()
+            self._stream.close()
+            self._stream = None
+
+    def _submit(self, pipeline):
+        tl1_cmd = 'rtrv-port-%spower::%s:%d:;\n'
+        forward = pipeline.submit(tl1_cmd % (_tl1._reverse(False), _tl1._list(self.ports), _tl1._ctag), pmon._powerList)
+        reverse = None
+        if self.reverse:
+            reverse = pipeline.submit(tl1_cmd % (_tl1._reverse(True), _tl1._list(self.ports), _tl1._ctag), pmon._powerList)
+        return time.time(), forward, reverse
+
+    def _store(self, when, forward, reverse):
+        forward = self._readings(forward)
+        reverse = self._readings(reverse)
+        row = self._count % self._capacity
+        with self._lock:
+            self._times[row] = when
+            self._fill(self._forward[row], forward)
+            self._fill(self._reverse[row], reverse)
+            self._count += 1
+        if self._stream is not None and self._count - self._written >= min(self.flush, self._capacity):
+            self._write()
+
+    def _readings(self, future):
+        if future is None:
+            return ()
+        try:
+            return future.result()
+        except (_tl1._Tl1Error, ValueError) as err:
+            logger.debug('power query failed: %s', err)
+            return ()
+
+    def _fill(self, row, readings):
+        row[:] = numpy.nan
+        for port, power in readings:
+            column = self._column.get(port)
+            if column is not None:
+                row[column] = power
+
+    def _write(self):
+        with self._lock:
+            count = min(self._count - self._written, self._capacity)
+            rows = numpy.arange(self._count - count, self._count) % self._capacity
+            records = numpy.empty(count, _recordType(len(self.ports)))
+            records['time'] = self._times[rows]
+            records['forward'] = self._forward[rows]
+            records['reverse'] = self._reverse[rows]
+            self._written = self._count
+        records.tofile(self._stream)
+        self._stream.flush()
+
+    def _run(self):
+        period = 1.0 / self.rate
+        inflight = []
+        with _tl1._Pipeline(self.session.socket, self.depth * 2) as pipeline:
+            tick = time.time()
+            while not self._stopped.is_set():
+                inflight.append(self._submit(pipeline))
+                if len(inflight) >= self.depth:
+                    self._store(*inflight.pop(0))
+                tick += period
+                delay = tick - time.time()
+                if delay < 0:
+                    # The switch does not keep up, drop the missed ticks
+                    missed = int(-delay / period) + 1
+                    self.overruns += missed
+                    tick += missed * period
+                    delay += missed * period
+                self._stopped.wait(delay)
+            for sample in inflight:
+                self._store(*sample)
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def _ordered(self):
+        count = min(self._count, self._capacity)
+        return numpy.arange(self._count - count, self._count) % self._capacity
+
+    def window(self, start=None, end=None):
+        """
+            This function returns the samples taken in a time window.
+
+            :param start: the first time as returned by time.time(). This defaults to the oldest sample kept.
+            :type start: float
+
+            :param end: the last time. This defaults to the newest sample.
+            :type end: float
+
+            :returns: the times, the forward power and the reverse power with one column per port in :attr:`ports`.
+            :rtype: tuple of NumPy arrays
+        """
+        with self._lock:
+            rows = self._ordered()
+            times = self._times[rows]
+            mask = numpy.ones(len(rows), bool)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times <= end
+            rows = rows[mask]
+            return self._times[rows], self._forward[rows], self._reverse[rows]
+
+    def series(self, port, reverse=False, start=None, end=None):
+        """
+            This function returns the power of one port over time.
+
+            :param port: the port.
+            :type port: integer
+
+            :param reverse: whether the reverse power is returned.
+            :type reverse: bool
+
+            :returns: the times and the power readings.
+            :rtype: tuple of NumPy arrays
+        """
+        times, forward, backward = self.window(start, end)
+        return times, (backward if reverse else forward)[:, self._column[port]]
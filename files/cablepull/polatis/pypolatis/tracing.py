@@ -0,0 +1,225 @@
+import bisect
+import json
+import logging
+import logging.handlers
+import threading
+import time
+
+import portset
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency histogram buckets in seconds, 0.1 ms to about 100 s
+_bounds = tuple(0.0001 * 2 ** (exponent / 2.0) for exponent in range(41))
+
+_active = None
+
+def enable(tracer):
+    """
+        This function starts recording the commands of all sessions with the
+        tracer. Only one tracer is active at a time.
+
+        :param tracer: the tracer to record into.
+        :type tracer: Tracer
+
+        :returns: the tracer.
+        :rtype: Tracer
+    """
+    global _active
+    _active = tracer
+    return tracer
+
+def disable():
+    """
+        This function stops recording. While no tracer is enabled the cost of
+        tracing is one comparison per command and per receive.
+    """
+    global _active
+    _active = None
+
+def _portCount(aid):
+    try:
+        count = 0
+        for item in portset._items(aid.replace(',', '&')):
+            if isinstance(item, tuple):
+                count += item[1] - item[0] + 1
+            elif item != portset._all:
+                count += 1
+        return count
+    except ValueError:
+        return 0
+
+class Span(object):
+    """
+        The timing of one command, from the send to the terminating ';' of
+        its response.
+    """
+    __slots__ = ('verb', 'ports', 'ctag', 'sent', 'received', 'start', 'firstByte', 'end', 'code')
+
+    def __init__(self, tl1_cmd):
+        fields = tl1_cmd.split(':', 4)
+        self.verb = fields[0].strip().lower()
+        self.ports = _portCount(fields[2]) if len(fields) > 2 and fields[2] else 0
+        self.ctag = fields[3].strip() if len(fields) > 3 else ''
+        self.sent = len(tl1_cmd)
+        self.received = 0
+        self.start = time.time()
+        self.firstByte = None
+        self.end = None
+        self.code = None
+
+    def record(self):
+        return {
+            'verb': self.verb,
+            'ports': self.ports,
+            'ctag': self.ctag,
+            'sent': self.sent,
+            'received': self.received,
+            'start': self.start,
+            'firstByteMs': None if self.firstByte is None else (self.firstByte - self.start) * 1e3,
+            'totalMs': (self.end - self.start) * 1e3,
+            'code': self.code,
+        }
+
+class _Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(_bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(_bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, fraction):
+        """
+            Returns the upper bound of the bucket holding the percentile.
+        """
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(_bounds[index], self.maximum) if index < len(_bounds) else self.maximum
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'meanMs': self.total / self.count * 1e3 if self.count else 0.0,
+            'p50Ms': self.percentile(0.50) * 1e3,
+            'p95Ms': self.percentile(0.95) * 1e3,
+            'p99Ms': self.percentile(0.99) * 1e3,
+            'maxMs': self.maximum * 1e3,
+        }
+
+class _Aggregate(object):
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.ports = 0
+        self.sent = 0
+        self.received = 0
+        self.firstByte = _Histogram()
+        self.total = _Histogram()
+
+    def add(self, span):
+        self.count += 1
+        if span.code != 'COMPLD':
+            self.errors += 1
+        self.ports += span.ports
+        self.sent += span.sent
+        self.received += span.received
+        if span.firstByte is not None:
+            self.firstByte.add(span.firstByte - span.start)
+        self.total.add(span.end - span.start)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'ports': self.ports,
+            'sent': self.sent,
+            'received': self.received,
+            'firstByte': self.firstByte.summary(),
+            'total': self.total.summary(),
+        }
+
+class Tracer(object):
+    """
+        Collects the spans of the commands sent on any session into latency
+        histograms per command verb, and optionally writes every span as a
+        JSON line to a size rotated file.
+
+        Example::
+
+            tracer = tracing.enable(tracing.Tracer('tl1-trace.jsonl'))
+            ...
+            print tracer.summary()['rtrv-patch']['total']['p95Ms']
+            tracing.disable()
+    """
+    def __init__(self, path=None, maxBytes=64 * 1024 * 1024, backupCount=4):
+        """
+            Initializes a tracer.
+
+            :param path: the JSON lines file of the spans. This defaults to the in-memory histograms only.
+            :type path: string
+
+            :param maxBytes: the size at which the file is rotated.
+            :type maxBytes: integer
+
+            :param backupCount: the number of rotated files kept.
+            :type backupCount: integer
+        """
+        self._lock = threading.Lock()
+        self._aggregates = {}
+        self._file = None
+        if path is not None:
+            self._file = logging.handlers.RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backupCount)
+
+    def start(self, tl1_cmd):
+        return Span(tl1_cmd)
+
+    def finish(self, span, code):
+        span.end = time.time()
+        if span.firstByte is None:
+            # the response came in the same receive as the one before it
+            span.firstByte = span.end
+        span.code = code
+        with self._lock:
+            aggregate = self._aggregates.get(span.verb)
+            if aggregate is None:
+                aggregate = self._aggregates[span.verb] = _Aggregate()
+            aggregate.add(span)
+        if self._file is not None:
+            self._file.handle(logging.makeLogRecord({'msg': json.dumps(span.record(), sort_keys=True)}))
+
+    def summary(self):
+        """
+            This function returns the statistics collected so far.
+
+            :returns: the count, errors, ports, bytes and the first byte and total latency percentiles by command verb.
+            :rtype: dictionary
+        """
+        with self._lock:
+            return dict((verb, aggregate.summary()) for verb, aggregate in self._aggregates.items())
+
+    def reset(self):
+        """
+            Clears the statistics.
+        """
+        with self._lock:
+            self._aggregates = {}
+
+    def close(self):
+        """
+            Closes the span file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
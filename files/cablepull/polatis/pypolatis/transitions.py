@@ -0,0 +1,206 @@
+import numpy
+
+_nan = float('nan')
+
+cycleType = numpy.dtype([
+    ('cycle', '<i4'),
+    ('offRequested', '<f8'), ('offActual', '<f8'), ('offDelay', '<f8'), ('fallTime', '<f8'),
+    ('onRequested', '<f8'), ('onActual', '<f8'), ('onDelay', '<f8'), ('riseTime', '<f8'),
+    ('dark', '<f8'), ('darkError', '<f8'),
+])
+
+def levels(alarmThresholds):
+    """
+        This function turns the result of :meth:`PowerMonitor.alarmThreshold`
+        into the low and high power levels by port. Light is off below the low
+        level and on above the high level; a degraded threshold without a high
+        level uses the low level for both.
+
+        :param alarmThresholds: the port, mode, edge, high and low tuples.
+        :type alarmThresholds: list of tuples
+
+        :returns: the low, high tuples by port.
+        :rtype: dictionary
+    """
+    return dict((port, (low, low if high is None else max(high, low)))
+                for port, mode, edge, high, low in alarmThresholds)
+
+def schedule(starts, timeOff, timeOn=None, count=None):
+    """
+        This function returns the requested toggle times of a cable pull run
+        where every cycle switches the light off at its start and on again
+        timeOff seconds later, like TIME_OFF and TIME_ON of 50_Cablepull.sh.
+
+        :param starts: the start times of the cycles as returned by time.time(), or the start of the first cycle if timeOn and count are given.
+        :type starts: float or list of floats
+
+        :param timeOff: the dark time in seconds, one for all cycles or one per cycle.
+        :type timeOff: float or list of floats
+
+        :param timeOn: the light time in seconds after each cycle.
+        :type timeOn: float
+
+        :param count: the number of cycles.
+        :type count: integer
+
+        :returns: the requested off and on times.
+        :rtype: tuple of NumPy arrays
+    """
+    if numpy.ndim(starts) == 0:
+        if timeOn is None or count is None:
+            raise ValueError('timeOn and count are required with a single start time')
+        starts = starts + numpy.arange(count) * (timeOff + timeOn)
+    off = numpy.asarray(starts, numpy.float64)
+    return off, off + numpy.asarray(timeOff, numpy.float64)
+
+def _decided(power, low, high):
+    with numpy.errstate(invalid='ignore'):
+        return (power >= high) | (power <= low)
+
+def state(power, low, high):
+    """
+        This function returns the light state of every sample, 1 for on and
+        0 for off. Samples between the levels or without a reading keep the
+        state of the sample before them, so noise around a single level does
+        not produce edges. Samples before the first decided one are -1.
+
+        :param power: the power readings.
+        :type power: NumPy array
+
+        :returns: the states.
+        :rtype: NumPy array of int8
+    """
+    power = numpy.asarray(power)
+    index = numpy.where(_decided(power, low, high), numpy.arange(len(power)), -1)
+    numpy.maximum.accumulate(index, out=index)
+    with numpy.errstate(invalid='ignore'):
+        states = numpy.where(power[index] >= high, 1, 0).astype(numpy.int8)
+    states[index < 0] = -1
+    return states
+
+def edges(times, power, low, high):
+    """
+        This function detects the off and on edges of a power series.
+
+        The time of an edge is that of the first sample past the level; its
+        transition time is the time from the last sample on the other side
+        of the band to that sample, i.e. how long the power took to cross
+        from one level to the other.
+
+        :param times: the sample times.
+        :type times: NumPy array
+
+        :param power: the power readings.
+        :type power: NumPy array
+
+        :param low: the level below which the light is off.
+        :type low: float
+
+        :param high: the level above which the light is on.
+        :type high: float
+
+        :returns: the fall times, fall durations, rise times and rise durations.
+        :rtype: tuple of NumPy arrays
+    """
+    times = numpy.asarray(times, numpy.float64)
+    power = numpy.asarray(power)
+    states = state(power, low, high)
+    change = numpy.flatnonzero((states[1:] != states[:-1]) & (states[:-1] >= 0)) + 1
+    # the last sample of the old state is the last one outside the band before the edge
+    last = numpy.where(_decided(power, low, high), numpy.arange(len(power)), -1)
+    numpy.maximum.accumulate(last, out=last)
+    before = last[change - 1]
+    falls = change[states[change] == 0]
+    rises = change[states[change] == 1]
+    fallBefore = before[states[change] == 0]
+    riseBefore = before[states[change] == 1]
+    return (times[falls], times[falls] - times[fallBefore],
+            times[rises], times[rises] - times[riseBefore])
+
+def _next(values, after):
+    """
+        This function returns the index of the first value at or after every
+        time in after, or len(values) if there is none.
+    """
+    return numpy.searchsorted(values, after, 'left')
+
+def _take(values, index):
+    result = numpy.full(len(index), _nan)
+    valid = index < len(values)
+    result[valid] = values[index[valid]]
+    return result
+
+def cycles(times, power, offRequested, onRequested, low, high, slack=1.0):
+    """
+        This function measures every cycle of a cable pull against the
+        requested toggle times.
+
+        The off edge of a cycle is the first fall no earlier than slack
+        seconds before its requested off time, the on edge the first rise
+        after that fall. Missing edges are NaN.
+
+        :param times: the sample times, as returned by time.time().
+        :type times: NumPy array
+
+        :param power: the power readings of one port and direction.
+        :type power: NumPy array
+
+        :param offRequested: the requested off times, see :func:`schedule`.
+        :type offRequested: NumPy array
+
+        :param onRequested: the requested on times.
+        :type onRequested: NumPy array
+
+        :param low: the level below which the light is off.
+        :type low: float
+
+        :param high: the level above which the light is on.
+        :type high: float
+
+        :param slack: the clock difference in seconds tolerated between the requester and the samples.
+        :type slack: float
+
+        :returns: one row per cycle with the fields of :data:`cycleType`.
+        :rtype: NumPy structured array
+    """
+    offRequested = numpy.asarray(offRequested, numpy.float64)
+    onRequested = numpy.asarray(onRequested, numpy.float64)
+    fall, fallTime, rise, riseTime = edges(times, power, low, high)
+    falls = _next(fall, offRequested - slack)
+    offActual = _take(fall, falls)
+    # a fall after the start of the next cycle belongs to that cycle
+    offActual[:-1][offActual[:-1] >= offRequested[1:] - slack] = _nan
+    falls[numpy.isnan(offActual)] = len(fall)
+    rises = _next(rise, numpy.where(numpy.isnan(offActual), numpy.inf, offActual))
+    onActual = _take(rise, rises)
+    table = numpy.zeros(len(offRequested), cycleType)
+    table['cycle'] = numpy.arange(1, len(offRequested) + 1)
+    table['offRequested'] = offRequested
+    table['offActual'] = offActual
+    table['offDelay'] = offActual - offRequested
+    table['fallTime'] = _take(fallTime, falls)
+    table['onRequested'] = onRequested
+    table['onActual'] = onActual
+    table['onDelay'] = onActual - onRequested
+    table['riseTime'] = _take(riseTime, rises)
+    table['dark'] = onActual - offActual
+    table['darkError'] = table['dark'] - (onRequested - offRequested)
+    return table
+
+def summary(table):
+    """
+        This function returns the mean, standard deviation and maximum of the
+        delays and the dark time error of a cycle table, ignoring the cycles
+        without edges.
+
+        :returns: the mean, std and max tuples by field.
+        :rtype: dictionary
+    """
+    result = {}
+    for field in ('offDelay', 'onDelay', 'fallTime', 'riseTime', 'darkError'):
+        values = table[field][~numpy.isnan(table[field])]
+        if len(values):
+            result[field] = (values.mean(), values.std(), numpy.abs(values).max())
+        else:
+            result[field] = (_nan, _nan, _nan)
+    return result
@@ -0,0 +1,88 @@
+### Record, list, compare and restore versioned snapshots of the switch state ###
+from pypolatis import snapshots
+from pypolatis.session import Session
+import argparse
+import json
+import time
+
+
+
+def login(args):
+    ses = Session(args.username, args.host)
+    ses.login(args.password)
+    return ses
+
+def record(args, store):
+    """
+    Record the current patches, port flaps and attenuation of the switch.
+    Nothing is stored if the switch did not change since its last version.
+    """
+    ses = login(args)
+    try:
+        print(store.record(args.switch or args.host, snapshots.capture(ses)))
+    finally:
+        ses.logout()
+
+def list_versions(args, store):
+    """
+    List the versions of every switch, or of one with --switch.
+    """
+    for switch in [args.switch] if args.switch else store.switches():
+        for stamp, version in store.versions(switch):
+            state = store.state(version)
+            print('%s  %s  %s  %d patches' % (switch, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp)), version, len(state['patches'])))
+
+def diff(args, store):
+    """
+    Show the changes from the old to the new version.
+    """
+    print(json.dumps(store.diff(store.resolve(args.old), store.resolve(args.new)), indent=4, sort_keys=True))
+
+def restore(args, store):
+    """
+    Set the patches of the switch back to a version, or to the one current
+    at --time.
+    """
+    switch = args.switch or args.host
+    if args.version:
+        version = store.resolve(args.version)
+    else:
+        version = store.at(switch, time.mktime(time.strptime(args.time, '%Y-%m-%d %H:%M:%S')))
+        if version is None:
+            raise SystemExit('No version of %s at %s' % (switch, args.time))
+    ses = login(args)
+    try:
+        store.restore(ses, version, dryRun=args.dry_run)
+    finally:
+        ses.logout()
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', action='store', required=True,
+                        help='Directory of the snapshot store')
+    parser.add_argument('--switch', action='store',
+                        help='Name of the switch in the store; default: the host')
+    subparsers = parser.add_subparsers(dest='action')
+    for name, function in (('record', record), ('restore', restore)):
+        subparser = subparsers.add_parser(name, help=function.__doc__.strip().split('\n')[0])
+        subparser.add_argument('--host', action='store', required=True,
+                               help='IP address of the switch')
+        subparser.add_argument('--username', action='store', required=True,
+                               help='Username')
+        subparser.add_argument('--password', action='store', required=True,
+                               help='Password')
+    restoreParser = subparsers.choices['restore']
+    target = restoreParser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--version', action='store', help='Version or a unique prefix of it')
+    target.add_argument('--time', action='store', help='Local time of the state; eg: "2024-05-01 13:00:00"')
+    restoreParser.add_argument('--dry-run', action='store_true', help='Only show the changes')
+    subparsers.add_parser('list', help='List the versions')
+    diffParser = subparsers.add_parser('diff', help='Show the changes between two versions')
+    diffParser.add_argument('old', help='Old version or a unique prefix of it')
+    diffParser.add_argument('new', help='New version or a unique prefix of it')
+    args = parser.parse_args()
+    actions = {'record': record, 'list': list_versions, 'diff': diff, 'restore': restore}
+    actions[args.action](args, snapshots.SnapshotStore(args.store))
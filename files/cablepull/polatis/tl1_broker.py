@@ -0,0 +1,292 @@
+### Keep TL1 sessions to the Polatis switches open and run commands on them ###
+from pypolatis import _tl1
+from pypolatis.coalesce import Coalescer, parse
+from pypolatis.session import Session
+import SocketServer
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+logger = logging.getLogger('tl1_broker')
+
+BROKER_SOCKET = os.environ.get('POLATIS_BROKER_SOCKET', '/tmp/.polatis-tl1-broker.sock')
+
+# exit codes of polatis.exp, RC_CONNECT also when the broker is not reachable
+RC_CONNECT = 19
+RC_LOGIN = 20
+RC_COMMAND = 21
+
+
+class BrokerError(Exception):
+    """
+    Exception raised when a command could not be run on the switch.
+    """
+    def __init__(self, rc, message):
+        super(BrokerError, self).__init__(message)
+        self.rc = rc
+        self.message = message
+
+
+class SwitchSession(object):
+    """
+    One authenticated session to a switch, logged in again when the switch
+    dropped it while idle.
+    """
+    def __init__(self, host, port, username, timeout):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.timeout = timeout
+        self.password = None
+        self.session = None
+        self.coalescer = None
+        self.lock = threading.Lock()
+
+    def _login(self, password):
+        # the shared session stays until the new one is logged in, so a
+        # client with a wrong password does not log the others out
+        session = Session(self.username, self.host)
+        session._port = self.port
+        session.timeout = self.timeout
+        try:
+            session.login(password)
+        except SystemExit:
+            # Session.login exits on connection and authentication failures
+            if session.socket is not None:
+                session.socket.close()
+            raise BrokerError(RC_LOGIN, 'Login to %s:%s as %s failed' % (self.host, self.port, self.username))
+        self._close()
+        self.session = session
+        self.password = password
+        logger.info('logged in to %s:%s as %s', self.host, self.port, self.username)
+
+    def _close(self):
+        self.coalescer = None
+        if self.session is not None:
+            try:
+                self.session.socket.close()
+            except socket.error:
+                pass
+            self.session = None
+
+    def _send(self, tl1_cmd):
+        sock = self.session.socket
+        sock.sendall(tl1_cmd)
+        lines = []
+        for kind, tag, data in _tl1._parser(sock).response():
+            if kind == 'line':
+                lines.append(data)
+            elif kind == 'deny':
+                return 'DENY', [' ' * 3 + data[0], ' ' * 3 + data[1]]
+            else:
+                return data, lines
+
+    def run(self, password, tl1_cmd):
+        """
+        Runs the command and returns the completion code and body lines.
+        """
+        with self.lock:
+            if self.session is None or password != self.password:
+                self._login(password)
+            try:
+                return self._send(tl1_cmd)
+            except (socket.error, _tl1._Tl1Error) as err:
+                logger.info('session to %s:%s dropped (%s), logging in again', self.host, self.port, err)
+                self._login(password)
+                try:
+                    return self._send(tl1_cmd)
+                except (socket.error, _tl1._Tl1Error) as err:
+                    self._close()
+                    raise BrokerError(RC_COMMAND, 'Command %s failed: %s' % (tl1_cmd.strip(), err))
+
+    def coalesced(self, password, tl1_cmd, window):
+        """
+        Runs a single port patch or shutter command merged with those other
+        clients send within the window, and returns the completion code and
+        body lines of its part.
+        """
+        with self.lock:
+            if self.session is None or password != self.password:
+                self._login(password)
+            if self.coalescer is None:
+                self.coalescer = Coalescer(self.session.socket, window, self.lock)
+            operation = self.coalescer.submit(tl1_cmd)
+        try:
+            operation.result()
+        except _tl1._Tl1Error as err:
+            return 'DENY', [' ' * 3 + err.code, ' ' * 3 + '/* %s */' % err.message]
+        except socket.error as err:
+            with self.lock:
+                self._close()
+            raise BrokerError(RC_COMMAND, 'Command %s failed: %s' % (tl1_cmd.strip(), err))
+        return _tl1._ok_resp, []
+
+    def logout(self):
+        with self.lock:
+            if self.session is not None:
+                try:
+                    self.session.socket.sendall('canc-user::%s:%d:;\n' % (self.username, _tl1._ctag))
+                    _tl1._discard(self.session.socket)
+                except (socket.error, _tl1._Tl1Error):
+                    pass
+                self._close()
+
+
+class Broker(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Unix socket server keeping one session per switch, port and user.
+    Commands for different switches run concurrently.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, timeout, window=0):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(self, path, BrokerHandler)
+        os.chmod(path, 0600)
+        self.path = path
+        self.timeout_switch = timeout
+        self.window = window
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+
+    def session(self, host, port, username):
+        key = (host, port, username)
+        with self.sessions_lock:
+            if key not in self.sessions:
+                self.sessions[key] = SwitchSession(host, port, username, self.timeout_switch)
+            return self.sessions[key]
+
+    def stop(self):
+        for switch in self.sessions.values():
+            switch.logout()
+        threading.Thread(target=self.shutdown).start()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BrokerHandler(SocketServer.StreamRequestHandler):
+    """
+    Handles one JSON request line and answers with one JSON line.
+    """
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if request.get('op') == 'stop':
+            self.wfile.write(json.dumps({'rc': 0, 'output': 'broker stopped'}) + '\n')
+            self.server.stop()
+            return
+        tl1_cmd = request['cmd'].strip()
+        if not tl1_cmd.endswith(_tl1._respsep):
+            tl1_cmd += _tl1._respsep
+        switch = self.server.session(request['host'], int(request['port']), request['user'])
+        try:
+            if self.server.window > 0 and parse(tl1_cmd) is not None:
+                code, lines = switch.coalesced(request['password'], tl1_cmd + '\n', self.server.window)
+            else:
+                code, lines = switch.run(request['password'], tl1_cmd + '\n')
+        except BrokerError as err:
+            response = {'rc': err.rc, 'output': err.message}
+        else:
+            output = '\n'.join(['M  %d %s' % (_tl1._ctag, code)] + lines + [_tl1._respsep])
+            response = {'rc': 0 if code == _tl1._ok_resp else RC_COMMAND, 'output': output}
+        self.wfile.write(json.dumps(response) + '\n')
+
+
+def request(path, message):
+    """
+    Sends one request to the broker and returns its response.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    try:
+        sock.sendall(json.dumps(message) + '\n')
+        return json.loads(sock.makefile().readline())
+    finally:
+        sock.close()
+
+
+def watch_parent(broker, pid):
+    """
+    Stops the broker once the process that started it is gone.
+    """
+    while True:
+        time.sleep(2)
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            logger.info('parent process %d is gone, stopping', pid)
+            broker.stop()
+            return
+
+
+def serve(args):
+    broker = Broker(args.socket, args.timeout, args.window)
+    logger.info('TL1 broker listening on %s', args.socket)
+    if args.parent:
+        watcher = threading.Thread(target=watch_parent, args=(broker, args.parent))
+        watcher.daemon = True
+        watcher.start()
+    try:
+        broker.serve_forever()
+    finally:
+        broker.server_close()
+
+
+def client(args):
+    if not all([args.host, args.user, args.password, args.cmd]):
+        logger.error('usage: %s client -h HOST [-p PORT] -u USER -pw PASSWORD -c CMD', sys.argv[0])
+        return 1
+    print('\n%s %s %s %s' % (args.host, args.port, args.user, args.cmd))
+    try:
+        response = request(args.socket, {'host': args.host, 'port': args.port, 'user': args.user,
+                                         'password': args.password, 'cmd': args.cmd})
+    except socket.error as err:
+        logger.error('TL1 broker on %s is not reachable: %s', args.socket, err)
+        return RC_CONNECT
+    print(response['output'])
+    if response['rc'] == 0:
+        print('\nCompleted execution of command on Switch')
+    return response['rc']
+
+
+def stop(args):
+    print(request(args.socket, {'op': 'stop'})['output'])
+    return 0
+
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('mode', choices=('serve', 'client', 'stop'),
+                        help='serve: run the broker; client: run one TL1 command; stop: stop the broker')
+    parser.add_argument('--socket', action='store', default=BROKER_SOCKET,
+                        help='Unix socket of the broker; default: %s' % BROKER_SOCKET)
+    parser.add_argument('--timeout', action='store', type=float, default=30,
+                        help='Switch response timeout in seconds; default: 30')
+    parser.add_argument('--window', action='store', type=float, default=0,
+                        help='Seconds to collect single port ent-patch, dlt-patch, port flap and shutter commands '
+                             'of all clients and send them as one command; default: 0, no merging')
+    parser.add_argument('--parent', action='store', type=int,
+                        help='Stop serving when the process with this pid exits')
+    parser.add_argument('-h', '--host', action='store', help='IP address of the switch')
+    parser.add_argument('-p', '--port', action='store', type=int, default=3082, help='TL1 port; default: 3082')
+    parser.add_argument('-u', '--user', action='store', help='Username')
+    parser.add_argument('-pw', '--password', action='store', help='Password')
+    parser.add_argument('-c', '--cmd', action='store', help='TL1 command; eg: "rtrv-patch::10:123:;"')
+    parser.add_argument('-?', '--help', action='help', help='show this help message and exit')
+    args = parser.parse_args()
+    ch = logging.StreamHandler()
+    ch.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(ch)
+    logger.setLevel(logging.INFO)
+    sys.exit({'serve': serve, 'client': client, 'stop': stop}[args.mode](args))
@@ -0,0 +1,51 @@
+### Play recorded TL1 sessions back on a local port in place of the switch ###
+from pypolatis.capture import ReplayServer
+import argparse
+import logging
+
+
+
+def replay(transcripts, bind, port, speed, timeout, loop):
+    """
+    Serve the transcripts, the next one to every connection, until
+    interrupted.
+
+    Arguments:
+    transcripts: Transcript files written with POLATIS_CAPTURE_DIR set
+    bind       : Address to listen on
+    port       : TL1 port
+    speed      : Factor the recorded response times are divided by, 0 for no delays
+    timeout    : Seconds to wait for a command of the client
+    loop       : Start again with the first transcript after the last one
+    """
+    server = ReplayServer(transcripts, (bind, port), speed, timeout, loop)
+    logging.getLogger('tl1_replay').info('replaying %d sessions on %s:%d', len(server.transcripts), bind or '*', port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    for path, expected, received in server.mismatches:
+        print('%s: expected %s, received %s' % (path, expected, received))
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('transcripts', nargs='+',
+                        help='Transcript files, served in the order they were recorded')
+    parser.add_argument('--bind', action='store', default='',
+                        help='Address to listen on; default: all')
+    parser.add_argument('--port', action='store', type=int, default=3082,
+                        help='TL1 port; default: 3082')
+    parser.add_argument('--speed', action='store', type=float, default=1,
+                        help='Replay speed, eg: 10 for ten times faster, 0 for no delays; default: 1')
+    parser.add_argument('--timeout', action='store', type=float, default=30,
+                        help='Seconds to wait for a command of the client; default: 30')
+    parser.add_argument('--loop', action='store_true',
+                        help='Start again with the first transcript after the last one')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    replay(args.transcripts, args.bind, args.port, args.speed, args.timeout, args.loop)
@@ -0,0 +1,59 @@
+### Run a simulated Polatis switch speaking TL1 on a local port ###
+from pypolatis.simulator import Simulator, SwitchModel
+import argparse
+import logging
+
+
+
+def simulate(bind, port, ports, users, latency, jitter, name, attenMode, quiet):
+    """
+    Serve a simulated switch until interrupted.
+
+    Arguments:
+    bind       : Address to listen on
+    port       : TL1 port
+    ports      : Port count of the simulated switch
+    users      : user:password pairs allowed to log in
+    latency    : Response time in ms
+    jitter     : Random extra response time in ms
+    name       : Target identifier in the message headers
+    attenMode  : Attenuation mode reported, NONE for no attenuation
+    quiet      : Do not send autonomous messages
+    """
+    switch = SwitchModel(ports, name, dict(user.split(':', 1) for user in users), attenMode, not quiet)
+    simulator = Simulator((bind, port), switch, latency / 1000.0, jitter / 1000.0)
+    logging.getLogger('tl1_simulator').info('simulating %d port switch %s on %s:%d', ports, name, bind or '*', port)
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.server_close()
+
+if __name__ == '__main__':
+    """
+    Main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bind', action='store', default='',
+                        help='Address to listen on; default: all')
+    parser.add_argument('--port', action='store', type=int, default=3082,
+                        help='TL1 port; default: 3082')
+    parser.add_argument('--ports', action='store', type=int, default=384,
+                        help='Port count of the simulated switch; default: 384')
+    parser.add_argument('--user', action='append', default=[],
+                        help='user:password allowed to log in, repeatable; default: admin:root')
+    parser.add_argument('--latency', action='store', type=float, default=0,
+                        help='Response time in ms; default: 0')
+    parser.add_argument('--jitter', action='store', type=float, default=0,
+                        help='Random extra response time in ms; default: 0')
+    parser.add_argument('--name', action='store', default='SIMULATOR',
+                        help='Target identifier in the message headers; default: SIMULATOR')
+    parser.add_argument('--atten-mode', action='store', default='ABSOLUTE',
+                        help='Attenuation mode reported, NONE for no attenuation; default: ABSOLUTE')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Do not send autonomous messages')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    simulate(args.bind, args.port, args.ports, args.user or ['admin:root'], args.latency, args.jitter,
+             args.name, args.atten_mode, args.quiet)
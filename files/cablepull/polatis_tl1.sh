@@ -147,7 +147,13 @@ if [[ -z ${HOST} ]] | [[ -z ${PORT} ]] |[[ -z ${USER} ]] | [[ -z ${PASSWD} ]] |
   usage
 fi
 
-expect ./cablepull/polatis.exp $HOST $PORT $USER $PASSWD $CMD
+# use the sessions kept open by a running tl1_broker.py, otherwise log in with expect
+BROKER_SOCKET=${POLATIS_BROKER_SOCKET:-/tmp/.polatis-tl1-broker.sock}
+if [[ -S ${BROKER_SOCKET} ]]; then
+    python2 ./cablepull/polatis/tl1_broker.py client --socket ${BROKER_SOCKET} -h $HOST -p $PORT -u $USER -pw $PASSWD -c "$CMD"
+else
+    expect ./cablepull/polatis.exp $HOST $PORT $USER $PASSWD $CMD
+fi
 if [[ $? != 0 ]]
 then
     exit 1
@@ -21,53 +21,108 @@ function add_lun {
     assert_fail $RC 0 "PASSED = LUN ${LUN} could be attached via ${PORTTYPE} adaptor ${ADAPTOR} and remote port ${WWPN}"
 }
 	
+# Root of the sysfs tree the zfcp states are read from, a fake tree can be given for testing
+SYSFSROOT=${SYSFSROOT:-/sys}
+
+# Reads the state of every remote port and SCSI device of all zfcp adaptors from sysfs in one pass,
+# with shell builtins only, into ZFCPPORTSTATE[adaptor:wwpn] and ZFCPLUNSTATE[adaptor:wwpn:lun]
+function scanZfcpStatus {
+    declare -gA ZFCPPORTSTATE=() ZFCPLUNSTATE=()
+    local DEVICE ADAPTOR RPORT SDEV WWPN LUN STATE
+    for DEVICE in ${SYSFSROOT}/bus/ccw/drivers/zfcp/*.*.*; do
+        ADAPTOR=${DEVICE##*/}
+        for RPORT in ${DEVICE}/host*/rport-*/fc_remote_ports/rport-*; do
+            [ -r ${RPORT}/port_name ] || continue
+            read -r WWPN < ${RPORT}/port_name
+            read -r STATE < ${RPORT}/port_state
+            ZFCPPORTSTATE[${ADAPTOR}:${WWPN,,}]=${STATE,,}
+        done
+        for SDEV in ${DEVICE}/host*/rport-*/target*/*:*:*:*; do
+            [ -r ${SDEV}/fcp_lun ] || continue
+            read -r WWPN < ${SDEV}/wwpn
+            read -r LUN < ${SDEV}/fcp_lun
+            read -r STATE < ${SDEV}/state
+            ZFCPLUNSTATE[${ADAPTOR}:${WWPN,,}:${LUN,,}]=${STATE,,}
+        done
+    done
+}
+
+function checkZfcpPath {
+    ADAPTOR=$1
+    WWPN=$2
+    [ "${ZFCPPORTSTATE[${ADAPTOR}:${WWPN,,}]}" == "online" ]
+    assert_fail $? 0 "Target port $WWPN is working and online with login from $ADAPTOR"
+    for LUN in ${SCSILUNS[@]}; do
+        echo "verifying status of $ADAPTOR:$WWPN:$LUN"
+        [ "${ZFCPLUNSTATE[${ADAPTOR}:${WWPN,,}:${LUN,,}]}" == "running" ]
+        assert_fail $? 0 "LUN ${LUN} is running via port $WWPN on adaptor ${ADAPTOR}"
+        echo
+    done
+}
+
 function checkZfcpStatus {
+    scanZfcpStatus
     if [ $STORAGETYPE == "V7K" ]; then
         # This is to handle V7K LUN attachments in that way, that WWPNs are matched to zfp devices alternately
-        for n in $(seq 0 $((${#ZFCPADAPTOR[@]}-1))); do
-            ADAPTOR=${ZFCPADAPTOR[$n]}
-            for m in $(seq $n ${#ZFCPADAPTOR[@]} $((${#STORAGEPORTS[@]}-1))); do
-                WWPN=${STORAGEPORTS[$m]}
-                lszfcp -Pa -b $ADAPTOR -p $WWPN | grep -i port_state | grep -q -i online
-                assert_fail $? 0 "Target port $WWPN is working and online with login from $ADAPTOR"
-                for LUN in ${SCSILUNS[@]}; do
-                    echo "verifying status of $ADAPTOR:$WWPN:$LUN"
-                    lszfcp -Da -b $ADAPTOR -p $WWPN -l $LUN | grep -w state | grep -q -i running
-                    assert_fail $? 0 "LUN ${LUN} is running via port $WWPN on adaptor ${ADAPTOR}"
-                    echo      
-                done
+        for ((n = 0; n < ${#ZFCPADAPTOR[@]}; n++)); do
+            for ((m = n; m < ${#STORAGEPORTS[@]}; m += ${#ZFCPADAPTOR[@]})); do
+                checkZfcpPath ${ZFCPADAPTOR[$n]} ${STORAGEPORTS[$m]}
             done
         done
     else  # DS8000 storage
         for ADAPTOR in ${ZFCPADAPTOR[@]}; do
             for WWPN in ${STORAGEPORTS[@]}; do
-                lszfcp -Pa -b $ADAPTOR -p $WWPN | grep -i port_state | grep -q -i online
-                assert_fail $? 0 "Target port $WWPN is working and online with login from $ADAPTOR"
-                for LUN in ${SCSILUNS[@]}; do
-                    echo "verifying status of $ADAPTOR:$WWPN:$LUN"
-                    lszfcp -Da -b $ADAPTOR -p $WWPN -l $LUN | grep -w state | grep -q -i running
-                    assert_fail $? 0 "LUN ${LUN} is running via port $WWPN on adaptor ${ADAPTOR}"
-                    echo      
-                 done
+                checkZfcpPath $ADAPTOR $WWPN
             done
         done
     fi
 }
 
+# Reads the channel paths of all DASDs from sysfs in one pass, with shell builtins only: the CHPIDs
+# of the paths in use (path_masks, or pim&pam&pom on older kernels) go to DASDCHPIDS[busid],
+# their count to DASDPATHS[busid], an offline DASD has none
+function scanDASDpaths {
+    declare -gA DASDPATHS=() DASDCHPIDS=()
+    local DEVICE BUSID ONLINE MASK PIM PAM POM CHPIDs i
+    for DEVICE in ${SYSFSROOT}/bus/ccw/drivers/dasd-eckd/*.*.* ${SYSFSROOT}/bus/ccw/drivers/dasd-fba/*.*.*; do
+        [ -r ${DEVICE}/online ] || continue
+        BUSID=${DEVICE##*/}
+        DASDPATHS[$BUSID]=0
+        DASDCHPIDS[$BUSID]=""
+        read -r ONLINE < ${DEVICE}/online
+        [ "$ONLINE" == "1" ] || continue
+        if [ -r ${DEVICE}/path_masks ]; then
+            read -r MASK REPLY < ${DEVICE}/path_masks
+            MASK=$(( 16#$MASK ))
+        else
+            read -r PIM PAM POM < ${DEVICE}/../pimpampom
+            MASK=$(( 16#$PIM & 16#$PAM & 16#$POM ))
+        fi
+        read -r -a CHPIDs < ${DEVICE}/../chpids
+        for ((i = 0; i < ${#CHPIDs[@]}; i++)); do
+            if (( MASK & (0x80 >> i) )); then
+                DASDCHPIDS[$BUSID]+=" ${CHPIDs[$i],,}"
+                DASDPATHS[$BUSID]=$(( ${DASDPATHS[$BUSID]} + 1 ))
+            fi
+        done
+        DASDCHPIDS[$BUSID]=${DASDCHPIDS[$BUSID]# }
+    done
+}
+
 function checkDASDpath {
 	myDASD=$1
-	lsdasd -l ${myDASD} |grep paths_in_use |cut -f 2 -d: |while read CHPIDs
-	do
-		CHPIDs_count=$(echo $CHPIDs |wc -w)
-		if [[ $CHPIDs_count -lt 2 ]]; then
-			assert_warn 1 0 "for ${myDASD} is only $CHPIDs channel paths online!"
-			exit 1
-		fi        
-	done    
+	# lsdasd takes c667 as well as 0.0.c667
+	[[ $myDASD == *.*.* ]] || myDASD=0.0.$myDASD
+	myDASD=${myDASD,,}
+	if [[ ${DASDPATHS[$myDASD]:-0} -lt 2 ]]; then
+		assert_warn 1 0 "for ${myDASD} is only ${DASDCHPIDS[$myDASD]} channel paths online!"
+		return 1
+	fi
 }
 
 function checkDASDpath_status () {
     if [[ -n $DASDs ]]; then
+      scanDASDpaths
       for DASD in $DASDs
       do
           echo "checkDASDpath $DASD"
@@ -79,24 +134,156 @@ function checkDASDpath_status () {
     fi
 }
 
+# Parses one multipath topology dump, of multipathd show topo or multipath -ll, into arrays with
+# the maps in MPMAPS, MPWWID[map], MPDM[map], MPHEADER[map] and MPMAPPATHS[map], the paths by
+# index in MPPATHDEV, MPPATHHCTL, MPPATHSTATE, MPPATHMAP, MPPATHGROUP, MPPATHADAPTOR and MPPATHWWPN,
+# the path group states in MPGROUPSTATE[map:group], and indexes to look them up:
+# MPBYWWID[wwid] and MPBYLUN[lun] give the map, MPBYDEV[sd], MPBYADAPTOR[adaptor] and
+# MPBYWWPN[wwpn] the path indexes, MPFAILED the failed, faulty or offline paths.
+# The dump is read from the file given, else multipathd show topo is run once; it is kept in MPTOPO.
+function readMultipathTopo {
+    if [ -n "$1" ]; then
+        MPTOPO=$(< $1)
+    else
+        MPTOPO=$(multipathd show topo)
+    fi
+    declare -ga MPMAPS=() MPPATHDEV=() MPPATHHCTL=() MPPATHSTATE=() MPPATHMAP=() MPPATHGROUP=() MPPATHADAPTOR=() MPPATHWWPN=() MPFAILED=()
+    declare -gA MPWWID=() MPDM=() MPHEADER=() MPMAPPATHS=() MPGROUPSTATE=() MPBYWWID=() MPBYLUN=() MPBYDEV=() MPBYADAPTOR=() MPBYWWPN=()
+    local LINE FIELDS STATE MAP GROUP HCTL LUN ADAPTOR WWPN i=0
+    while read -r LINE; do
+        if [[ $LINE =~ ([0-9#]+:[0-9#]+:[0-9#]+:([0-9#]+))\ +([^ ]+)\ +[0-9#]+:[0-9#]+\ +(.*)$ ]]; then
+            HCTL=${BASH_REMATCH[1]}
+            MPPATHHCTL[$i]=$HCTL
+            MPPATHDEV[$i]=${BASH_REMATCH[3]}
+            STATE=(${BASH_REMATCH[4]})
+            MPPATHSTATE[$i]=${STATE[*]}
+            MPPATHMAP[$i]=$MAP
+            MPPATHGROUP[$i]=$GROUP
+            MPMAPPATHS[$MAP]+="$i "
+            MPBYDEV[${BASH_REMATCH[3]}]=$i
+            if [[ ${BASH_REMATCH[2]} != "#" ]]; then
+                # the SCSI LUN is the FCP LUN with its first two 16 bit levels swapped
+                printf -v LUN '0x%04x%04x00000000' $(( ${BASH_REMATCH[2]} & 0xffff )) $(( ${BASH_REMATCH[2]} >> 16 & 0xffff ))
+                MPBYLUN[$LUN]=$MAP
+            fi
+            if [ -r ${SYSFSROOT}/class/scsi_device/${HCTL}/device/hba_id ]; then
+                read -r ADAPTOR < ${SYSFSROOT}/class/scsi_device/${HCTL}/device/hba_id
+                read -r WWPN < ${SYSFSROOT}/class/scsi_device/${HCTL}/device/wwpn
+                MPPATHADAPTOR[$i]=$ADAPTOR
+                MPPATHWWPN[$i]=${WWPN,,}
+                MPBYADAPTOR[$ADAPTOR]+="$i "
+                MPBYWWPN[${WWPN,,}]+="$i "
+            fi
+            [[ ${MPPATHSTATE[$i]} =~ failed|faulty|offline ]] && MPFAILED+=($i)
+            i=$((i+1))
+        elif [[ $LINE == *policy=* ]]; then
+            GROUP=$((GROUP+1))
+            MPGROUPSTATE[$MAP:$GROUP]=${LINE#*policy=}
+            MPGROUPSTATE[$MAP:$GROUP]="policy=${MPGROUPSTATE[$MAP:$GROUP]}"
+        elif [[ -n $LINE && $LINE != size=* && $LINE != [\|\`]* ]]; then
+            LINE=${LINE#create: }
+            LINE=${LINE#reload: }
+            LINE=${LINE//[()]/}
+            FIELDS=($LINE)
+            MAP=${FIELDS[0]}
+            GROUP=0
+            MPMAPS+=($MAP)
+            MPHEADER[$MAP]=${FIELDS[*]:0:5}
+            if [[ ${FIELDS[2]} == dm-* ]]; then
+                MPWWID[$MAP]=${FIELDS[1]}
+                MPDM[$MAP]=${FIELDS[2]}
+            else
+                MPWWID[$MAP]=${FIELDS[0]}
+                MPDM[$MAP]=${FIELDS[1]}
+            fi
+            MPBYWWID[${MPWWID[$MAP]}]=$MAP
+            MPMAPPATHS[$MAP]=""
+        fi
+    done <<< "$MPTOPO"
+}
+
+# Parses the topology like readMultipathTopo and lists its failed, faulty or offline paths,
+# returns 1 if there are any
+function checkMultipathPaths {
+    readMultipathTopo "$@"
+    local i
+    for i in ${MPFAILED[@]}; do
+        echo "${MPPATHMAP[$i]} ${MPPATHHCTL[$i]} ${MPPATHDEV[$i]} ${MPPATHSTATE[$i]}"
+    done
+    [ ${#MPFAILED[@]} -eq 0 ]
+}
+
+# Lists the paths that differ between two saved topology dumps, one line per path:
+# "+ map H:C:T:L dev state" for a new path, "- ..." for a gone one and "~ ... old state -> new state"
+function diffMultipathTopo {
+    local -A BEFORE=()
+    local KEY i
+    readMultipathTopo $1
+    for i in ${!MPPATHDEV[@]}; do
+        BEFORE["${MPPATHMAP[$i]} ${MPPATHHCTL[$i]} ${MPPATHDEV[$i]}"]=${MPPATHSTATE[$i]}
+    done
+    readMultipathTopo $2
+    for i in ${!MPPATHDEV[@]}; do
+        KEY="${MPPATHMAP[$i]} ${MPPATHHCTL[$i]} ${MPPATHDEV[$i]}"
+        if [[ ! -v "BEFORE[$KEY]" ]]; then
+            echo "+ $KEY ${MPPATHSTATE[$i]}"
+        elif [[ ${BEFORE[$KEY]} != "${MPPATHSTATE[$i]}" ]]; then
+            echo "~ $KEY ${BEFORE[$KEY]} -> ${MPPATHSTATE[$i]}"
+        fi
+        unset "BEFORE[$KEY]"
+    done
+    for KEY in "${!BEFORE[@]}"; do
+        echo "- $KEY ${BEFORE[$KEY]}"
+    done
+}
+
+# Path failover monitor: startFailoverMonitor records the multipath and zfcp path events in the
+# background until the calling script ends, failoverMark adds a toggle of the cable pull to them
+# and stopFailoverMonitor prints the detection and recovery times of every cycle
+function startFailoverMonitor {
+    FAILOVERMONITOR=$(dirname ${BASH_SOURCE[0]})/cablepull/polatis/failover_monitor.py
+    FAILOVEREVENTS=${1:-failover_$(date +%Y%m%d_%H%M%S)_$$.jsonl}
+    python2 ${FAILOVERMONITOR} --events ${FAILOVEREVENTS} run --sysfs ${SYSFSROOT} --parent $$ &
+    FAILOVERPID=$!
+    echo "recording path events to ${FAILOVEREVENTS}"
+}
+
+function failoverMark {
+    [ -n "${FAILOVERPID}" ] || return 0
+    echo "{\"time\": $(date +%s.%N), \"kind\": \"mark\", \"action\": \"$1\", \"target\": \"$2\"}" >> ${FAILOVEREVENTS}
+}
+
+function stopFailoverMonitor {
+    [ -n "${FAILOVERPID}" ] || return 0
+    kill ${FAILOVERPID}
+    wait ${FAILOVERPID}
+    FAILOVERPID=""
+    python2 ${FAILOVERMONITOR} --events ${FAILOVEREVENTS} report
+}
+
 function createDeviceList {
 
     if [ ! -e ${DEVICE_LIST} ]; then
+        readMultipathTopo
         if [ "${STORAGETYPE}" == "DS8K" ]; then
             LUNLIST=($(cat 00_config-file | grep  "^declare -a SCSILUNS" | sed 's/declare -a SCSILUNS=//g;s/(//g;s/)//'))
             for LUN in ${LUNLIST[@]}; do
-                STRING=$(echo ${LUN:4:2};echo ${LUN:8:2})
-                SUBSTRING=$(echo ${STRING//[[:space:]]}\))
-                LINE=$(multipathd show topo | grep ${SUBSTRING} | sort -k 1 | sed 's/(//g;s/)//g;s/create: //g')
-                MPATHDEV=/dev/disk/by-id/dm-name-$(echo ${LINE} | awk '{print $1" "$2" "$3" "$4" "$5}')
+                MAP=${MPBYLUN[${LUN,,}]}
+                if [ -z "${MAP}" ]; then
+                    assert_warn 1 0 "LUN ${LUN} has no multipath device"
+                    continue
+                fi
+                MPATHDEV=/dev/disk/by-id/dm-name-${MPHEADER[$MAP]}
                 echo ${MPATHDEV} >> ${DEVICE_LIST}
                 echo ${MPATHDEV} added...
             done
         else
-            multipathd show topo | grep "IBM" | grep -v "IBM,2107" | sort -k 1 | sed 's/(//g;s/)//g;s/create: //g' 1>multipath.txt 2>&1
+            for MAP in ${MPMAPS[@]}; do
+                [[ ${MPHEADER[$MAP]} == *IBM* && ${MPHEADER[$MAP]} != *IBM,2107* ]] && echo ${MPHEADER[$MAP]}
+            done | sort -k 1 1>multipath.txt 2>&1
             cat multipath.txt |
             while read LINE; do
-                MPATHDEV=/dev/disk/by-id/dm-name-$(echo ${LINE} | awk '{print $1" "$2" "$3" "$4" "$5}')
+                MPATHDEV=/dev/disk/by-id/dm-name-${LINE}
                 echo ${MPATHDEV} >> ${DEVICE_LIST}
                 echo ${MPATHDEV} added...
              done